@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Parsing of block minimizer logs by da_block_convergence: the previous per-line re.compile and
+#  fixed (members, patterns, 10000) storage versus the single compiled expression with growable
+#  member columns.
+#
+#  A synthetic log with the norm reduction and cost function lines of every iteration for all
+#  members, mixed with unrelated output, is written and parsed both ways.
+#
+#  Usage: python benchmarks/bench_block_convergence.py [--members 80] [--iterations 500]
+#                                                      [--noise-lines 50]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import numpy as np
+import os
+import re
+import tempfile
+import time
+
+import fv3jeditools.diag_da_block_convergence as da_block_convergence
+import fv3jeditools.log_parser as log_parser
+
+# --------------------------------------------------------------------------------------------------
+
+def create_log(filename, members, iterations, noise_lines):
+
+    rng = np.random.default_rng(0)
+    with open(filename, 'w') as fh:
+        fh.write("Minimizer algorithm=DRPBlockLanczos\n")
+        for iteration in range(1, iterations+1):
+            for n in range(noise_lines):
+                fh.write("OOPS_TRACE[0] State::State done iteration "+str(iteration)+"\n")
+            norm = rng.uniform(0.1, 1.0, members)
+            cost = rng.uniform(1.0e4, 1.0e5, members)
+            fh.write("   Norm reduction all members ("+str(iteration)+") = "+
+                     ", ".join('{:.6e}'.format(value) for value in norm)+"\n")
+            fh.write("   Quadratic cost function all members: J ("+str(iteration)+") = "+
+                     ", ".join('{:.6e}'.format(value) for value in cost)+"\n")
+
+# --------------------------------------------------------------------------------------------------
+
+def previous(filename, members):
+
+    file = open(filename, "r")
+    for line in file:
+        if "Minimizer algorithm=" in line:
+            break
+
+    search_patterns = ["   Norm reduction all members .",
+                       "   Quadratic cost function all members: J ."]
+    matches = []
+    for line in file:
+        for search_pattern in search_patterns:
+            reg = re.compile(search_pattern)
+            if bool(re.match(reg, line.rstrip())):
+                matches.append(line.rstrip())
+    file.close()
+
+    maxiterations = 10000
+    count = np.zeros(len(search_patterns), dtype=int)
+    stats = np.zeros((members, len(search_patterns), maxiterations))
+    for search_pattern in search_patterns:
+        index = [i for i, s in enumerate(search_patterns) if search_pattern in s]
+        for match in matches:
+            reg = re.compile(search_pattern)
+            if bool(re.match(reg, match)):
+                x = match.split()[-members:]
+                x2 = [sub.replace(',' , '') for sub in x]
+                for member in range(members):
+                    stats[member,index,count[index]]=x2[member]
+                count[index] = count[index] + 1
+
+    return np.sum(stats)
+
+# --------------------------------------------------------------------------------------------------
+
+def current(filename, members):
+
+    consumer = da_block_convergence.DaBlockConvergenceConsumer()
+    log_parser.parse_log(filename, [consumer])
+
+    return sum(np.sum(consumer.values(statistic)) for statistic in consumer.statistics)
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=80, help="Number of ensemble members")
+    parser.add_argument("--iterations", type=int, default=500, help="Number of iterations")
+    parser.add_argument("--noise-lines", type=int, default=50,
+                        help="Unrelated lines written before each iteration")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        filename = os.path.join(tmpdir, 'block.log')
+        create_log(filename, args.members, args.iterations, args.noise_lines)
+        print(f"log size       {os.path.getsize(filename)/1024**2:8.1f} MB")
+
+        timings = {}
+        for name, function in [('previous', previous), ('current', current)]:
+            start = time.perf_counter()
+            total = function(filename, args.members)
+            timings[name] = time.perf_counter() - start
+            print(f"{name:<14} {timings[name]:8.3f} s   (checksum {total:.6e})")
+
+        print(f"speedup        {timings['previous']/timings['current']:8.1f} x")
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
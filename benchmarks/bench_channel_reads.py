@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Per-channel strided reads versus one whole-matrix read per group for radiance files.
+#
+#  A synthetic IODA-like file with ObsValue and hofx groups of shape (nlocs, nchans) is written and
+#  the omb of every channel is computed both ways.
+#
+#  Usage: python benchmarks/bench_channel_reads.py [--nlocs 20000] [--nchans 500]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import netCDF4
+import numpy as np
+import os
+import tempfile
+import time
+
+import fv3jeditools.ioda_reader as ioda_reader
+import fv3jeditools.utils as utils
+
+variable = 'brightness_temperature'
+
+# --------------------------------------------------------------------------------------------------
+
+def create_file(filename, nlocs, nchans):
+
+    fh = netCDF4.Dataset(filename, 'w')
+    fh.createDimension('nlocs', nlocs)
+    fh.createDimension('nchans', nchans)
+    fh.createVariable('nchans', 'i4', ('nchans',))[:] = np.arange(1, nchans+1)
+    rng = np.random.default_rng(0)
+    for group in ['ObsValue', 'hofx']:
+        var = fh.createGroup(group).createVariable(variable, 'f4', ('nlocs', 'nchans'), zlib=True)
+        var[:] = 250.0 + rng.standard_normal((nlocs, nchans), dtype=np.float32)
+    fh.close()
+
+# --------------------------------------------------------------------------------------------------
+
+def per_channel(filename, nchans):
+
+    fh = netCDF4.Dataset(filename)
+    total = 0.0
+    for channel in range(1, nchans+1):
+        total += np.sum(utils.read_ioda_variable(fh, 'omb', variable, channel))
+    fh.close()
+    return total
+
+# --------------------------------------------------------------------------------------------------
+
+def whole_matrix(filename, nchans):
+
+    fh = ioda_reader.IodaReader(filename)
+    block = utils.read_ioda_variable(fh, 'omb', variable)
+    total = 0.0
+    for channel_idx in range(nchans):
+        total += np.sum(block[:, channel_idx])
+    fh.close()
+    return total
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nlocs", type=int, default=20000, help="Number of locations")
+    parser.add_argument("--nchans", type=int, default=500, help="Number of channels")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        filename = os.path.join(tmpdir, 'radiance.nc4')
+        create_file(filename, args.nlocs, args.nchans)
+
+        timings = {}
+        for name, function in [('per-channel', per_channel), ('whole-matrix', whole_matrix)]:
+            start = time.perf_counter()
+            total = function(filename, args.nchans)
+            timings[name] = time.perf_counter() - start
+            print(f"{name:<14} {timings[name]:8.3f} s   (checksum {total:.6e})")
+
+        print(f"speedup        {timings['per-channel']/timings['whole-matrix']:8.1f} x")
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
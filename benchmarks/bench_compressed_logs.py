@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Parsing throughput of plain text logs versus logs compressed with gzip, bzip2, xz and zstd
+#  (zstd only when the zstandard package is installed), decompressed on the fly by log_parser.
+#
+#  A synthetic JEDI-like log with minimizer iteration reports and an OOPS_STATS timing table, mixed
+#  with unrelated output, is written in each format and parsed with the da_convergence and
+#  log_timing consumers. With --memory the peak Python memory of each parse is also measured
+#  (tracemalloc slows the parse down, so the throughput is then not representative).
+#
+#  Usage: python benchmarks/bench_compressed_logs.py [--size-mb 200] [--memory]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fv3jeditools.diag_da_convergence as da_convergence
+import fv3jeditools.diag_log_timing as log_timing
+import fv3jeditools.log_parser as log_parser
+
+# --------------------------------------------------------------------------------------------------
+
+def create_log(filename, size_mb):
+
+    noise = "OOPS_TRACE[0] oops::State::State starting with some typical verbose output\n"*40
+    iteration = 0
+    with open(filename, 'w') as fh:
+        while fh.tell() < size_mb*1024*1024:
+            iteration = iteration + 1
+            fh.write(noise)
+            fh.write("DRIPCG end of iteration "+str(iteration)+"\n")
+            fh.write("  Gradient reduction ("+str(iteration)+") = 0.5\n")
+            fh.write("  Norm reduction ("+str(iteration)+") = 0.25\n")
+            fh.write("\n")
+            fh.write("  Quadratic cost function: J   ("+str(iteration)+") = 1000.0\n")
+            fh.write("  Quadratic cost function: Jb  ("+str(iteration)+") = 100.0\n")
+            fh.write("  Quadratic cost function: JoJc("+str(iteration)+") = 900.0\n")
+        fh.write("OOPS_STATS ------------------------- Timing Statistics ---------------\n")
+        fh.write("OOPS_STATS Name : total (ms) count time/call (ms)\n")
+        fh.write("OOPS_STATS header\n")
+        for method in range(50):
+            fh.write("OOPS_STATS oops::Method"+str(method)+" : "+str(100.0*method)+" 10 : "+
+                     str(10.0*method)+"\n")
+        fh.write("OOPS_STATS oops::Total : 1.0 1 : 1.0\n")
+        fh.write("OOPS_STATS ------------------------- Timing Statistics ---------------\n")
+
+# --------------------------------------------------------------------------------------------------
+
+def compress(filename, compression):
+
+    compressed = filename+'.'+compression
+    if compression == 'zstd':
+        import zstandard
+        with open(filename, 'rb') as fin, open(compressed, 'wb') as fout:
+            zstandard.ZstdCompressor().copy_stream(fin, fout)
+        return compressed
+
+    opener = {'gzip': gzip.open, 'bzip2': bz2.open, 'xz': lzma.open}[compression]
+    with open(filename, 'rb') as fin, opener(compressed, 'wb') as fout:
+        while True:
+            chunk = fin.read(16*1024*1024)
+            if not chunk:
+                break
+            fout.write(chunk)
+
+    return compressed
+
+# --------------------------------------------------------------------------------------------------
+
+def parse(filename):
+
+    consumers = [da_convergence.DaConvergenceConsumer(), log_timing.LogTimingConsumer()]
+    log_parser.parse_log(filename, consumers)
+
+    return len(consumers[0].minimizers['DRIPCG']['grad_red'])
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=200, help="Size of the plain text log")
+    parser.add_argument("--memory", action='store_true', help="Measure the peak memory")
+    args = parser.parse_args()
+
+    compressions = ['gzip', 'bzip2', 'xz']
+    try:
+        import zstandard
+        compressions.append('zstd')
+    except ImportError:
+        print("zstandard is not installed, zstd is not benchmarked")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        filename = os.path.join(tmpdir, 'jedi.log')
+        create_log(filename, args.size_mb)
+        size = os.path.getsize(filename)
+
+        files = [('plain', filename)]
+        for compression in compressions:
+            files.append((compression, compress(filename, compression)))
+
+        print(f"{'format':<8} {'file MB':>9} {'time s':>8} {'MB/s':>8} {'iterations':>11}" +
+              (f" {'peak MB':>8}" if args.memory else ""))
+        for name, path in files:
+            if args.memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            iterations = parse(path)
+            elapsed = time.perf_counter() - start
+            line = f"{name:<8} {os.path.getsize(path)/1024**2:9.1f} {elapsed:8.2f} " + \
+                   f"{size/1024**2/elapsed:8.1f} {iterations:11d}"
+            if args.memory:
+                line = line + f" {tracemalloc.get_traced_memory()[1]/1024**2:8.1f}"
+                tracemalloc.stop()
+            print(line)
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
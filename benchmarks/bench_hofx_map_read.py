@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Read throughput of hofx_map: the former per-element list appends versus the two-pass
+#  preallocated read of diag_hofx_map (read_hofx_locations and read_hofx_data).
+#
+#  Usage: python benchmarks/bench_hofx_map_read.py [--files 8] [--nlocs 500000]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import netCDF4
+import numpy as np
+import os
+import tempfile
+import time
+
+import fv3jeditools.diag_hofx_map as diag_hofx_map
+import fv3jeditools.ioda_reader as ioda_reader
+
+field = 'air_temperature'
+
+# --------------------------------------------------------------------------------------------------
+
+def create_files(tmpdir, nfiles, nlocs):
+
+    rng = np.random.default_rng(0)
+    filenames = []
+    for n in range(nfiles):
+        filename = os.path.join(tmpdir, 'aircraft_hofx_'+str(n).zfill(4)+'.nc4')
+        fh = netCDF4.Dataset(filename, 'w')
+        fh.createDimension('nlocs', nlocs)
+        meta = fh.createGroup('MetaData')
+        meta.createVariable('longitude', 'f4', ('nlocs',))[:] = rng.uniform(-180, 180, nlocs)
+        meta.createVariable('latitude', 'f4', ('nlocs',))[:] = rng.uniform(-90, 90, nlocs)
+        obs = 250.0 + rng.standard_normal(nlocs)
+        obs[::97] = 1.0e+31
+        fh.createGroup('ObsValue').createVariable(field, 'f4', ('nlocs',))[:] = obs
+        fh.close()
+        filenames.append(filename)
+
+    return filenames
+
+# --------------------------------------------------------------------------------------------------
+
+def read_appends(hofx_files):
+
+    # The read path hofx_map used before the preallocated arrays
+
+    odat = []
+    lons = []
+    lats = []
+    for hofx_file in hofx_files:
+        fh = netCDF4.Dataset(hofx_file)
+        odat_proc = fh.groups['ObsValue'].variables[field][:]
+        lons_proc = fh.groups['MetaData'].variables['longitude'][:]
+        lats_proc = fh.groups['MetaData'].variables['latitude'][:]
+        for m in range(len(odat_proc)):
+            odat.append(odat_proc[m])
+            lons.append(lons_proc[m])
+            lats.append(lats_proc[m])
+        fh.close()
+
+    missing = 9.0e+30
+    odat = np.where(np.abs(odat) < missing, odat, float("NaN"))
+    obarray = np.empty([len(odat), 3])
+    obarray[:, 0] = odat
+    obarray[:, 1] = lons
+    obarray[:, 2] = lats
+
+    return obarray[:, 0]
+
+# --------------------------------------------------------------------------------------------------
+
+def read_preallocated(hofx_files):
+
+    # The read path of hofx_map, locations and data into arrays sized from all the files
+
+    readers = [ioda_reader.open_ioda(hofx_file) for hofx_file in hofx_files]
+    lons, lats = diag_hofx_map.read_hofx_locations(readers)
+    odat = diag_hofx_map.read_hofx_data(readers, 'ObsValue', field)
+    for fh in readers:
+        fh.close()
+
+    return odat
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=8, help="Number of files")
+    parser.add_argument("--nlocs", type=int, default=500000, help="Locations per file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        hofx_files = create_files(tmpdir, args.files, args.nlocs)
+        nobs = args.files*args.nlocs
+
+        for name, function in [('list appends', read_appends), ('preallocated', read_preallocated)]:
+            start = time.perf_counter()
+            odat = function(hofx_files)
+            seconds = time.perf_counter() - start
+            print(f"{name:<14} {seconds:8.3f} s   {nobs/seconds/1.0e6:8.2f} Mobs/s   "
+                  f"(mean {np.nanmean(odat, dtype=np.float64):.4f})")
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
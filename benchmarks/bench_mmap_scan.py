@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Line-by-line parsing of a plain text log versus the memory-mapped scan of log_parser, which
+#  searches the whole buffer with a compiled bytes expression and only decodes the matched lines.
+#
+#  A synthetic verbose JEDI-like log, mostly unrelated output with a minimizer iteration report
+#  every few thousand lines and an OOPS_STATS timing table at the end, is written and parsed with
+#  the da_convergence and log_timing consumers both ways. The log is written to --directory, which
+#  needs room for it (5 GB by default).
+#
+#  Usage: python benchmarks/bench_mmap_scan.py [--size-gb 5] [--directory /tmp] [--keep]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import tempfile
+import time
+
+import fv3jeditools.diag_da_convergence as da_convergence
+import fv3jeditools.diag_log_timing as log_timing
+import fv3jeditools.log_parser as log_parser
+
+# --------------------------------------------------------------------------------------------------
+
+def create_log(filename, size_gb):
+
+    noise = "OOPS_TRACE[0] oops::Variational::execute State::State ObsSpace::ObsSpace done\n"*2000
+    size = size_gb*1024**3
+    iteration = 0
+    with open(filename, 'w') as fh:
+        while fh.tell() < size:
+            iteration = iteration + 1
+            fh.write(noise)
+            fh.write("DRIPCG end of iteration "+str(iteration)+"\n"
+                     "  Gradient reduction ("+str(iteration)+") = 0.5\n"
+                     "  Norm reduction ("+str(iteration)+") = 0.25\n"
+                     "\n"
+                     "  Quadratic cost function: J   ("+str(iteration)+") = 1000.0\n"
+                     "  Quadratic cost function: Jb  ("+str(iteration)+") = 100.0\n"
+                     "  Quadratic cost function: JoJc("+str(iteration)+") = 900.0\n")
+        fh.write("OOPS_STATS ------------------------- Timing Statistics ---------------\n")
+        fh.write("OOPS_STATS Name : total (ms) count time/call (ms)\n")
+        fh.write("OOPS_STATS header\n")
+        for method in range(50):
+            fh.write("OOPS_STATS oops::Method"+str(method)+" : "+str(100.0*method)+" 10 : "+
+                     str(10.0*method)+"\n")
+        fh.write("OOPS_STATS oops::Total : 1.0 1 : 1.0\n")
+        fh.write("OOPS_STATS ------------------------- Timing Statistics ---------------\n")
+
+# --------------------------------------------------------------------------------------------------
+
+def parse(filename, mapped):
+
+    consumers = [da_convergence.DaConvergenceConsumer(), log_timing.LogTimingConsumer()]
+    log_parser.parse_log(filename, consumers, mapped=mapped)
+
+    return len(consumers[0].minimizers['DRIPCG']['grad_red']), len(consumers[1].raw_timings)
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-gb", type=float, default=5, help="Size of the synthetic log")
+    parser.add_argument("--directory", default=None, help="Directory for the synthetic log")
+    parser.add_argument("--keep", action='store_true', help="Keep the synthetic log")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.directory)
+    filename = os.path.join(directory, 'jedi.log')
+
+    try:
+
+        start = time.perf_counter()
+        create_log(filename, args.size_gb)
+        size = os.path.getsize(filename)
+        print(f"wrote {size/1024**3:.2f} GB in {time.perf_counter()-start:.1f} s")
+
+        timings = {}
+        for name, mapped in [('line-by-line', False), ('mmap', True)]:
+            start = time.perf_counter()
+            iterations, methods = parse(filename, mapped)
+            timings[name] = time.perf_counter() - start
+            print(f"{name:<14} {timings[name]:8.2f} s {size/1024**2/timings[name]:9.1f} MB/s   "
+                  f"({iterations} iterations, {methods} methods)")
+
+        print(f"speedup        {timings['line-by-line']/timings['mmap']:8.1f} x")
+
+    finally:
+        if args.keep:
+            print("log kept in", filename)
+        else:
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rmdir(directory)
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
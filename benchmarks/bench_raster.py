@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Rendering time of one level of a cube-sphere field with raster.py: one PolyCollection per tile
+#  built from the projected vertex arrays, versus the former one Polygon patch per cell with its
+#  own Geodetic transform. The setup (projected cells, figure and coastlines) is done once per
+#  rendering process and is timed separately from the plot of a level.
+#
+#  The grid is a synthetic equiangular gnomonic cube-sphere, so no fv3grid file is needed. The
+#  patch version is only timed with --patches and is very slow above C48.
+#
+#  Usage: python benchmarks/bench_raster.py [--resolutions 48,96,192] [--patches]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.patches as mpatches
+import matplotlib.pyplot as plt
+import numpy as np
+import cartopy.crs as ccrs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src', 'raster'))
+import raster
+
+# --------------------------------------------------------------------------------------------------
+
+def gnomonic_grid(npx):
+
+    # Vertices (6, npx+1, npx+1) in degrees of an equiangular gnomonic cube-sphere
+
+    angle = np.tan(np.linspace(-np.pi/4, np.pi/4, npx+1))
+    a, b = np.meshgrid(angle, angle)
+    one = np.ones_like(a)
+    faces = [(one, a, b), (-a, one, b), (-one, -a, b), (a, -one, b), (-b, a, one), (b, a, -one)]
+
+    vlons = np.zeros((6, npx+1, npx+1))
+    vlats = np.zeros((6, npx+1, npx+1))
+    for itile, (x, y, z) in enumerate(faces):
+        vlons[itile] = np.degrees(np.arctan2(y, x))
+        vlats[itile] = np.degrees(np.arctan2(z, np.sqrt(x**2 + y**2)))
+
+    return vlons, vlats
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_patches(vlons, vlats, fld_level, projection, cmap, norm, output):
+
+    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(projection=projection))
+    ax.set_global()
+    ax.coastlines()
+    ny = fld_level.shape[1]
+    nx = fld_level.shape[2]
+    for itile in range(0, 6):
+        for iy in range(0, ny):
+            for ix in range(0, nx):
+                xy = [[vlons[itile,iy+0,ix+0], vlats[itile,iy+0,ix+0]],
+                      [vlons[itile,iy+0,ix+1], vlats[itile,iy+0,ix+1]],
+                      [vlons[itile,iy+1,ix+1], vlats[itile,iy+1,ix+1]],
+                      [vlons[itile,iy+1,ix+0], vlats[itile,iy+1,ix+0]]]
+                ax.add_patch(mpatches.Polygon(xy=xy, closed=True,
+                                              facecolor=cmap(norm(fld_level[itile,iy,ix])),
+                                              transform=ccrs.Geodetic()))
+    plt.savefig(output + ".png", format="png", dpi=300)
+    plt.close(fig)
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolutions", default="48,96,192", help="Cube-sphere resolutions")
+    parser.add_argument("--patches", action='store_true', help="Also time one patch per cell")
+    args = parser.parse_args()
+
+    projection = ccrs.Orthographic(raster.lonview, raster.latview)
+    cmap = copy.copy(plt.get_cmap("viridis"))
+    cmap.set_bad('gray', 1)
+    norm = plt.Normalize(vmin=-1.0, vmax=1.0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        output = os.path.join(tmpdir, 'level')
+        print(f"{'grid':<6} {'cells':>9} {'setup s':>8} {'plot s':>8}" +
+              (f" {'patches s':>10}" if args.patches else ""))
+
+        for npx in map(int, args.resolutions.split(',')):
+
+            vlons, vlats = gnomonic_grid(npx)
+            centers = np.radians(0.25*(vlons[:,:-1,:-1] + vlons[:,1:,:-1] +
+                                       vlons[:,:-1,1:] + vlons[:,1:,1:]))
+            fld_level = np.sin(3.0*centers)
+
+            start = time.perf_counter()
+            raster.init_plot(vlons, vlats)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            raster.plot_level(fld_level, "viridis", -1.0, 1.0, "C"+str(npx), output)
+            plot = time.perf_counter() - start
+            plt.close(raster.plot_state["fig"])
+
+            line = f"C{npx:<5} {6*npx*npx:9d} {build:8.2f} {plot:8.2f}"
+            if args.patches:
+                start = time.perf_counter()
+                plot_patches(vlons, vlats, fld_level, projection, cmap, norm, output)
+                line = line + f" {time.perf_counter() - start:10.2f}"
+            print(line)
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Conversion of winds to streamfunction and velocity potential with spectral_uv2psichi (needs
+#  shtns): the former per-level getpsichi loop, scaling the grids, versus getpsichi_levels, which
+#  scales in spectral space, for a number of OpenMP threads of the shtns transforms.
+#
+#  The default grid is the 1536x768 Gaussian grid used for C384 members, with 127 levels of random
+#  winds, which takes about 3.6 GB of memory (use --nlevs to reduce it).
+#
+#  Usage: python benchmarks/bench_spectral_uv2psichi.py [--nlons 1536] [--nlats 768] [--nlevs 127]
+#                                                      [--threads 1,4,8]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src',
+                                'Workflows', 'EMC', 'ConvertEnsColdStarts_To_BVars'))
+import spectral_uv2psichi
+
+# --------------------------------------------------------------------------------------------------
+
+def loop_levels(gaugrid, u, v):
+
+    # Former conversion, one level at a time with the grids scaled after the synthesis
+
+    psi = np.empty(u.shape, np.float32)
+    chi = np.empty(u.shape, np.float32)
+    for nlev in range(u.shape[0]):
+        psispec, chispec = gaugrid._shtns.analys(u[nlev].astype(np.float64),
+                                                 v[nlev].astype(np.float64))
+        psi[nlev] = gaugrid.rsphere*gaugrid.spectogrd(psispec)
+        chi[nlev] = gaugrid.rsphere*gaugrid.spectogrd(chispec)
+
+    return psi, chi
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nlons", type=int, default=1536, help="Number of longitudes")
+    parser.add_argument("--nlats", type=int, default=768, help="Number of Gaussian latitudes")
+    parser.add_argument("--nlevs", type=int, default=127, help="Number of levels")
+    parser.add_argument("--threads", default="1,4,8", help="Numbers of OpenMP threads")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    u = rng.standard_normal((args.nlevs, args.nlats, args.nlons)).astype(np.float32)
+    v = rng.standard_normal((args.nlevs, args.nlats, args.nlons)).astype(np.float32)
+
+    start = time.perf_counter()
+    gaugrid = spectral_uv2psichi.Spharmt(args.nlons, args.nlats, args.nlats//2, nthreads=1)
+    print(f"plan           {time.perf_counter() - start:8.2f} s")
+
+    start = time.perf_counter()
+    psi_loop, chi_loop = loop_levels(gaugrid, u, v)
+    reference = time.perf_counter() - start
+    print(f"level loop     {reference:8.2f} s")
+
+    for nthreads in map(int, args.threads.split(',')):
+        gaugrid = spectral_uv2psichi.Spharmt(args.nlons, args.nlats, args.nlats//2,
+                                             nthreads=nthreads)
+        start = time.perf_counter()
+        psi, chi = gaugrid.getpsichi_levels(u, v)
+        elapsed = time.perf_counter() - start
+        error = max(np.max(np.abs(psi - psi_loop))/np.max(np.abs(psi_loop)),
+                    np.max(np.abs(chi - chi_loop))/np.max(np.abs(chi_loop)))
+        print(f"{nthreads:3d} thread(s)   {elapsed:8.2f} s  speedup {reference/elapsed:5.1f} x  "
+              f"max relative difference {error:.1e}")
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+#  Startup time of the fv3jeditools applications.
+#
+#  Each case is run in a fresh interpreter, resolving the application through the registry the same
+#  way the fv3jeditools.x driver does. The lightweight applications must not import cartopy.
+#
+#  Usage: python benchmarks/bench_startup.py [--repeat 5]
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+heavy_modules = ['cartopy', 'matplotlib', 'netCDF4', 'scipy']
+
+statement = """
+import sys
+import fv3jeditools
+for app_name in {apps}:
+    fv3jeditools.get_application(app_name)
+print(','.join(m for m in {heavy} if m in sys.modules))
+"""
+
+# --------------------------------------------------------------------------------------------------
+
+def time_startup(apps, repeat):
+
+    code = statement.format(apps=apps, heavy=heavy_modules)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), proc.stdout.decode().strip()
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per case")
+    args = parser.parse_args()
+
+    import fv3jeditools
+
+    cases = [('stage_files', ['stage_files']),
+             ('tar', ['tar']),
+             ('untar', ['untar']),
+             ('remove', ['remove']),
+             ('all applications', sorted(fv3jeditools.application_modules))]
+
+    failed = False
+    print(f"{'case':<20} {'median (s)':>10}   heavy modules imported")
+    for name, apps in cases:
+        seconds, loaded = time_startup(apps, args.repeat)
+        print(f"{name:<20} {seconds:10.3f}   {loaded if loaded else '-'}")
+        if name != 'all applications' and 'cartopy' in loaded:
+            failed = True
+
+    if failed:
+        sys.exit("ERROR: a lightweight application imported cartopy")
+
+# --------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
 #import matplotlib
 #matplotlib.use('Agg')
+import argparse
 import numpy as np
 from netCDF4 import Dataset
-import sys
-import os
 import shtns
 #import matplotlib.pyplot as plt
 
@@ -13,9 +12,11 @@ class Spharmt(object):
     atmospheric models.  Provides an interface to shtns compatible
     with pyspharm (pyspharm.googlecode.com).
     """
-    def __init__(self,nlons,nlats,ntrunc,rsphere=6.3712e6,gridtype='gaussian'):
+    def __init__(self,nlons,nlats,ntrunc,rsphere=6.3712e6,gridtype='gaussian',nthreads=0):
+        # nthreads is the number of OpenMP threads of each transform (0: all cpus)
         self._shtns = shtns.sht(ntrunc, ntrunc, 1, \
-                                norm=shtns.sht_orthonormal+shtns.SHT_NO_CS_PHASE)
+                                norm=shtns.sht_orthonormal+shtns.SHT_NO_CS_PHASE,
+                                nthreads=nthreads)
         if gridtype == 'gaussian':
             #self._shtns.set_grid(nlats,nlons,shtns.sht_gauss_fly|shtns.SHT_PHI_CONTIGUOUS,1.e-10)
             self._shtns.set_grid(nlats,nlons,shtns.sht_quick_init|shtns.SHT_PHI_CONTIGUOUS,1.e-10)
@@ -28,7 +29,7 @@ class Spharmt(object):
         self.ntrunc = ntrunc
         self.nlm = self._shtns.nlm
         self.degree = self._shtns.l
-        self.lap = -self.degree*(self.degree+1.0).astype(np.complex)
+        self.lap = -self.degree*(self.degree+1.0).astype(complex)
         self.invlap = np.zeros(self.lap.shape, self.lap.dtype)
         self.invlap[1:] = 1./self.lap[1:]
         self.rsphere = rsphere
@@ -48,33 +49,59 @@ class Spharmt(object):
         vrtspec, divspec = self._shtns.analys(u, v)
         return self.lap*self.rsphere*vrtspec, self.lap*self.rsphere*divspec
     def getpsichi(self,u,v):
+        """compute streamfunction and velocity potential from wind vector"""
         psispec, chispec = self._shtns.analys(u, v)
-        return self.rsphere*self.spectogrd(psispec), self.rsphere*self.spectogrd(chispec)
+        # scaling the nlm coefficients is cheaper than scaling the nlats*nlons grids
+        return self.spectogrd(self.rsphere*psispec), self.spectogrd(self.rsphere*chispec)
         #vrtspec, divspec = self.getvrtdivspec(u, v)
         #psispec = self.invlap*vrtspec; chispec = self.invlap*divspec
         #return self.spectogrd(psispec), self.spectogrd(chispec)
+    def getpsichi_levels(self,u,v):
+        """
+        compute streamfunction and velocity potential from wind vector
+        for all levels of (nlevs, nlats, nlons) arrays, with one vector
+        analysis and two scalar syntheses per level stored in the
+        float32 outputs. masked arrays are filled with their
+        fill value. the transforms are spread over the OpenMP threads
+        given to the constructor: the python wrapper of shtns holds the
+        GIL and does not expose its batched (shtns_set_many) transforms,
+        so levels cannot be batched or threaded from python.
+        """
+        nlevs = u.shape[0]
+        psi = np.empty((nlevs,self.nlats,self.nlons), np.float32)
+        chi = np.empty((nlevs,self.nlats,self.nlons), np.float32)
+        for nlev in range(nlevs):
+            psi[nlev], chi[nlev] = self.getpsichi(
+                np.ascontiguousarray(np.ma.filled(u[nlev]), dtype=np.float64),
+                np.ascontiguousarray(np.ma.filled(v[nlev]), dtype=np.float64))
+        return psi, chi
     def getgrad(self,divspec):
-    	"""compute gradient vector from spectral coeffs"""
-    	vrtspec = np.zeros(divspec.shape, dtype=np.complex)
-    	u,v = self._shtns.synth(vrtspec,divspec)
-    	return u/rsphere, v/rsphere
+        """compute gradient vector from spectral coeffs"""
+        vrtspec = np.zeros(divspec.shape, dtype=complex)
+        u,v = self._shtns.synth(vrtspec,divspec)
+        return u/self.rsphere, v/self.rsphere
 
-filename = sys.argv[1]
-nc = Dataset(filename,'a')
-u = nc['ugrd'][:].squeeze().astype(np.float)
-v = nc['vgrd'][:].squeeze().astype(np.float)
-psi = nc.createVariable('psigrd',np.float32, ('time', 'pfull', 'grid_yt', 'grid_xt'))
-chi = nc.createVariable('chigrd',np.float32, ('time', 'pfull', 'grid_yt', 'grid_xt'))
-nlevs,nlats,nlons = u.shape
-re = 6.3712e6 # radius of earth
-gaugrid = Spharmt(nlons,nlats,nlats//2)
-for nlev in range(nlevs):
-    psig, chig = gaugrid.getpsichi(u[nlev],v[nlev])
-    psi[0,nlev,...]=psig
-    chi[0,nlev,...]=chig
-    #if nlev == 55:
-    #    plt.imshow(chi)
-    #    plt.colorbar()
-    #    plt.savefig('chi.png')
-    #    raise SystemExit
-nc.close()
+def main():
+    parser = argparse.ArgumentParser(description='Add streamfunction (psigrd) and velocity '
+                                     'potential (chigrd) computed from ugrd/vgrd to a Gaussian '
+                                     'grid file')
+    parser.add_argument('filename', help='File with ugrd and vgrd, modified in place')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Number of OpenMP threads of the transforms (default: 0, all cpus '
+                        'or OMP_NUM_THREADS)')
+    args = parser.parse_args()
+
+    nc = Dataset(args.filename,'a')
+    u = nc['ugrd'][:].squeeze()
+    v = nc['vgrd'][:].squeeze()
+    nlevs,nlats,nlons = u.shape
+    gaugrid = Spharmt(nlons,nlats,nlats//2,nthreads=args.threads)
+    psig, chig = gaugrid.getpsichi_levels(u,v)
+    psi = nc.createVariable('psigrd',np.float32, ('time', 'pfull', 'grid_yt', 'grid_xt'))
+    chi = nc.createVariable('chigrd',np.float32, ('time', 'pfull', 'grid_yt', 'grid_xt'))
+    psi[0,...]=psig
+    chi[0,...]=chig
+    nc.close()
+
+if __name__ == "__main__":
+    main()
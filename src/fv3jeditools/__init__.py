@@ -1,18 +1,20 @@
 # -*- coding: utf-8 -*-
 __path__ = __import__('pkgutil').extend_path(__path__, __name__)
 
-from .diag_da_block_convergence import *
-from .diag_da_convergence import *
-from .diag_field_plot import *
-from .diag_hofx_innovations import *
-from .diag_hofx_map import *
-from .diag_log_timing import *
-from .diag_obs_scatter import *
-from .gsidiag_to_ioda import *
-from .parse_file_datetime import *
-from .remove import *
-from .stage_files import *
-from .tar import *
-from .untar import *
+import importlib
+
 from .utils import *
 from .utils_datetime import *
+from .applications import *
+
+# Applications and their modules are imported on first access, e.g. fv3jeditools.hofx_map, so that
+# importing the package does not pull in the plotting and netCDF dependencies.
+def __getattr__(name):
+
+    if name in application_modules:
+        return get_application(name)
+
+    if name in application_modules.values():
+        return importlib.import_module('.'+name, __name__)
+
+    raise AttributeError("module '"+__name__+"' has no attribute '"+name+"'")
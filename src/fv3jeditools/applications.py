@@ -0,0 +1,87 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import copy
+import importlib
+import sys
+
+import fv3jeditools.utils as utils
+
+__all__ = ['application_modules', 'get_application', 'run_application']
+
+# --------------------------------------------------------------------------------------------------
+## @package applications
+#
+#  Registry of the applications that can be triggered with "application name: <name>". Only the
+#  module implementing the requested application is imported, so lightweight applications such as
+#  tar or stage_files do not pay for importing cartopy, matplotlib, netCDF4 or scipy.
+#
+#  To add an application add its name and the module (within fv3jeditools) that implements it.
+#
+# --------------------------------------------------------------------------------------------------
+
+application_modules = {
+  "da_block_convergence": "diag_da_block_convergence",
+  "da_convergence": "diag_da_convergence",
+  "ensemble_statistics": "ensemble_statistics",
+  "femps_convergence": "diag_femps_convergence",
+  "field_plot": "diag_field_plot",
+  "gsidiag_to_ioda": "gsidiag_to_ioda",
+  "hofx_innovations": "diag_hofx_innovations",
+  "hofx_map": "diag_hofx_map",
+  "log_diagnostics": "diag_log_diagnostics",
+  "log_timing": "diag_log_timing",
+  "log_timing_trend": "diag_log_timing_trend",
+  "obs_scatter": "diag_obs_scatter",
+  "parse_file_datetime": "parse_file_datetime",
+  "pipeline": "pipeline",
+  "remove": "remove",
+  "stage_files": "stage_files",
+  "tar": "tar",
+  "untar": "untar"
+}
+
+# --------------------------------------------------------------------------------------------------
+
+def get_application(app_name):
+
+    # Return the function implementing the application, importing only the module it lives in
+
+    try:
+        module_name = application_modules[app_name]
+    except:
+        utils.abort('\''+app_name+'\' is not in the application registry')
+
+    module = importlib.import_module('fv3jeditools.'+module_name)
+    application = getattr(module, app_name)
+
+    # As with the star imports this replaces, the package attribute refers to the application
+    # rather than to the module when the two share a name (e.g. fv3jeditools.tar)
+    setattr(sys.modules['fv3jeditools'], app_name, application)
+
+    return application
+
+# --------------------------------------------------------------------------------------------------
+
+def run_application(app_name, datetime, app_conf):
+
+    # Run an application and report the outcome as (success, message) rather than exiting, so that
+    # a failure does not take down other cycles or pipeline steps running in the same process
+
+    try:
+        get_application(app_name)(datetime, copy.deepcopy(app_conf))
+        success, message = True, ''
+    except SystemExit as e:
+        success, message = False, str(e.code)
+    except Exception as e:
+        success, message = False, repr(e)
+
+    # Processes are reused between applications so release any figures that were left open
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    return success, message
+
+# --------------------------------------------------------------------------------------------------
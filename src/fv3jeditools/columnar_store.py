@@ -0,0 +1,124 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+import os
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package columnar_store
+#
+#  Append-only table kept in a directory with one raw binary file per column, e.g. the timing of
+#  every method for every cycle. Rows are only ever appended, so adding a cycle does not rewrite
+#  what is already stored, and reading a column is a single np.fromfile.
+#
+#  Columns are declared with a numpy dtype. Columns declared with dtype str hold their values as
+#  int32 codes into a dictionary of the distinct strings, kept in <column>.dict with one string per
+#  line, which is also append-only.
+#
+#  If an append is interrupted some columns can be longer than others. Only the rows present in
+#  every column are returned when reading, and the next append first trims the longer columns.
+#
+# --------------------------------------------------------------------------------------------------
+
+class ColumnarStore(object):
+
+    def __init__(self, path, columns):
+
+        # columns is a dictionary of column name to dtype (a numpy dtype or str)
+
+        self.path = path
+        self.columns = columns
+        utils.createPath(path)
+
+    def _column_file(self, name):
+
+        return os.path.join(self.path, name+'.bin')
+
+    def _dtype(self, name):
+
+        return np.dtype(np.int32) if self.columns[name] is str else np.dtype(self.columns[name])
+
+    def _dictionary(self, name):
+
+        dictionary_file = os.path.join(self.path, name+'.dict')
+        if not os.path.exists(dictionary_file):
+            return []
+        with open(dictionary_file) as fh:
+            return fh.read().splitlines()
+
+    def rows(self):
+
+        # Number of complete rows
+
+        sizes = []
+        for name in self.columns:
+            column_file = self._column_file(name)
+            size = os.path.getsize(column_file) if os.path.exists(column_file) else 0
+            sizes.append(size // self._dtype(name).itemsize)
+
+        return min(sizes)
+
+    def read(self):
+
+        # Dictionary of column name to array holding all the rows, str columns are decoded
+
+        rows = self.rows()
+
+        table = {}
+        for name in self.columns:
+            column_file = self._column_file(name)
+            if os.path.exists(column_file):
+                values = np.fromfile(column_file, dtype=self._dtype(name), count=rows)
+            else:
+                values = np.zeros(0, dtype=self._dtype(name))
+            if self.columns[name] is str:
+                values = np.array(self._dictionary(name), dtype=object)[values] if rows > 0 \
+                         else np.zeros(0, dtype=object)
+            table[name] = values
+
+        return table
+
+    def append(self, table):
+
+        # Append rows given as a dictionary of column name to array, all columns must be given
+
+        lengths = set(len(table[name]) for name in self.columns)
+        if len(lengths) != 1:
+            utils.abort('ColumnarStore: all columns must have the same number of rows')
+        if lengths == {0}:
+            return
+
+        # Drop the rows of an interrupted append
+        rows = self.rows()
+        for name in self.columns:
+            column_file = self._column_file(name)
+            if os.path.exists(column_file):
+                with open(column_file, 'r+b') as fh:
+                    fh.truncate(rows*self._dtype(name).itemsize)
+
+        for name in self.columns:
+
+            values = table[name]
+
+            # Encode strings, new strings are added to the dictionary
+            if self.columns[name] is str:
+                dictionary = self._dictionary(name)
+                codes = {string: code for code, string in enumerate(dictionary)}
+                new = []
+                for value in values:
+                    if value not in codes:
+                        codes[value] = len(codes)
+                        new.append(value)
+                if new:
+                    with open(os.path.join(self.path, name+'.dict'), 'a') as fh:
+                        fh.write(''.join(value+'\n' for value in new))
+                values = [codes[value] for value in values]
+
+            with open(self._column_file(name), 'ab') as fh:
+                np.asarray(values, dtype=self._dtype(name)).tofile(fh)
+
+# --------------------------------------------------------------------------------------------------
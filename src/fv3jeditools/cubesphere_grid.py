@@ -0,0 +1,183 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import hashlib
+import json
+import netCDF4
+import numpy as np
+import os
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package cubesphere_grid
+#
+#  Cube-sphere grids read from the fv3grid_cNNNN.nc4 files written by the fv3-jedi geometry test,
+#  which hold the longitudes and latitudes in radians of the (6, npx+1, npx+1) cell vertices.
+#
+#  read_grid returns the vertices and the cell centers in degrees as float32 arrays. The first
+#  read of a grid file decodes the netCDF file, converts the vertices to degrees, derives the
+#  centers and stores the four arrays as .npy files in a cache directory. Later reads memory-map
+#  these files, so only the parts of the grid that are used are read from disk, and processes
+#  rendering from the same grid share the pages.
+#
+#  Each grid file has its own cache entry, named after the resolution and its path. The entry
+#  records the size, modification time and sha1 checksum of the grid file. When the size or time
+#  changed the checksum is computed again and the entry is rebuilt if the contents differ.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Directory of the grid cache, can be set with FV3JEDITOOLS_GRID_CACHE
+default_cache_path = os.environ.get("FV3JEDITOOLS_GRID_CACHE",
+                                    os.path.join(os.path.expanduser("~"), ".cache", "fv3jeditools",
+                                                 "grids"))
+
+# Arrays of a cache entry
+grid_arrays = ['vlons', 'vlats', 'lons', 'lats']
+
+# Version of the cache entries, to be increased when their contents change
+cache_version = 1
+
+# --------------------------------------------------------------------------------------------------
+
+def grid_file(resolution, grid_path):
+
+    # Name of the grid file of a resolution, e.g. fv3grid_c0384.nc4
+
+    return os.path.join(grid_path, "fv3grid_c"+str(resolution).zfill(4)+".nc4")
+
+# --------------------------------------------------------------------------------------------------
+
+def _checksum(filename):
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(16*1024*1024), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+# --------------------------------------------------------------------------------------------------
+
+def cell_centers(vlons, vlats):
+
+    # Centers of the cells in degrees, the normalised mean of the unit vectors of the four vertices,
+    # which is not affected by the longitude jump at the date line or by the poles
+
+    lon = np.radians(np.asarray(vlons, dtype=np.float64))
+    lat = np.radians(np.asarray(vlats, dtype=np.float64))
+    xyz = np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)], axis=-1)
+    center = xyz[..., :-1, :-1, :] + xyz[..., :-1, 1:, :] + xyz[..., 1:, 1:, :] + \
+             xyz[..., 1:, :-1, :]
+
+    lons = np.degrees(np.arctan2(center[..., 1], center[..., 0]))
+    lats = np.degrees(np.arctan2(center[..., 2], np.hypot(center[..., 0], center[..., 1])))
+
+    return lons, lats
+
+# --------------------------------------------------------------------------------------------------
+
+def _build_entry(source, entry_path, key):
+
+    # Decode the grid file and write the arrays of its cache entry
+
+    print(" cubesphere_grid: caching "+source+" in "+entry_path)
+
+    fgrid = netCDF4.Dataset(source, "r")
+    vlons = np.degrees(fgrid["vlons"][:,:,:]).astype(np.float32)
+    vlats = np.degrees(fgrid["vlats"][:,:,:]).astype(np.float32)
+    fgrid.close()
+    lons, lats = cell_centers(vlons, vlats)
+
+    os.makedirs(entry_path, exist_ok=True)
+    arrays = {'vlons': vlons, 'vlats': vlats, 'lons': lons.astype(np.float32),
+              'lats': lats.astype(np.float32)}
+
+    # Written to temporary files first so concurrent readers never see partial files, the key is
+    # written last and marks the entry as complete
+    for name in grid_arrays:
+        filename = os.path.join(entry_path, name+'.npy')
+        with open(filename+'.'+str(os.getpid()), 'wb') as fh:
+            np.save(fh, np.ma.filled(arrays[name], np.nan))
+        os.replace(filename+'.'+str(os.getpid()), filename)
+    _write_key(entry_path, key)
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_key(entry_path):
+
+    try:
+        with open(os.path.join(entry_path, 'key.json')) as fh:
+            return json.load(fh)
+    except Exception:
+        return None
+
+# --------------------------------------------------------------------------------------------------
+
+def _write_key(entry_path, key):
+
+    filename = os.path.join(entry_path, 'key.json')
+    with open(filename+'.'+str(os.getpid()), 'w') as fh:
+        json.dump(key, fh)
+    os.replace(filename+'.'+str(os.getpid()), filename)
+
+# --------------------------------------------------------------------------------------------------
+
+def grid_entry(resolution, grid_path, cache_path=None):
+
+    # Directory and key of the cache entry of a grid file, the entry is built or rebuilt first if
+    # it does not match the grid file
+
+    source = os.path.abspath(grid_file(resolution, grid_path))
+    if not os.path.exists(source):
+        utils.abort('cubesphere_grid: grid file '+source+' not found')
+
+    if cache_path is None:
+        cache_path = default_cache_path
+    entry_path = os.path.join(os.path.expandvars(cache_path), "c"+str(resolution).zfill(4)+"_"+
+                              hashlib.sha1(source.encode()).hexdigest()[:16])
+
+    # Check the entry against the grid file, the checksum is only computed when the file changed
+    stat = os.stat(source)
+    key = _read_key(entry_path)
+    if key is None or key['version'] != cache_version:
+        key = {'grid file': source, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+               'sha1': _checksum(source), 'version': cache_version}
+        _build_entry(source, entry_path, key)
+    elif key['size'] != stat.st_size or key['mtime'] != stat.st_mtime_ns:
+        sha1 = _checksum(source)
+        rebuild = sha1 != key['sha1']
+        key.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1})
+        if rebuild:
+            _build_entry(source, entry_path, key)
+        else:
+            _write_key(entry_path, key)
+
+    return entry_path, key
+
+# --------------------------------------------------------------------------------------------------
+
+def read_grid(resolution, grid_path, cache_path=None, cache=True):
+
+    # Vertices (6, npx+1, npx+1) and centers (6, npx, npx) of the grid in degrees, as float32
+    # arrays memory-mapped from the cache
+
+    if not cache:
+        source = os.path.abspath(grid_file(resolution, grid_path))
+        if not os.path.exists(source):
+            utils.abort('cubesphere_grid: grid file '+source+' not found')
+        fgrid = netCDF4.Dataset(source, "r")
+        vlons = np.degrees(fgrid["vlons"][:,:,:]).astype(np.float32)
+        vlats = np.degrees(fgrid["vlats"][:,:,:]).astype(np.float32)
+        fgrid.close()
+        lons, lats = cell_centers(vlons, vlats)
+        return vlons, vlats, lons.astype(np.float32), lats.astype(np.float32)
+
+    entry_path, key = grid_entry(resolution, grid_path, cache_path)
+
+    return tuple(np.load(os.path.join(entry_path, name+'.npy'), mmap_mode='r')
+                 for name in grid_arrays)
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,160 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import netCDF4
+import numpy as np
+import os
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package cubesphere_reader
+#
+#  Reader for fields on the cube-sphere written by FV3 and fv3-jedi, in either of the two layouts:
+#
+#  gfs  | one file per tile, name.tile1.nc to name.tile6.nc, variables (Time, zaxis, yaxis, xaxis)
+#  geos | a single file with the tiles along the nf dimension, variables (time, lev, nf, Ydim, Xdim)
+#
+#  read_field returns the requested levels of all six tiles in one (6, nz, ny, nx) float32 array,
+#  with NaN where the file has missing values. The array is allocated once and filled in place.
+#  Variables without a level dimension (e.g. surface pressure) are returned with nz = 1.
+#
+#  Levels are read as contiguous hyperslabs, one read per run of consecutive levels, rather than
+#  with a list of level indices which netCDF4 turns into a read per point. The tiles are read one
+#  after the other, since netCDF4 with HDF5 is not thread-safe, and each file is closed after it is
+#  read. A base field to subtract, e.g. to plot an increment, is read tile by tile into the same
+#  tile slice and subtracted in place.
+#
+# --------------------------------------------------------------------------------------------------
+
+def tile_file(filepath, itile):
+
+    # File of a tile (0 to 5) in the gfs layout, e.g. fv_core.res.nc -> fv_core.res.tile1.nc
+
+    return filepath.replace(".nc", ".tile"+str(itile+1)+".nc")
+
+# --------------------------------------------------------------------------------------------------
+
+def file_layout(filepath, variable):
+
+    # Layout of a file, geos when the variable has an nf dimension, gfs when the tiles are in
+    # separate files
+
+    if os.path.exists(filepath):
+        with netCDF4.Dataset(filepath, "r") as fh:
+            if variable in fh.variables and 'nf' in fh.variables[variable].dimensions:
+                return 'geos'
+    if os.path.exists(tile_file(filepath, 0)):
+        return 'gfs'
+
+    utils.abort('cubesphere_reader: cannot find '+variable+' in '+filepath+' or its tile files')
+
+# --------------------------------------------------------------------------------------------------
+
+def level_runs(levels):
+
+    # Runs of consecutive levels as (position in levels, first level index from 0, number of levels)
+
+    runs = []
+    for position, level in enumerate(levels):
+        if runs and level-1 == runs[-1][1]+runs[-1][2]:
+            runs[-1][2] = runs[-1][2] + 1
+        else:
+            runs.append([position, level-1, 1])
+
+    return [tuple(run) for run in runs]
+
+# --------------------------------------------------------------------------------------------------
+
+def _tile_source(filepath, layout, itile, has_levels=True):
+
+    # File and index prefix of a tile, the index of a variable without levels ignores the levels
+
+    if layout == 'geos':
+        if has_levels:
+            return filepath, lambda start, count: (0, slice(start, start+count), itile)
+        return filepath, lambda start, count: (0, slice(itile, itile+1))
+    if has_levels:
+        return tile_file(filepath, itile), lambda start, count: (0, slice(start, start+count))
+    return tile_file(filepath, itile), lambda start, count: (slice(0, 1),)
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_tile(out, itile, runs, has_levels, filepath, variable, layout, base_filepath,
+               base_variable):
+
+    # Read the runs of levels of one tile into out[itile], minus the base field if given
+
+    filename, index = _tile_source(filepath, layout, itile, has_levels)
+    with netCDF4.Dataset(filename, "r") as fh:
+        var = fh.variables[variable]
+        for position, start, count in runs:
+            out[itile, position:position+count] = np.ma.filled(var[index(start, count)], np.nan)
+
+    if base_filepath is not None:
+        filename, index = _tile_source(base_filepath, layout, itile, has_levels)
+        with netCDF4.Dataset(filename, "r") as fh:
+            var = fh.variables[base_variable]
+            for position, start, count in runs:
+                out[itile, position:position+count] -= np.ma.filled(var[index(start, count)],
+                                                                   np.nan)
+
+# --------------------------------------------------------------------------------------------------
+
+def field_levels(filepath, variable, layout=None):
+
+    # Number of levels of a variable, 0 for a variable without a level dimension
+
+    if layout is None:
+        layout = file_layout(filepath, variable)
+    filename, index = _tile_source(filepath, layout, 0)
+    with netCDF4.Dataset(filename, "r") as fh:
+        if variable not in fh.variables:
+            utils.abort('cubesphere_reader: '+variable+' not found in '+filename)
+        var = fh.variables[variable]
+        return var.shape[1] if var.ndim == (5 if layout == 'geos' else 4) else 0
+
+# --------------------------------------------------------------------------------------------------
+
+def read_field(filepath, variable, levels, layout=None, base_filepath=None, base_variable=None):
+
+    # Levels (numbered from 1) of a variable on all tiles as a (6, nz, ny, nx) float32 array,
+    # minus the same levels of base_variable (default variable) in base_filepath if given.
+    # Returns the array with the units and long name of the variable. levels is ignored for
+    # variables without a level dimension.
+
+    if layout is None:
+        layout = file_layout(filepath, variable)
+    if layout not in ['gfs', 'geos']:
+        utils.abort('cubesphere_reader: layout should be gfs or geos, not '+str(layout))
+    if base_variable is None:
+        base_variable = variable
+
+    # Shape and metadata from the first tile
+    filename, index = _tile_source(filepath, layout, 0)
+    with netCDF4.Dataset(filename, "r") as fh:
+        if variable not in fh.variables:
+            utils.abort('cubesphere_reader: '+variable+' not found in '+filename)
+        var = fh.variables[variable]
+        ny, nx = var.shape[-2:]
+        has_levels = var.ndim == (5 if layout == 'geos' else 4)
+        nlev = var.shape[1] if has_levels else 1
+        units = getattr(var, 'units', '')
+        long_name = getattr(var, 'long_name', variable)
+
+    levels = [int(level) for level in levels] if has_levels else [1]
+    if min(levels) < 1 or max(levels) > nlev:
+        utils.abort('cubesphere_reader: levels should be between 1 and '+str(nlev)+' for '+variable)
+    runs = level_runs(levels)
+
+    out = np.empty((6, len(levels), ny, nx), dtype=np.float32)
+
+    for itile in range(6):
+        _read_tile(out, itile, runs, has_levels, filepath, variable, layout, base_filepath,
+                   base_variable)
+
+    return out, units, long_name
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,155 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import glob
+import numpy as np
+import os
+import scipy.sparse
+import scipy.spatial
+
+import fv3jeditools.cubesphere_grid as cubesphere_grid
+
+# --------------------------------------------------------------------------------------------------
+## @package cubesphere_remap
+#
+#  Interpolation of cube-sphere fields to a regular lat/lon grid for quick-look plots.
+#
+#  The interpolation weights from the cube-sphere cell centers to the lat/lon points form a sparse
+#  matrix with one row per lat/lon point. Each row holds the inverse distance weights of the
+#  nearest cell centers, found with a k-d tree on the unit sphere. The matrix is built once for a
+#  grid file and a lat/lon grid and saved in a cache directory, after which remapping any number
+#  of levels and variables is a single sparse matrix product.
+#
+#  The lat/lon grid has nlon longitudes from -180 to 180 and nlat latitudes from -90 to 90, both
+#  ends included, so that contour plots close at the date line.
+#
+#  Cache entries are named after the grid cache entry of the grid file (see cubesphere_grid), the
+#  checksum of the grid file and the lat/lon grid, so a changed grid file gets new weights. The
+#  weights of the previous contents of the grid file are removed when the new ones are written.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Directory of the weights cache, can be set with FV3JEDITOOLS_REMAP_CACHE
+default_cache_path = os.environ.get("FV3JEDITOOLS_REMAP_CACHE",
+                                    os.path.join(os.path.expanduser("~"), ".cache", "fv3jeditools",
+                                                 "remap"))
+
+# Number of cell centers used for each lat/lon point
+default_neighbours = 4
+
+# --------------------------------------------------------------------------------------------------
+
+def _unit_vectors(lons, lats):
+
+    lon = np.radians(np.asarray(lons, dtype=np.float64).ravel())
+    lat = np.radians(np.asarray(lats, dtype=np.float64).ravel())
+
+    return np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)], axis=-1)
+
+# --------------------------------------------------------------------------------------------------
+
+def latlon_grid(nlon, nlat):
+
+    # Longitudes and latitudes of the lat/lon grid, each (nlat, nlon)
+
+    return np.meshgrid(np.linspace(-180.0, 180.0, nlon), np.linspace(-90.0, 90.0, nlat))
+
+# --------------------------------------------------------------------------------------------------
+
+def build_weights(lons, lats, target_lons, target_lats, neighbours=None):
+
+    # Sparse (number of targets, number of cells) inverse distance weights from the cells at
+    # lons/lats to the targets, cells are ordered as lons.ravel()
+
+    if neighbours is None:
+        neighbours = default_neighbours
+
+    tree = scipy.spatial.cKDTree(_unit_vectors(lons, lats))
+    distance, index = tree.query(_unit_vectors(target_lons, target_lats), k=neighbours)
+    distance = distance.reshape(len(distance), -1)
+    index = index.reshape(len(index), -1)
+
+    # A target on a cell center takes the value of the cell
+    weights = 1.0/np.maximum(distance, 1.0e-12)
+    weights = weights/np.sum(weights, axis=1, keepdims=True)
+
+    rows = np.repeat(np.arange(index.shape[0]), index.shape[1])
+
+    return scipy.sparse.csr_matrix((weights.ravel(), (rows, index.ravel())),
+                                   shape=(index.shape[0], np.asarray(lons).size))
+
+# --------------------------------------------------------------------------------------------------
+
+class CubeSphereRemap(object):
+
+    def __init__(self, resolution, grid_path, nlon=361, nlat=181, cache_path=None,
+                 grid_cache_path=None):
+
+        # Weights from the cube-sphere of a resolution, whose grid file is in grid_path, to a nlon
+        # by nlat lat/lon grid, read from the cache or built and saved to it. grid_cache_path is the
+        # cache of the grid arrays passed to cubesphere_grid.
+
+        self.resolution = resolution
+        self.nlon = nlon
+        self.nlat = nlat
+        self.lons, self.lats = latlon_grid(nlon, nlat)
+
+        if cache_path is None:
+            cache_path = default_cache_path
+        cache_path = os.path.expandvars(cache_path)
+
+        entry_path, key = cubesphere_grid.grid_entry(resolution, grid_path, grid_cache_path)
+        prefix = os.path.join(cache_path, os.path.basename(entry_path)+"_")
+        suffix = "_"+str(nlon)+"x"+str(nlat)+".npz"
+        filename = prefix+key['sha1'][:16]+suffix
+
+        if os.path.exists(filename):
+            self.weights = scipy.sparse.load_npz(filename)
+        else:
+            print(" cubesphere_remap: computing the weights from C"+str(resolution)+" to "+
+                  str(nlon)+"x"+str(nlat))
+            vlons, vlats, lons, lats = cubesphere_grid.read_grid(resolution, grid_path,
+                                                                 grid_cache_path)
+            self.weights = build_weights(lons, lats, self.lons, self.lats)
+
+            # Written to a temporary file first so concurrent readers never see partial files
+            os.makedirs(cache_path, exist_ok=True)
+            temporary = filename+'.'+str(os.getpid())+'.npz'
+            scipy.sparse.save_npz(temporary, self.weights)
+            os.replace(temporary, filename)
+
+            # Weights of the same grid file and lat/lon grid with another checksum are stale
+            for stale in glob.glob(glob.escape(prefix)+"?"*16+glob.escape(suffix)):
+                if stale != filename:
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+
+    def remap(self, field):
+
+        # Remap a (6, nz, ny, nx) or (6, ny, nx) field to (nz, nlat, nlon) or (nlat, nlon). Missing
+        # values (NaN) are left out and the weights of the other cells renormalised.
+
+        field = np.asarray(field)
+        levels = field.ndim == 4
+        if levels:
+            columns = np.moveaxis(field, 1, -1).reshape(-1, field.shape[1])
+        else:
+            columns = field.reshape(-1, 1)
+
+        valid = np.isfinite(columns)
+        if np.all(valid):
+            remapped = self.weights @ columns
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                remapped = (self.weights @ np.where(valid, columns, 0.0)) / \
+                           (self.weights @ valid.astype(columns.dtype))
+
+        remapped = np.moveaxis(remapped.reshape(self.nlat, self.nlon, -1), -1, 0)
+
+        return remapped if levels else remapped[0]
+
+# --------------------------------------------------------------------------------------------------
@@ -3,11 +3,13 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
+import array
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import re
 
+import fv3jeditools.log_parser as log_parser
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -20,22 +22,101 @@ import fv3jeditools.utils as utils
 #  log file    | The log file to parse the statistics from
 #  yscale      | Whether to use log or linear scale for the yaxis
 #  plot format | The extension used for the file name, png or pdf
+#  log cache   | Keep the statistics parsed from the log in a cache so the log is not parsed again
+#                when only the figure options change [false]
+#  log cache path | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the convergence
 #  statistics from the log of a variational data assimilation run, provided through the yaml.
 #  It will search for the Minimizer norm gradient, J, Jb, JoJc and GMRESR
 #
+#  The log is read with log_parser. The statistics lines are recognised by a single compiled
+#  expression and the values of each member are appended to growable columns, so there is no limit
+#  on the number of iterations or members.
 #
 # --------------------------------------------------------------------------------------------------
 
-def da_block_convergence(datetime, conf):
+class DaBlockConvergenceConsumer(log_parser.LogConsumer):
 
-    # Log file to parse
-    try:
-        log_file = conf['log file']
-    except:
-        utils.abort('\'log file\' must be present in the configuration')
+    # One expression for all the lines of interest, the named group that matched tells which
+    pattern = re.compile("(?:.*Minimizer algorithm=(?P<minimizer>.*))|"
+                         "(?:   (?:(?P<norm>Norm reduction all members)|"
+                         "(?P<cost>Quadratic cost function all members: J)) .)")
+
+    # Statistics, keyed by the name of their group in the pattern
+    statistics = ['norm', 'cost']
+
+    triggers = ["Minimizer algorithm=", "Norm reduction all members",
+                "Quadratic cost function all members: J"]
+
+    def __init__(self):
+
+        self.minimizer = None
+
+        # For each statistic a column of values per member, created at the first match
+        self.columns = {statistic: None for statistic in self.statistics}
+
+    def consume(self, line, following):
+
+        match = self.pattern.match(line.rstrip())
+        if match is None:
+            return
+
+        # Search for the type of minimizer used for the assimilation, statistics follow it
+        if self.minimizer is None:
+            if match.group('minimizer') is not None:
+                self.minimizer = match.group('minimizer').rstrip()
+            return
+
+        statistic = match.lastgroup
+        if statistic not in self.statistics:
+            return
+
+        # Values of all members, after the label and after the equals sign when there is one
+        values = line[match.end(statistic):].rsplit('=', 1)[-1].replace(',', ' ').split()
+
+        columns = self.columns[statistic]
+        if columns is None:
+            columns = [array.array('d') for value in values]
+            self.columns[statistic] = columns
+        elif len(values) != len(columns):
+            utils.abort('da_block_convergence: '+str(len(values))+' values found in a line '+
+                        'with '+str(len(columns))+' members: '+line.rstrip())
+
+        for column, value in zip(columns, values):
+            column.append(float(value))
+
+    def to_arrays(self):
+
+        arrays = {'minimizer': np.array('' if self.minimizer is None else self.minimizer)}
+        for statistic in self.statistics:
+            arrays[statistic] = self.values(statistic)
+        return arrays
+
+    def from_arrays(self, arrays):
+
+        self.minimizer = str(arrays['minimizer']) or None
+        for statistic in self.statistics:
+            values = arrays[statistic]
+            if values.size == 0:
+                self.columns[statistic] = None
+            else:
+                self.columns[statistic] = [array.array('d', row) for row in values]
+
+    def values(self, statistic):
+
+        # Array (members, iterations) of a statistic
+
+        columns = self.columns[statistic]
+        if columns is None:
+            return np.zeros((0, 0))
+
+        return np.array([np.frombuffer(column, dtype=np.float64) for column in columns])
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_da_block_convergence(datetime, conf, consumer, log_file):
 
     # Get the number of members
     try:
@@ -53,70 +134,24 @@ def da_block_convergence(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Replace datetime in logfile name
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-    log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
-
-
-    # Read file and gather norm information
-    print(" Reading convergence from ", log_file)
-
-    # Open the file ready for reading
-    if os.path.exists(log_file):
-        file = open(log_file, "r")
-    else:
-        utils.abort('Log file not found.')
 
-
-    # Search for the type of minimizer used for the assimilation
-    for line in file:
-        if "Minimizer algorithm=" in line:
-            minimizer = line.split('=')[1].rstrip()
-            break
-
-
-    # Patterns to search for from the file
-    search_patterns = []
-    search_patterns.append("   Norm reduction all members .")
-    search_patterns.append("   Quadratic cost function all members: J .") 
+    if consumer.minimizer is None:
+        utils.abort('Minimizer algorithm not found in the log file.')
 
     # Labels for the figures
     ylabels = []
-    ylabels.append(minimizer+" normalized gradient reduction")
+    ylabels.append(consumer.minimizer+" normalized gradient reduction")
     ylabels.append("Quadratic cost function J   ")
 
-    # Get all lines that match the search patterns
-    matches = []
-    for line in file:
-        for search_pattern in search_patterns:
-            reg = re.compile(search_pattern) 
-            if bool(re.match(reg, line.rstrip())):
-                matches.append(line.rstrip())
-
-    # Close the file
-    file.close()
- 
-    # Loop over stats to be searched on
-    maxiterations = 10000
-    count = np.zeros(len(search_patterns), dtype=int)
-    stats = np.zeros((members, len(search_patterns), maxiterations))
-    for search_pattern in search_patterns:
-
-        index = [i for i, s in enumerate(search_patterns) if search_pattern in s]
-
-        # Loop over the matches and fill stats
-        for match in matches:
-            reg = re.compile(search_pattern) 
-            if bool(re.match(reg, match)):
-                x = match.split()[-members:]
-                x2 = [sub.replace(',' , '') for sub in x]
-                for member in range(members):
-                    stats[member,index,count[index]]=x2[member]
-                count[index] = count[index] + 1
-
-
-    niter = count[0]
-    stat = np.zeros((members, niter))
+    # Values of the last members printed on each line
+    stats = []
+    for statistic in consumer.statistics:
+        values = consumer.values(statistic)
+        if values.shape[0] < members:
+            utils.abort('da_block_convergence: the log has '+str(values.shape[0])+
+                        ' members, less than the '+str(members)+' requested')
+        stats.append(values[-members:, :])
 
 
     # Create figures
@@ -134,19 +169,17 @@ def da_block_convergence(datetime, conf):
     except:
         plotformat = 'png'
 
-    for ylabel in ylabels:
+    for ylabel, stat in zip(ylabels, stats):
 
-        index = [i for i, s in enumerate(ylabels) if ylabel in s]
         savename = ylabel.lower().strip()
         savename = savename.replace(" ", "-")
         savename = savename+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat
         savename = os.path.join(output_path,savename)
         fig, ax = plt.subplots(figsize=(15, 7.5))
         for member in range(members):
-            stat[member,0:niter] = stats[member,index,0:niter]
-            stat_plot = stat[member,np.nonzero(stat[member,:])]
-            iter = np.arange(1, len(stat_plot[0])+1)
-            ax.plot(iter, stat_plot[0], linestyle='-', marker='x',label = 'member %s'%member) 
+            stat_plot = stat[member, np.nonzero(stat[member, :])[0]]
+            iter = np.arange(1, len(stat_plot)+1)
+            ax.plot(iter, stat_plot, linestyle='-', marker='x',label = 'member %s'%member)
         ax.tick_params(labelbottom=True, labeltop=False, labelleft=True, labelright=True)
         plt.title("JEDI variational assimilation convergence statistics | "+isodatestr)
         plt.legend()
@@ -156,5 +189,20 @@ def da_block_convergence(datetime, conf):
 
         print(" Saving figure as", savename, "\n")
         plt.savefig(savename)
+        plt.close(fig)
+
+# --------------------------------------------------------------------------------------------------
+
+def da_block_convergence(datetime, conf):
+
+    # Log file to parse
+    log_file = log_parser.log_file_name(datetime, conf)
+
+    # Read file and gather norm information
+    print(" Reading convergence from ", log_file)
+    consumer = DaBlockConvergenceConsumer()
+    log_parser.parse_log_configured(log_file, [consumer], conf)
+
+    plot_da_block_convergence(datetime, conf, consumer, log_file)
 
 # --------------------------------------------------------------------------------------------------
@@ -6,8 +6,8 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-import re
 
+import fv3jeditools.log_parser as log_parser
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -20,22 +20,75 @@ import fv3jeditools.utils as utils
 #  log file    | The log file to parse the statistics from
 #  yscale      | Whether to use log or linear scale for the yaxis
 #  plot format | The extension used for the file name, png or pdf
+#  follow      | Follow a log that is still being written, updating the figures as iterations
+#                complete [false]
+#  poll interval   | Seconds between reads of the log in follow mode [30]
+#  idle timeout    | Follow mode stops when the log has not grown for this many seconds [3600]
+#  checkpoint file | File recording how far the log has been parsed in follow mode, a restarted
+#                    follower resumes from it [<output path>/<log file name>.follow.json]
+#  log cache       | Keep the statistics parsed from the log in a cache so the log is not parsed again
+#                    when only the figure options change [false]
+#  log cache path  | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the convergence
 #  statistics from the log of a variational data assimilation run, provided through the yaml.
 #  It will search for the Minimizer norm gradient, J, Jb, JoJc and GMRESR
 #
+#  The log is read with log_parser. The consumer collects the statistics of every minimizer used
+#  in the run, e.g. DRIPCG and GMRESR, in the same pass.
+#
+#  In follow mode the statistics of each new iteration are printed as they appear in the log and
+#  the figures are redrawn, so a minimization that stalls or diverges is seen while the job runs.
+#
 #
 # --------------------------------------------------------------------------------------------------
 
-def da_convergence(datetime, conf):
+class DaConvergenceConsumer(log_parser.LogConsumer):
 
-    # Log file to parse
-    try:
-        log_file = conf['log file']
-    except:
-        utils.abort('\'log file\' must be present in the configuration')
+    # Each iteration report is the "end of iteration" line followed by the statistics
+    triggers = [" end of iteration "]
+    lookahead = 6
+
+    def __init__(self):
+
+        # Statistics for each minimizer in the order they appear in the log
+        self.minimizers = {}
+
+    def consume(self, line, following):
+
+        minimizer = line.split()[0]
+        stats = self.minimizers.setdefault(minimizer, {'grad_red': [], 'norm_red': [],
+                                                       'quad_j': [], 'quad_jb': [],
+                                                       'quad_JoJc': []})
+
+        if len(following) > 1:
+            stats['grad_red'].append(float(following[0].split()[-1]))
+            stats['norm_red'].append(float(following[1].split()[-1]))
+        if len(following) > 5 and following[3].split()[:1] == ['Quadratic']:
+            stats['quad_j'].append(float(following[3].split()[-1]))
+            stats['quad_jb'].append(float(following[4].split()[-1]))
+            stats['quad_JoJc'].append(float(following[5].split()[-1]))
+
+    def to_arrays(self):
+
+        arrays = {'minimizers': np.array(list(self.minimizers.keys()), dtype=str)}
+        for minimizer, stats in self.minimizers.items():
+            for name, values in stats.items():
+                arrays[minimizer+'|'+name] = np.array(values, dtype=np.float64)
+        return arrays
+
+    def from_arrays(self, arrays):
+
+        self.minimizers = {}
+        for minimizer in arrays['minimizers'].tolist():
+            self.minimizers[minimizer] = {name: arrays[minimizer+'|'+name].tolist()
+                                          for name in ['grad_red', 'norm_red', 'quad_j', 'quad_jb',
+                                                       'quad_JoJc']}
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_da_convergence(datetime, conf, consumer, log_file):
 
     # Get output path for plots
     try:
@@ -59,72 +112,30 @@ def da_convergence(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Replace datetime in logfile name
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-    log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
-
-
-    # Read file and gather norm information
-    print(" Reading convergence from ", log_file)
-
-
-    # Check the file exists
-    if not os.path.exists(log_file):
-        utils.abort('Log file not found.')
-
-    # Convert file to list
-    lines = []
-    with open(log_file) as file:
-        for line in file:
-            lines.append(line)
-
-    # Get unique minizers used in run, e.g. DRIPCG + GMRES
-    minimizers = []
-    for line in lines:
-        if " end of iteration " in line:
-            minimizers.append(line.split()[0])
-    minimizers=set(minimizers) # Unique only
-
 
     # Loop over minimizers
-    for minimizer in minimizers:
+    for minimizer, stats in consumer.minimizers.items():
 
         print('Processing ', minimizer)
 
-        grad_red  = []
-        norm_red  = []
-        quad_j    = []
-        quad_jb   = []
-        quad_JoJc = []
-        for num, line in enumerate(lines, 1):
-            if minimizer+" end of iteration " in line:
-                grad_red.append(lines[num].split()[-1])
-                norm_red.append(lines[num+1].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_j.append(lines[num+3].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_jb.append(lines[num+4].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_JoJc.append(lines[num+5].split()[-1])
-
-
         # Loop over metrics
         for s in range(5):
 
             if (s==0):
-                stat_str = grad_red
+                stat_str = stats['grad_red']
                 ylabel = 'Gradient reduction'
             elif (s==1):
-                stat_str = norm_red
+                stat_str = stats['norm_red']
                 ylabel = 'Norm reduction'
             elif (s==2):
-                stat_str = quad_j
+                stat_str = stats['quad_j']
                 ylabel = 'Quadratic cost function: J'
             elif (s==3):
-                stat_str = quad_jb
+                stat_str = stats['quad_jb']
                 ylabel = 'Quadratic cost function: Jb'
             elif (s==4):
-                stat_str = quad_JoJc
+                stat_str = stats['quad_JoJc']
                 ylabel = 'Quadratic cost function: JoJc'
 
             niter = len(stat_str)
@@ -153,6 +164,75 @@ def da_convergence(datetime, conf):
                 plt.xlim([0.9, niter+0.1])
                 print(" Saving figure as", savename, "\n")
                 plt.savefig(savename)
+                plt.close(fig)
+
+# --------------------------------------------------------------------------------------------------
+
+def _report_iterations(consumer, reported):
+
+    # Print the iterations parsed since the previous report, reported holds the number of iterations
+    # already printed for each minimizer. Returns the number of new iterations.
+
+    new = 0
+    for minimizer, stats in consumer.minimizers.items():
+
+        for n in range(reported.get(minimizer, 0), len(stats['grad_red'])):
+            line = "  "+minimizer+" iteration "+str(n+1)+ \
+                   ": gradient reduction "+'{:.6e}'.format(stats['grad_red'][n])+ \
+                   ", norm reduction "+'{:.6e}'.format(stats['norm_red'][n])
+            if n < len(stats['quad_j']):
+                line = line+", J "+'{:.6e}'.format(stats['quad_j'][n])
+            print(line)
+
+            # A reduction above one means the gradient has grown since the first iteration
+            if stats['grad_red'][n] > 1.0:
+                print("  WARNING: "+minimizer+" gradient reduction above one at iteration "+
+                      str(n+1)+", the minimization may be diverging")
+
+        new = new + len(stats['grad_red']) - reported.get(minimizer, 0)
+        reported[minimizer] = len(stats['grad_red'])
+
+    return new
+
+# --------------------------------------------------------------------------------------------------
+
+def da_convergence(datetime, conf):
+
+    # Log file to parse
+    log_file = log_parser.log_file_name(datetime, conf)
+
+    # Follow mode options
+    follow = utils.configGet(conf, 'follow', False)
+    poll_interval = utils.configGet(conf, 'poll interval', 30)
+    idle_timeout = utils.configGet(conf, 'idle timeout', 3600)
+
+    consumer = DaConvergenceConsumer()
+
+    if not follow:
+
+        # Read file and gather norm information
+        print(" Reading convergence from ", log_file)
+        log_parser.parse_log_configured(log_file, [consumer], conf)
+
+        plot_da_convergence(datetime, conf, consumer, log_file)
+
+        return
+
+    # Follow the log as it is written
+    output_path = utils.configGet(conf, 'output path', './')
+    utils.createPath(output_path)
+    checkpoint_file = utils.configGet(conf, 'checkpoint file',
+                                      os.path.join(output_path,
+                                                   os.path.basename(log_file)+'.follow.json'))
+
+    print(" Following convergence in ", log_file)
+    reported = {}
+
+    def update():
+        if _report_iterations(consumer, reported) > 0:
+            plot_da_convergence(datetime, conf, consumer, log_file)
+
+    log_parser.follow_log(log_file, [consumer], checkpoint_file, poll_interval, idle_timeout, update)
 
 
 # --------------------------------------------------------------------------------------------------
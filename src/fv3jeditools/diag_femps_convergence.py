@@ -11,64 +11,70 @@ import matplotlib
 import numpy as np
 import os
 
-matplotlib.use("Agg")
+import fv3jeditools.log_parser as log_parser
+import fv3jeditools.utils as utils
 
+# --------------------------------------------------------------------------------------------------
+## @package femps_convergence
+#
+#  This application can be triggered by using "application name: femps_convergence" or by running
+#  this file as a script (-p plot level, -f field, -l log file).
+#
+#  Configuration options:
+#  ----------------------
+#  log file    | The log file to parse the FEMPS inverse Laplacian convergence from
+#  plot level  | Level to plot [50]
+#  field       | Field to plot, psi or chi [psi]
+#  output path | Path where the figure is saved [./]
+#  log cache   | Keep the values parsed from the log in a cache so the log is not parsed again
+#                when only the figure options change [false]
+#  log cache path | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
+#
+#
+#  The log is read with log_parser.
+#
+# --------------------------------------------------------------------------------------------------
 
-def lines_that_contain(string, fh):
-    return [line for line in fh if string in line]
+class FempsConvergenceConsumer(log_parser.LogConsumer):
 
+    triggers = ["INVERSELAP RMSE:"]
 
-def main():
+    def __init__(self):
 
-    # User input
-    # ----------
+        # Level, iteration and rmse of each line
+        self.rows = []
 
-    sargs = argparse.ArgumentParser()
-    sargs.add_argument("-p", "--plot_level", default='50')
-    sargs.add_argument("-f", "--field",      default='psi')
-    sargs.add_argument("-l", "--log_file",   default='femps_rmse.txt')
+    def consume(self, line, following):
 
-    args = sargs.parse_args()
+        self.rows.append([float(value) for value in line.split()[2:5]])
+
+    def to_arrays(self):
+
+        return {'rows': np.array(self.rows, dtype=np.float64).reshape(-1, 3)}
+
+    def from_arrays(self, arrays):
+
+        self.rows = arrays['rows'].tolist()
+
+# --------------------------------------------------------------------------------------------------
+
+def _plot_femps(consumer, levelstr, field, log_file, output_path='./'):
 
-    levelstr = args.plot_level
-    field = args.field
     if field == 'psi':
         psi_or_chi = 0
     elif field == 'chi':
         psi_or_chi = 1
     else:
-        print("ABORT: field should be psi or chi based on default fv3-jedi runs")
-        exit()
-
-    log_file = args.log_file
-
-    print("\n FEMPS convergence analysis tool")
-    print(" - Level to plot "+levelstr)
-    print(" - Field to plot: "+field)
-    print(" - File to read: "+log_file)
-    print("\n")
+        utils.abort("field should be psi or chi based on default fv3-jedi runs")
 
     level = float(levelstr)-1
 
-    # Search log for matching string
-
-    convergence_all = []
-    # Open and get lines that match
-    with open(log_file, 'r') as fh:
-        for line in lines_that_contain("INVERSELAP RMSE:", fh):
-            convergence_all.append(line)
-
-    nsize = len(convergence_all)
-
     ind_levl = 0
     ind_iter = 1
     ind_rmse = 2
 
     # Array of convergence data
-    convergence = np.empty((nsize, 3))
-    for n in range(nsize):
-        for m in range(2, 5):
-            convergence[n, m-2] = float(convergence_all[n].split()[m])
+    convergence = np.array(consumer.rows).reshape(-1, 3)
 
     niter = int(np.max(convergence[:, ind_iter]))
 
@@ -86,6 +92,7 @@ def main():
     rmse_array[:] = convergence_var[:, ind_rmse]
 
     figfile = 'fempsconv-'+os.path.splitext(os.path.split(log_file)[1])[0]+'-level'+levelstr.zfill(2)+'-'+field+'.png'
+    figfile = os.path.join(output_path, figfile)
 
     plt.figure(figsize=(15, 7.5))
     plt.plot(iter_array, rmse_array, linestyle='-', marker='x')
@@ -97,6 +104,70 @@ def main():
 
     print(" Saving figure as", figfile, "\n")
     plt.savefig(figfile, transparent=True)
+    plt.close('all')
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_femps_convergence(datetime, conf, consumer, log_file):
+
+    # Level and field to plot
+    levelstr = str(utils.configGet(conf, 'plot level', 50))
+    field = utils.configGet(conf, 'field', 'psi')
+
+    # Get output path for plots
+    output_path = utils.configGet(conf, 'output path', './')
+    utils.createPath(output_path)
+
+    _plot_femps(consumer, levelstr, field, log_file, output_path)
+
+# --------------------------------------------------------------------------------------------------
+
+def femps_convergence(datetime, conf):
+
+    # Log file to parse
+    log_file = log_parser.log_file_name(datetime, conf)
+
+    print(" Reading FEMPS convergence from ", log_file)
+    consumer = FempsConvergenceConsumer()
+    log_parser.parse_log_configured(log_file, [consumer], conf)
+
+    plot_femps_convergence(datetime, conf, consumer, log_file)
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    matplotlib.use("Agg")
+
+    # User input
+    # ----------
+
+    sargs = argparse.ArgumentParser()
+    sargs.add_argument("-p", "--plot_level", default='50')
+    sargs.add_argument("-f", "--field",      default='psi')
+    sargs.add_argument("-l", "--log_file",   default='femps_rmse.txt')
+
+    args = sargs.parse_args()
+
+    levelstr = args.plot_level
+    field = args.field
+    if field not in ['psi', 'chi']:
+        print("ABORT: field should be psi or chi based on default fv3-jedi runs")
+        exit()
+
+    log_file = args.log_file
+
+    print("\n FEMPS convergence analysis tool")
+    print(" - Level to plot "+levelstr)
+    print(" - Field to plot: "+field)
+    print(" - File to read: "+log_file)
+    print("\n")
+
+    # Search log for matching string
+    consumer = FempsConvergenceConsumer()
+    log_parser.parse_log(log_file, [consumer])
+
+    _plot_femps(consumer, levelstr, field, log_file)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,8 @@ import netCDF4
 import numpy as np
 import os
 
+import fv3jeditools.cubesphere_reader as cubesphere_reader
+import fv3jeditools.cubesphere_remap as cubesphere_remap
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -19,13 +21,69 @@ import fv3jeditools.utils as utils
 #  Configuration options:
 #  ----------------------
 #
-#  fields file | File containing field on lat/lon grid
-#  field name  | Name of field to plot as it appears in the file
-#  model layer | Model layer to plot if rank 3 field is chosen.
+#  fields file      | File containing field on lat/lon or cube-sphere grid
+#  field name       | Name of field to plot as it appears in the file
+#  model layer      | Model layer to plot if rank 3 field is chosen, or a list of layers
+#  grid path        | Directory of the fv3grid_cNNNN.nc4 grid files, for cube-sphere files
+#                     [$FV3_GRID_DIR]
+#  remap longitudes | Number of longitudes cube-sphere fields are remapped to [361]
+#  remap latitudes  | Number of latitudes cube-sphere fields are remapped to [181]
 #
 #  This function can be used to plot fields that are on a lon/lat grid as written by fv3-jedi.
 #
+#  Files without lon and lat dimensions are read as native cube-sphere files, either the tile
+#  files of GFS (the fields file is then e.g. fv_core.res.nc for fv_core.res.tile1.nc to
+#  fv_core.res.tile6.nc) or a GEOS file with the tiles along the nf dimension. Their fields are
+#  remapped to a regular lat/lon grid with cubesphere_remap, whose interpolation weights are
+#  computed once per resolution and lat/lon grid and then reused from a cache. The requested layers
+#  of all the fields are read first and remapped together with a single sparse matrix product.
 #
+#
+# --------------------------------------------------------------------------------------------------
+
+def remap_cubesphere_fields(fields_file, field_names, model_layers, grid_path, nlon, nlat):
+
+    # Read the layers of the fields and remap them all at once, one sparse product per resolution.
+    # Returns the (field name, layer or None, units, lons, lats, field) of each figure.
+
+    blocks = {}
+    figures = []
+    for field_name in field_names:
+
+        # Check if field is two or three dimensions
+        layered = cubesphere_reader.field_levels(fields_file, field_name) > 0
+
+        # User must provide layer/level to plot if 3D
+        if layered and model_layers == [None]:
+            utils.abort("If plotting 3D variable user must provide \'model layer\' in the configuration")
+
+        # Read the layers of the field on all tiles
+        if layered:
+            print(" Reading layer(s) ", model_layers, " from field ", field_name)
+        else:
+            print(" Reading field ", field_name)
+        layers = model_layers if layered else [None]
+        tiles, units, long_name = cubesphere_reader.read_field(fields_file, field_name,
+                                                               model_layers if layered else [1])
+
+        # Stack the layers of the fields of each resolution into one column block
+        npx = tiles.shape[-1]
+        block = blocks.setdefault(npx, [])
+        position = sum(layer_tiles.shape[1] for layer_tiles in block)
+        block.append(tiles)
+        for n, layer in enumerate(layers):
+            figures.append((field_name, layer, units, npx, position+n))
+
+    # Remap each block to the lat/lon grid, the weights are made once per resolution
+    remapped = {}
+    for npx, block in blocks.items():
+        remap = cubesphere_remap.CubeSphereRemap(npx, grid_path, nlon, nlat)
+        remapped[npx] = (remap.lons, remap.lats, remap.remap(np.concatenate(block, axis=1)))
+        del block[:]
+
+    return [(field_name, layer, units, remapped[npx][0], remapped[npx][1], remapped[npx][2][index])
+            for field_name, layer, units, npx, index in figures]
+
 # --------------------------------------------------------------------------------------------------
 
 def field_plot(datetime, conf):
@@ -46,11 +104,12 @@ def field_plot(datetime, conf):
     except:
         utils.abort('\'field names\' must be present in the configuration')
 
-    # Get model layer to plot
+    # Get model layer(s) to plot
     try:
         model_layer = conf['model layer']
     except:
         model_layer = None
+    model_layers = model_layer if isinstance(model_layer, list) else [model_layer]
 
     # Get output path for plots
     try:
@@ -62,63 +121,96 @@ def field_plot(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Open the file
-    print('\nOpening ', fields_file, 'for reading')
-    ncfile = netCDF4.Dataset(fields_file, mode='r')
+    # Lat/lon files have lon and lat dimensions, other files hold cube-sphere fields
+    latlon = False
+    if os.path.exists(fields_file):
+        with netCDF4.Dataset(fields_file, mode='r') as fh:
+            latlon = 'lon' in fh.dimensions and 'lat' in fh.dimensions
 
     # Output filename
     fields_file_name = output_path + os.path.splitext(os.path.basename(fields_file))[0]
 
-    # Get metadata from the file
-    npx = ncfile.dimensions["lon"].size
-    npy = ncfile.dimensions["lat"].size
-    npz = ncfile.dimensions["lev"].size
-    lons = ncfile.variables["lons"][:]
-    lats = ncfile.variables["lats"][:]
+    if latlon:
 
-    # Print field dimensions
-    print(" Grid dimensions", npx, 'x', npy, 'x', npz)
+        # Open the file
+        print('\nOpening ', fields_file, 'for reading')
+        ncfile = netCDF4.Dataset(fields_file, mode='r')
 
-    for field_name in field_names:
+        # Get metadata from the file
+        npx = ncfile.dimensions["lon"].size
+        npy = ncfile.dimensions["lat"].size
+        npz = ncfile.dimensions["lev"].size
+        lons = ncfile.variables["lons"][:]
+        lats = ncfile.variables["lats"][:]
+
+        # Print field dimensions
+        print(" Grid dimensions", npx, 'x', npy, 'x', npz)
+
+    else:
+
+        # Grid files and lat/lon grid the cube-sphere fields are remapped to
+        grid_path = utils.configGet(conf, 'grid path', os.environ.get('FV3_GRID_DIR', './'))
+        nlon = utils.configGet(conf, 'remap longitudes', 361)
+        nlat = utils.configGet(conf, 'remap latitudes', 181)
+
+        print('\nReading cube-sphere fields from', fields_file)
+
+    # Fields to plot, with the lat/lon grid they are on
+    figures = []
+
+    if latlon:
+
+      for field_name in field_names:
 
         # Get field units from the file
         units = ncfile.variables[field_name].units
 
-        # Zero out array to fill with field
-        field = np.zeros((npy, npx))
-
         # Check if field is two or three dimensions
         if len(ncfile.variables[field_name].shape) == 4:
 
           # User must provide layer/level to plot if 3D
-          if (model_layer == None):
+          if (model_layers == [None]):
               utils.abort("If plotting 3D variable user must provide \'model layer\' in the configuration")
 
-          # Message and read the field at provided layer
-          print(" Reading layer ", model_layer, " from field ", field_name)
-          field[:,:] = ncfile.variables[field_name][:,model_layer-1,:,:]
-
-          # Set plot title and output file to include level plotted
-          title = "Contour of "+field_name+" ("+units+") for layer "+str(model_layer)
-          outfile = fields_file_name+"_"+field_name+"_layer-"+str(model_layer)+".png"
+          # Message and read the field at provided layers
+          for layer in model_layers:
+            print(" Reading layer ", layer, " from field ", field_name)
+            field = np.zeros((npy, npx))
+            field[:,:] = ncfile.variables[field_name][:,layer-1,:,:]
+            figures.append((field_name, layer, units, lons, lats, field))
 
         elif len(ncfile.variables[field_name].shape) == 3:
 
-          # Message and read the field at provided layer
+          # Message and read the field
           print(" Reading field ", field_name)
+          field = np.zeros((npy, npx))
           field[:,:] = ncfile.variables[field_name][:,:]
+          figures.append((field_name, None, units, lons, lats, field))
+
+    else:
+
+      figures = remap_cubesphere_fields(fields_file, field_names, model_layers, grid_path, nlon,
+                                        nlat)
+
+    for field_name, layer, units, lons, lats, field in figures:
+
+        # Set plot title and output file, including the level plotted
+        if layer is not None:
+          title = "Contour of "+field_name+" ("+units+") for layer "+str(layer)
+          outfile = fields_file_name+"_"+field_name+"_layer-"+str(layer)+".png"
+        else:
           title = "Contour of "+field_name+" ("+units+")"
           outfile = fields_file_name+"_"+field_name+".png"
 
         # Check if field has positve and negative values
         # ----------------------------------------------
-        if np.min(field) < 0:
-          cmax = np.max(np.abs(field))
+        if np.nanmin(field) < 0:
+          cmax = np.nanmax(np.abs(field))
           cmin = -cmax
           cmap = 'RdBu'
         else:
-          cmax = np.max(field)
-          cmin = np.min(field)
+          cmax = np.nanmax(field)
+          cmin = np.nanmin(field)
           cmap = 'nipy_spectral'
 
         levels = np.linspace(cmin,cmax,25)
@@ -160,7 +252,8 @@ def field_plot(datetime, conf):
         plt.savefig(outfile)
 
     # Close the file
-    ncfile.close()
+    if latlon:
+        ncfile.close()
 
 
 # --------------------------------------------------------------------------------------------------
@@ -9,11 +9,12 @@ import glob
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
-import netCDF4
 import numpy as np
 import os
 import scipy.interpolate
 
+import fv3jeditools.ioda_reader as ioda_reader
+import fv3jeditools.running_statistics as running_statistics
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -38,10 +39,58 @@ import fv3jeditools.utils as utils
 #  window length         | Window length (hours)
 #  time offset           | Offset of time in filename from window center (hours), e.g. -3, +3 or 0
 #  plot format           | Output format for plots ([png] or pdf)
+#  ioda cache size       | Memory cap in MB for the arrays cached from each file, or from all the
+#                          files of a pipeline batch together
+#  histogram minimum     | Lower edge of the histogram bins, found from the data when not given
+#  histogram maximum     | Upper edge of the histogram bins, found from the data when not given
+#  cycle offsets         | Offsets (hours) from the datetime of the cycles whose files are combined
+#                          into one distribution, e.g. [-18, -12, -6, 0] [0]
 #
 #
 #  This function can be used to plot innovation statistics for the variational assimilation output.
 #
+#  The files are processed one at a time so the memory needed does not depend on the total number
+#  of locations. The mean and standard deviation are accumulated with running_statistics and the
+#  histograms are accumulated on bin edges shared by all files and cycles. When the histogram
+#  limits are not given the files are read twice, once to find the range of the data and once to
+#  fill the histograms.
+#
+# --------------------------------------------------------------------------------------------------
+
+def _accumulate_file(hofx_file, variable, nouter, conf, cache_size, statistics, histograms):
+
+    # Add the innovations of one file to the accumulators of each outer loop. Either list of
+    # accumulators can be None. Returns the channel, None for files without channels.
+
+    # Missing values
+    missing = 9.0e+30
+
+    # Open file for reading
+    fh = ioda_reader.open_ioda(hofx_file, cache_size)
+
+    # Check for channels, user must provide channel number
+    chan = None
+    index = slice(None)
+    if fh.dimension("nchans") != 0:
+        chan = utils.configGetOrFail(conf, 'channel')
+        index = (slice(None), chan-1)
+
+    # Observations with missing values set to nans
+    obs = np.array(fh.read('ObsValue', variable)[index], dtype=np.float64)
+    obs[~(np.abs(obs) < missing)] = np.nan
+
+    # Loop over outer loops
+    for n in range(nouter+1):
+        innovations = fh.read('hofx'+str(n), variable)[index] - obs
+        if statistics is not None:
+            statistics[n].update(innovations)
+        if histograms is not None:
+            histograms[n].update(innovations)
+
+    fh.close()
+
+    return chan
+
 # --------------------------------------------------------------------------------------------------
 
 def hofx_innovations(datetime, conf):
@@ -88,6 +137,17 @@ def hofx_innovations(datetime, conf):
     except:
         nbins = 1000
 
+    # Fixed limits for the histograms
+    hist_min = conf.get('histogram minimum', None)
+    hist_max = conf.get('histogram maximum', None)
+    fixed_edges = hist_min is not None and hist_max is not None
+
+    # Cycles combined into one distribution
+    cycle_offsets = utils.configGet(conf, 'cycle offsets', [0])
+
+    # Memory cap for the arrays cached from each file (MB)
+    cache_size = utils.configGet(conf, 'ioda cache size', ioda_reader.default_max_memory_mb)
+
     # Get output path for plots
     try:
         output_path = conf['output path']
@@ -98,17 +158,22 @@ def hofx_innovations(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Get list of hofx files to read
-    # ------------------------------
+    # Get list of hofx files to read for each cycle
+    # ----------------------------------------------
+    cycles = []
+    for offset in cycle_offsets:
 
-    # Replace datetime in logfile name
-    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-    hofx_files_template = utils.stringReplaceDatetimeTemplate(isodatestr, hofx_files_template)
+        cycle = datetime + dt.timedelta(hours=offset)
 
-    hofx_files = glob.glob(hofx_files_template)
+        # Replace datetime in file name
+        isodatestr = cycle.strftime("%Y-%m-%dT%H:%M:%S")
+        hofx_files = glob.glob(utils.stringReplaceDatetimeTemplate(isodatestr,
+                                                                   hofx_files_template))
 
-    if hofx_files==[]:
-        utils.abort("No hofx files matching the input string")
+        if hofx_files==[]:
+            utils.abort("No hofx files matching the input string for cycle "+str(cycle))
+
+        cycles.append((cycle, hofx_files))
 
 
     # Variable name and units
@@ -117,126 +182,107 @@ def hofx_innovations(datetime, conf):
     vmetric = 'innovations'
 
 
-    # Compute window begin time
-    # -------------------------
-    window_begin = datetime + time_offset - window_length/2
-
-
-    # Loop over data files and read
-    # -----------------------------
-    nlocs = 0
-    print(" Reading all files to get global nlocs")
-    for hofx_file in hofx_files:
+    # Compute window begin time and window length covered by the cycles
+    # ------------------------------------------------------------------
+    first_cycle = min(cycle for cycle, _ in cycles)
+    last_cycle = max(cycle for cycle, _ in cycles)
+    window_begin = first_cycle + time_offset - window_length/2
+    window_end = last_cycle + time_offset + window_length/2
 
-        # Open the file
-        fh = netCDF4.Dataset(hofx_file)
-        nlocs = nlocs + fh.dimensions['nlocs'].size
-        fh.close()
 
-    print(" Number of locations for this platform: ", nlocs)
+    # First pass: running statistics, and histograms when the bin edges are known
+    # ---------------------------------------------------------------------------
+    statistics = [running_statistics.RunningStatistics() for n in range(nouter+1)]
+    histograms = None
+    if fixed_edges:
+        edges = running_statistics.histogram_edges(hist_min, hist_max, nbins)
+        histograms = [running_statistics.Histogram(edges) for n in range(nouter+1)]
 
-    # Array to hold hofx data
-    obs = np.zeros((nlocs))
-    hofx = np.zeros((nlocs, nouter+1))
+    for cycle, hofx_files in cycles:
 
-    # Missing values
-    missing = 9.0e+30
+        print(" Reading", len(hofx_files), "files for cycle", cycle)
 
-    # Loop over files and read h(x) files
-    nlocs_start = 0
-    print(" Reading all files to get data")
-    for hofx_file in hofx_files:
+        # Accumulate the cycle on its own and merge it into the combined statistics
+        cycle_statistics = [running_statistics.RunningStatistics() for n in range(nouter+1)]
+        cycle_histograms = None
+        if fixed_edges:
+            cycle_histograms = [running_statistics.Histogram(edges) for n in range(nouter+1)]
 
-        # Open file for reading
-        fh = netCDF4.Dataset(hofx_file)
+        for hofx_file in hofx_files:
+            chan = _accumulate_file(hofx_file, variable, nouter, conf, cache_size,
+                                    cycle_statistics, cycle_histograms)
 
-        # Check for channels
-        try:
-            nchans = fh.dimensions["nchans"].size
-        except:
-            nchans = 0
+        for n in range(nouter+1):
+            statistics[n].merge(cycle_statistics[n])
+            if fixed_edges:
+                histograms[n].merge(cycle_histograms[n])
 
-        # User must provide channel number
-        if nchans != 0:
-            chan = utils.configGetOrFail(conf, 'channel')
+        if len(cycles) > 1:
+            print("  Locations:", cycle_statistics[0].count,
+                  " mean observation minus background:", cycle_statistics[0].mean)
 
-        # Number of locations in this file
-        nlocs_final = nlocs_start + fh.dimensions['nlocs'].size
+    print(" Number of locations for this platform: ", statistics[0].count)
 
-        # Background
-        if nchans != 0:
-            obs[nlocs_start:nlocs_final] = fh.groups['ObsValue'].variables[variable][:,chan-1]
-        else:
-            obs[nlocs_start:nlocs_final] = fh.groups['ObsValue'].variables[variable][:]
+    if statistics[0].count == 0:
+        print(" No valid data for "+varname+", skip plotting")
+        return
 
 
-        # Set missing values to nans
-        obs[nlocs_start:nlocs_final] = np.where(np.abs(obs[nlocs_start:nlocs_final]) < missing,
-                                       obs[nlocs_start:nlocs_final], float("NaN"))
+    # Second pass: histograms on edges spanning the data of each outer loop
+    # ---------------------------------------------------------------------
+    if not fixed_edges:
 
-        # Loop over outer loops
-        for n in range(nouter+1):
-            if nchans != 0:
-                hofx[nlocs_start:nlocs_final,n] = fh.groups['hofx'+str(n)].variables[variable][:,chan-1] - \
-                                                  obs[nlocs_start:nlocs_final]
-            else:
-                hofx[nlocs_start:nlocs_final,n] = fh.groups['hofx'+str(n)].variables[variable][:] - \
-                                                  obs[nlocs_start:nlocs_final]
+        histograms = [running_statistics.Histogram(
+                      running_statistics.histogram_edges(statistics[n].minimum,
+                                                         statistics[n].maximum, nbins))
+                      for n in range(nouter+1)]
 
-        # Set start ready for next file
-        nlocs_start = nlocs_final
+        print(" Reading all files to fill the histograms")
+        for cycle, hofx_files in cycles:
+            for hofx_file in hofx_files:
+                _accumulate_file(hofx_file, variable, nouter, conf, cache_size, None, histograms)
 
-        fh.close()
 
     # Figure filename
     # ---------------
-    if nchans != 0:
+    if chan is not None:
         savename = os.path.join(output_path, varname+"-channel"+str(chan)+"_"+vmetric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
     else:
         savename = os.path.join(output_path, varname+"_"+vmetric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
 
 
-    # Statistics arrays
-    hist  = np.zeros((nbins, nouter+1))
-    edges = np.zeros((nbins, nouter+1))
-    splines = np.zeros((nbins, nouter+1))
-    stddev = np.zeros(nouter+1)
-
     # Create figure
     fig, ax = plt.subplots(figsize=(12, 7.5))
 
     # Loop over outer loops, compute stats and plot
     for n in range(nouter+1):
 
-        # Generate histograms
-        hist[:,n], edges_hist = np.histogram(hofx[~np.isnan(hofx[:,n]),n], bins=nbins)
-        edges[:,n] = edges_hist[:-1] + (edges_hist[1] - edges_hist[0])/2
-
         # Generate splines for plotting
-        spline = scipy.interpolate.UnivariateSpline(edges[:,n], hist[:,n], s=None)
-        splines[:,n] = spline(edges[:,n])
+        centers = histograms[n].centers()
+        spline = scipy.interpolate.UnivariateSpline(centers, histograms[n].counts, s=None)
+        splines = spline(centers)
 
         # Standard deviation
-        stddev[n] = np.nanstd(hofx[:, n])
+        stddev = statistics[n].stddev()
 
         # Print basic statistics
         print("\n Statisitcs for outer loop", n)
-        print("  Mean observation minus h(x) = ", np.nanmean(hofx[:, n]))
-        print("  Sdev observation minus h(x) = ", stddev[n])
+        print("  Mean observation minus h(x) = ", statistics[n].mean)
+        print("  Sdev observation minus h(x) = ", stddev)
 
         if n == 0:
             label = "Obs minus background"
         else:
             label = "Obs minus h(x) after "+utils.ordinalNumber(n)+" outer loop"
 
-        ax.plot(edges[:,n], splines[:,n], label=label)
-        plt.xlim(-2*stddev[n], 2*stddev[n])
+        ax.plot(centers, splines, label=label)
+        plt.xlim(-2*stddev, 2*stddev)
 
     plt.legend(loc='upper left')
     ax.tick_params(labelbottom=True, labeltop=True, labelleft=True, labelright=True)
     plt.title("Observation statistics: "+varname.replace("_"," ")+" "+vmetric+" | "+
               window_begin.strftime("%Y%m%d %Hz")+" to "+
-              (window_begin+window_length).strftime("%Y%m%d %Hz"), y=1.08)
+              window_end.strftime("%Y%m%d %Hz"), y=1.08)
     if not units==None:
         plt.xlabel("Observation minus h(x) ["+units+"]")
     else:
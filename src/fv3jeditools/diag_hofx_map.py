@@ -6,13 +6,15 @@
 import cartopy.crs as ccrs
 import datetime as dt
 import glob
+import itertools
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
-import netCDF4
 import numpy as np
 import os
 
+import fv3jeditools.figure_pool as figure_pool
+import fv3jeditools.ioda_reader as ioda_reader
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -29,20 +31,171 @@ import fv3jeditools.utils as utils
 #  in the file name. If this time is not equivalent to the central time of the window the time
 #  offset option described below can be used.
 #
-#  hofx files       | File(s) to parse. E.g. aircraft_hofx_%Y%m%d%H.nc4
-#  variable         | Variable to plot (either something from the file or variable@omb)
-#  units            | Units of the field being plotted
-#  window length    | Window length (hours)
-#  time offset      | Offset of time in filename from window center (hours), e.g. -3, +3 or 0
-#  plot format      | Output format for plots ([png] or pdf)
-#  colorbar minimum | User defined colorbar minimum
-#  colorbar maximum | User defined colorbar maximum
+#  hofx files        | File(s) to parse. E.g. aircraft_hofx_%Y%m%d%H.nc4
+#  field             | Field(s) to plot, a single name or a list, e.g. air_temperature
+#  metric            | Metric(s) to plot, a single name or a list, e.g. [ObsValue, hofx, omb]
+#  channel           | Channel(s) to plot for files with channels, a single number or a list
+#  units             | Units of the field being plotted
+#  window length     | Window length (hours)
+#  time offset       | Offset of time in filename from window center (hours), e.g. -3, +3 or 0
+#  plot format       | Output format for plots ([png] or pdf)
+#  colorbar minimum  | User defined colorbar minimum
+#  colorbar maximum  | User defined colorbar maximum
+#  ioda cache size   | Memory cap in MB for the arrays cached from each file, or from all the files
+#                      of a pipeline batch together
+#  number of workers | Number of processes rendering the figures [1]
+#  render mode       | scatter: one marker per observation, density: observations binned into pixels
+#                      and drawn as an image, for very large numbers of observations [scatter]
+#  density aggregation | Value of a pixel in density mode, mean of the metric or count of obs [mean]
+#  density pixels    | Number of pixels in longitude and latitude in density mode [720, 360]
+#
+#  A figure is made for every combination of field, metric and channel. The files are found and
+#  the locations read only once for all the figures.
 #
 #
 #  This function can be used to plot fields that are on a lon/lat grid as written by fv3-jedi.
 #
 # --------------------------------------------------------------------------------------------------
 
+def read_hofx_locations(readers):
+
+    # Read the longitudes and latitudes from all the files into preallocated float32 arrays
+
+    nlocs = sum([fh.dimension('nlocs') for fh in readers])
+
+    lons = np.empty(nlocs, dtype=np.float32)
+    lats = np.empty(nlocs, dtype=np.float32)
+
+    nlocs_start = 0
+    for fh in readers:
+        nlocs_final = nlocs_start + fh.dimension('nlocs')
+        lons[nlocs_start:nlocs_final] = fh.read('MetaData', 'longitude')
+        lats[nlocs_start:nlocs_final] = fh.read('MetaData', 'latitude')
+        nlocs_start = nlocs_final
+
+    return lons, lats
+
+# --------------------------------------------------------------------------------------------------
+
+def read_hofx_data(readers, metric, field, chan=None):
+
+    # Read metric/field from all the files straight into a preallocated float32 array, the total
+    # number of locations is known from the file dimensions. Missing values are set to NaN in place.
+
+    nlocs = sum([fh.dimension('nlocs') for fh in readers])
+
+    odat = np.empty(nlocs, dtype=np.float32)
+
+    nlocs_start = 0
+    for fh in readers:
+
+        # Locations of this file in the array
+        nlocs_final = nlocs_start + fh.dimension('nlocs')
+
+        # Read metric, user must provide channel number for files with channels
+        if fh.dimension("nchans") != 0:
+            if chan is None:
+                utils.abort('\'channel\' must be present in the configuration')
+            odat[nlocs_start:nlocs_final] = fh.read(metric, field)[:,chan-1]
+        else:
+            odat[nlocs_start:nlocs_final] = fh.read(metric, field)
+
+        nlocs_start = nlocs_final
+
+    # Set missing values to nans
+    missing = 9.0e+30
+    odat[~(np.abs(odat) < missing)] = np.nan
+
+    return odat
+
+# --------------------------------------------------------------------------------------------------
+
+def _render_map(spec, shared):
+
+    # Create and save one map, the locations come from the data shared by all the maps
+
+    # Norm for scatter plot
+    norm = None
+    cmap = spec['cmap']
+    units = spec['units']
+
+    if spec['integer colorbar']:
+
+      # Specialized colorbar for integers
+      cmap = plt.cm.jet
+      cmaplist = [cmap(i) for i in range(cmap.N)]
+      cmaplist[1] = (.5, .5, .5, 1.0)
+      cmap = matplotlib.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, cmap.N)
+      bounds = np.insert(np.linspace(0.5, int(spec['datma'])+0.5, int(spec['datma'])+1), 0, 0)
+      norm = matplotlib.colors.BoundaryNorm(bounds, cmap.N)
+
+    fig = plt.figure(figsize=(10, 5))
+
+    # initialize the plot pointing to the projection
+    ax = plt.axes(projection=ccrs.PlateCarree(central_longitude=0))
+
+    # plot grid lines
+    gl = ax.gridlines(crs=ccrs.PlateCarree(central_longitude=0), draw_labels=True,
+                      linewidth=1, color='gray', alpha=0.5, linestyle='-')
+
+    gl.xlabel_style = {'size': 10, 'color': 'black'}
+    gl.ylabel_style = {'size': 10, 'color': 'black'}
+    gl.xlocator = mticker.FixedLocator(
+        [-180, -135, -90, -45, 0, 45, 90, 135, 179.9])
+    ax.set_ylabel("Latitude",  fontsize=7)
+    ax.set_xlabel("Longitude", fontsize=7)
+
+    ax.tick_params(labelbottom=False, labeltop=False, labelleft=False, labelright=False)
+
+    # Color limits are given by the norm when there is one
+    if norm is None:
+        limits = {'vmin': spec['cmin'], 'vmax': spec['cmax']}
+    else:
+        limits = {}
+
+    if 'grid' in spec:
+
+        # density, observation counts are shown on a log scale
+        if spec['aggregation'] == 'count':
+            cmap = 'viridis'
+            norm = matplotlib.colors.LogNorm(vmin=1, vmax=max(np.nanmax(spec['grid']), 1))
+            limits = {}
+            units = 'Observations per pixel'
+
+        sc = ax.imshow(spec['grid'], origin='lower', extent=[-180, 180, -90, 90],
+                       interpolation='nearest', transform=ccrs.PlateCarree(), cmap=cmap,
+                       norm=norm, **limits)
+
+    else:
+
+        # scatter data
+        sc = ax.scatter(shared['lons'], shared['lats'],
+                        c=spec['odat'], s=4, linewidth=0,
+                        transform=ccrs.PlateCarree(), cmap=cmap, norm=norm, **limits)
+
+    # colorbar
+    cbar = plt.colorbar(sc, ax=ax, orientation="horizontal", pad=.1, fraction=0.06,)
+    if not units==None:
+        cbar.ax.set_ylabel(units, fontsize=10)
+
+    # plot globally
+    ax.set_global()
+
+    # draw coastlines
+    ax.coastlines()
+
+    # figure labels
+    plt.title(spec['title'], y=1.08)
+    ax.text(0.45, -0.1,   'Longitude', transform=ax.transAxes, ha='left')
+    ax.text(-0.08, 0.4, 'Latitude', transform=ax.transAxes,
+            rotation='vertical', va='bottom')
+
+    # show plot
+    print(" Saving figure as", spec['savename'], "\n")
+    plt.savefig(spec['savename'])
+
+# --------------------------------------------------------------------------------------------------
+
 def hofx_map(datetime, conf):
 
 
@@ -53,12 +206,25 @@ def hofx_map(datetime, conf):
     hofx_files_template = utils.configGetOrFail(conf, 'hofx files')
 
 
-    # Get metric to plot
-    metric = utils.configGetOrFail(conf, 'metric')
+    # Get metric(s) to plot
+    metrics = utils.configGetOrFail(conf, 'metric')
+    if not isinstance(metrics, list):
+        metrics = [metrics]
+
+
+    # Get field(s) to plot
+    fields = utils.configGetOrFail(conf, 'field')
+    if not isinstance(fields, list):
+        fields = [fields]
 
 
-    # Get field to plot
-    field = utils.configGetOrFail(conf, 'field')
+    # Get channel(s) to plot, only used for files with channels
+    try:
+        chans = conf['channel']
+    except:
+        chans = None
+    if not isinstance(chans, list):
+        chans = [chans]
 
 
     # Get window length
@@ -91,6 +257,19 @@ def hofx_map(datetime, conf):
     except:
         plotformat = 'png'
 
+    # Memory cap for the arrays cached from each file (MB)
+    cache_size = utils.configGet(conf, 'ioda cache size', ioda_reader.default_max_memory_mb)
+
+    # Number of processes rendering the figures
+    workers = utils.configGet(conf, 'number of workers', 1)
+
+    # Scatter or density rendering
+    render_mode = utils.configGet(conf, 'render mode', 'scatter')
+    if render_mode not in ['scatter', 'density']:
+        utils.abort('\'render mode\' must be scatter or density')
+    aggregation = utils.configGet(conf, 'density aggregation', 'mean')
+    density_nx, density_ny = utils.configGet(conf, 'density pixels', [720, 360])
+
     # Get output path for plots
     try:
         output_path = conf['output path']
@@ -119,182 +298,109 @@ def hofx_map(datetime, conf):
     window_begin = datetime + time_offset - window_length/2
 
 
-    # Loop over data files and read
-    # -----------------------------
-    odat = []
-    lons = []
-    lats = []
-    time = []
+    # Open the files and read the locations once for all figures
+    # ----------------------------------------------------------
+    readers = []
     for hofx_file in hofx_files:
-
-        # Message file being read
         print(" Reading "+hofx_file)
+        readers.append(ioda_reader.open_ioda(hofx_file, cache_size))
 
-        # Open the file
-        fh = netCDF4.Dataset(hofx_file)
-
-        # Check for channels
-        try:
-            nchans = fh.dimensions["nchans"].size
-        except:
-            nchans = 0
-
-        # User must provide channel number
-        if nchans != 0:
-            chan = utils.configGetOrFail(conf, 'channel')
-
-            # Read metric
-            if metric=='omb':
-                odat_proc = fh.groups['ObsValue'].variables[field][:,chan-1] - fh.groups['hofx'].variables[field][:,chan-1]
-            else:
-                odat_proc = fh.groups[metric].variables[field][:,chan-1]
-
-        else:
-
-            # Read metric
-            if metric=='omb':
-                odat_proc = fh.groups['ObsValue'].variables[field][:] - fh.groups['hofx'].variables[field][:]
-            else:
-                odat_proc = fh.groups[metric].variables[field][:]
-
-        # Read metadata
-        lons_proc = fh.groups['MetaData'].variables['longitude'][:]
-        lats_proc = fh.groups['MetaData'].variables['latitude'][:]
-        time_proc = fh.groups['MetaData'].variables['datetime'][:]
+    lons, lats = read_hofx_locations(readers)
 
+    nchans = readers[0].dimension("nchans")
+    if nchans == 0:
+        chans = [None]
 
-        for m in range(len(odat_proc)):
-            odat.append(odat_proc[m])
-            lons.append(lons_proc[m])
-            lats.append(lats_proc[m])
-
-        fh.close()
-
-    # Figure filename
-    # ---------------
-    field_savename = field
-    if nchans != 0:
-        field_savename = field_savename+"-channel"+str(chan)
-    savename = os.path.join(output_path, field_savename+"_"+metric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
-
-    # Set missing values to nans
-    missing = 9.0e+30
-    odat = np.where(np.abs(odat) < missing, odat, float("NaN"))
-    
-    numobs = len(odat)
-
-    obarray = np.empty([numobs, 3])
-
-    obarray[:, 0] = odat
-    obarray[:, 1] = lons
-    obarray[:, 2] = lats
-
-
-    # Compute and print some stats for the data
-    # -----------------------------------------
-    stdev = np.nanstd(obarray[:, 0])  # Standard deviation
-    omean = np.nanmean(obarray[:, 0]) # Mean of the data
-    datmi = np.nanmin(obarray[:, 0])  # Min of the data
-    datma = np.nanmax(obarray[:, 0])  # Max of the data
-
-    print("Plotted data statistics: ")
-    print("Mean: ", omean)
-    print("Standard deviation: ", stdev)
-    print("Minimum ", datmi)
-    print("Maximum: ", datma)
-
-
-    # Norm for scatter plot
-    # ---------------------
-    norm = None
-
-
-    # Min max for colorbar
-    # --------------------
-    if np.nanmin(obarray[:, 0]) < 0:
-      cmax = datma
-      cmin = datmi
-      cmap = 'RdBu'
+    # Density maps are binned here, only the scatter needs the locations in the rendering processes
+    if render_mode == 'density':
+        lons = np.where(lons > 180.0, lons - 360.0, lons)
+        shared = {}
     else:
-      cmax = omean+stdev
-      cmin = np.maximum(omean-stdev, 0.0)
-      cmap = 'viridis'
+        shared = {'lons': lons, 'lats': lats}
 
-    if metric == 'PreQC' or metric == 'EffectiveQC':
-      cmin = datmi
-      cmax = datma
 
-      # Specialized colorbar for integers
-      cmap = plt.cm.jet
-      cmaplist = [cmap(i) for i in range(cmap.N)]
-      cmaplist[1] = (.5, .5, .5, 1.0)
-      cmap = matplotlib.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, cmap.N)
-      bounds = np.insert(np.linspace(0.5, int(cmax)+0.5, int(cmax)+1), 0, 0)
-      norm = matplotlib.colors.BoundaryNorm(bounds, cmap.N)
-
-    # If using omb then use standard deviation for the cmin/cmax
-    if metric=='omb' or metric=='ombg' or metric=='oman':
-      cmax = stdev
-      cmin = -stdev
-
-    # Override with user chosen limits
-    if (colmin!=None):
-      print("Using user provided minimum for colorbar")
-      cmin = colmin
-    if (colmax!=None):
-      print("Using user provided maximum for colorbar")
-      cmax = colmax
+    # Loop over the figures, the data is prepared here and rendered by the pool
+    # -------------------------------------------------------------------------
+    with figure_pool.FigurePool(workers, shared) as pool:
 
+        for field, metric, chan in itertools.product(fields, metrics, chans):
 
-    # Create figure
-    # -------------
+            odat = read_hofx_data(readers, metric, field, chan)
 
-    fig = plt.figure(figsize=(10, 5))
+            # Figure filename
+            # ---------------
+            field_savename = field
+            if nchans != 0:
+                field_savename = field_savename+"-channel"+str(chan)
+            savename = os.path.join(output_path, field_savename+"_"+metric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
 
-    # initialize the plot pointing to the projection
-    ax = plt.axes(projection=ccrs.PlateCarree(central_longitude=0))
-
-    # plot grid lines
-    gl = ax.gridlines(crs=ccrs.PlateCarree(central_longitude=0), draw_labels=True,
-                      linewidth=1, color='gray', alpha=0.5, linestyle='-')
 
-    gl.xlabel_style = {'size': 10, 'color': 'black'}
-    gl.ylabel_style = {'size': 10, 'color': 'black'}
-    gl.xlocator = mticker.FixedLocator(
-        [-180, -135, -90, -45, 0, 45, 90, 135, 179.9])
-    ax.set_ylabel("Latitude",  fontsize=7)
-    ax.set_xlabel("Longitude", fontsize=7)
+            # Compute and print some stats for the data
+            # -----------------------------------------
+            stdev = np.nanstd(odat, dtype=np.float64)   # Standard deviation
+            omean = np.nanmean(odat, dtype=np.float64)  # Mean of the data
+            datmi = np.nanmin(odat)                     # Min of the data
+            datma = np.nanmax(odat)                     # Max of the data
 
-    ax.tick_params(labelbottom=False, labeltop=False, labelleft=False, labelright=False)
+            print("Plotted data statistics for "+field_savename+" "+metric+": ")
+            print("Mean: ", omean)
+            print("Standard deviation: ", stdev)
+            print("Minimum ", datmi)
+            print("Maximum: ", datma)
 
-    # scatter data
-    sc = ax.scatter(obarray[:, 1], obarray[:, 2],
-                    c=obarray[:, 0], s=4, linewidth=0,
-                    transform=ccrs.PlateCarree(), cmap=cmap, vmin=cmin, vmax = cmax, norm=norm)
 
-    # colorbar
-    cbar = plt.colorbar(sc, ax=ax, orientation="horizontal", pad=.1, fraction=0.06,)
-    if not units==None:
-        cbar.ax.set_ylabel(units, fontsize=10)
-
-    # plot globally
-    ax.set_global()
-
-    # draw coastlines
-    ax.coastlines()
-
-    # figure labels
-    plt.title("Observation statistics: "+field.replace("_"," ")+" "+metric+" | "+
-              window_begin.strftime("%Y%m%d %Hz")+" to "+
-              (window_begin+window_length).strftime("%Y%m%d %Hz"), y=1.08)
-    ax.text(0.45, -0.1,   'Longitude', transform=ax.transAxes, ha='left')
-    ax.text(-0.08, 0.4, 'Latitude', transform=ax.transAxes,
-            rotation='vertical', va='bottom')
-
-    # show plot
-    print(" Saving figure as", savename, "\n")
-    plt.savefig(savename)
+            # Min max for colorbar
+            # --------------------
+            if datmi < 0:
+              cmax = datma
+              cmin = datmi
+              cmap = 'RdBu'
+            else:
+              cmax = omean+stdev
+              cmin = np.maximum(omean-stdev, 0.0)
+              cmap = 'viridis'
+
+            integer_colorbar = metric == 'PreQC' or metric == 'EffectiveQC'
+            if integer_colorbar:
+              cmin = datmi
+              cmax = datma
+
+            # If using omb then use standard deviation for the cmin/cmax
+            if metric=='omb' or metric=='ombg' or metric=='oman':
+              cmax = stdev
+              cmin = -stdev
+
+            # Override with user chosen limits
+            if (colmin!=None):
+              print("Using user provided minimum for colorbar")
+              cmin = colmin
+            if (colmax!=None):
+              print("Using user provided maximum for colorbar")
+              cmax = colmax
+
+
+            # Render the figure
+            # -----------------
+            title = "Observation statistics: "+field.replace("_"," ")+" "+metric+" | "+ \
+                    window_begin.strftime("%Y%m%d %Hz")+" to "+ \
+                    (window_begin+window_length).strftime("%Y%m%d %Hz")
+
+            spec = {'cmin': cmin, 'cmax': cmax, 'cmap': cmap,
+                    'integer colorbar': integer_colorbar, 'datma': datma,
+                    'units': units, 'title': title, 'savename': savename}
+
+            if render_mode == 'density':
+                spec['aggregation'] = aggregation
+                spec['grid'] = utils.density_grid(lons, lats,
+                                                  odat if aggregation == 'mean' else None,
+                                                  (-180.0, 180.0), (-90.0, 90.0),
+                                                  density_nx, density_ny, aggregation)
+            else:
+                spec['odat'] = odat
 
+            pool.submit(_render_map, spec)
 
+    for fh in readers:
+        fh.close()
 
 # --------------------------------------------------------------------------------------------------
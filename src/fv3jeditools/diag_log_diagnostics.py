@@ -0,0 +1,82 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import importlib
+
+import fv3jeditools.applications as applications
+import fv3jeditools.log_parser as log_parser
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package log_diagnostics
+#
+#  This application can be triggered by using "application name: log_diagnostics"
+#
+#  Configuration options:
+#  ----------------------
+#  log file    | The log file to parse the statistics from
+#  diagnostics | Dictionary with the log applications to run as keys and their options as values,
+#                e.g. {da_convergence: {yscale: log}, log_timing: {number of methods: 12}}
+#  log cache   | Keep the statistics parsed from the log in a cache so the log is not parsed again
+#                when only the figure options change [false]
+#  log cache path | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
+#
+#  Options given at the top level, e.g. output path or plot format, are passed to every diagnostic
+#  and can be overridden in the options of each diagnostic.
+#
+#
+#  This function produces the figures of several log applications from a single pass over the log,
+#  rather than reading the log once per application.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Log applications and the names of their consumer and plotting function
+log_applications = {
+  "da_block_convergence": ("DaBlockConvergenceConsumer", "plot_da_block_convergence"),
+  "da_convergence": ("DaConvergenceConsumer", "plot_da_convergence"),
+  "femps_convergence": ("FempsConvergenceConsumer", "plot_femps_convergence"),
+  "log_timing": ("LogTimingConsumer", "plot_log_timing")
+}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_diagnostics(datetime, conf):
+
+    # Log file to parse
+    log_file = log_parser.log_file_name(datetime, conf)
+
+    # Diagnostics to produce
+    diagnostics = utils.configGetOrFail(conf, 'diagnostics')
+
+    # Consumer and configuration of each diagnostic
+    consumers = []
+    plots = []
+    for app_name, app_options in diagnostics.items():
+
+        if app_name not in log_applications:
+            utils.abort('log_diagnostics: \''+app_name+'\' is not one of '+
+                        ', '.join(log_applications.keys()))
+
+        app_conf = {key: value for key, value in conf.items() if key != 'diagnostics'}
+        app_conf.update(app_options or {})
+
+        module = importlib.import_module('fv3jeditools.'+
+                                         applications.application_modules[app_name])
+        consumer_name, plot_name = log_applications[app_name]
+
+        consumer = getattr(module, consumer_name)()
+        consumers.append(consumer)
+        plots.append((app_name, getattr(module, plot_name), app_conf, consumer))
+
+    # Single pass over the log
+    print(" Reading", ", ".join(diagnostics.keys()), "from ", log_file)
+    log_parser.parse_log_configured(log_file, consumers, conf)
+
+    # Figures of each diagnostic
+    for app_name, plot, app_conf, consumer in plots:
+        print(" log_diagnostics: "+app_name)
+        plot(datetime, app_conf, consumer, log_file)
+
+# --------------------------------------------------------------------------------------------------
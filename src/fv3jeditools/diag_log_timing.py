@@ -6,9 +6,8 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-import re
 
-import fv3jeditools.utils as utils
+import fv3jeditools.log_parser as log_parser
 
 # --------------------------------------------------------------------------------------------------
 ## @package log_timing
@@ -20,22 +19,119 @@ import fv3jeditools.utils as utils
 #  log file          | The log file to parse the statistics from
 #  number of methods | Number of methods to show in the pie chart. Code will pick n most expensive [10]
 #  plot format       | The extension used for the file name, png or pdf
+#  log cache         | Keep the tables parsed from the log in a cache so the log is not parsed again
+#                      when only the figure options change [false]
+#  log cache path    | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
+#  load imbalance    | Analyse the load imbalance between MPI tasks from the Parallel Timing
+#                      Statistics table [false]
+#  imbalance minimum percent | Methods whose average time is less than this percentage of the most
+#                      expensive method are left out of the imbalance ranking [1]
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the timing
 #  statistics from the log of a JEDI run, this log file is provided through the yaml.
 #
+#  The log is read with log_parser. The consumer keeps the OOPS_STATS lines of the Timing
+#  Statistics and Parallel Timing Statistics tables as they go past.
+#
+#  With load imbalance the minimum, maximum and average time over the MPI tasks are read for each
+#  method and the imbalance ratio max/avg is computed. A ratio near one means the work is well
+#  shared and more tasks should reduce the time; a large ratio means the tasks spend max - avg
+#  waiting for the slowest one, which more tasks with the same layout will not remove. The methods
+#  are ranked by imbalance ratio in a report and a bar chart.
+#
 # --------------------------------------------------------------------------------------------------
 
-def log_timing(datetime, conf):
+class LogTimingConsumer(log_parser.LogConsumer):
 
+    triggers = ["OOPS_STATS"]
 
-    # Log file to parse
-    # -----------------
-    try:
-        log_file = conf['log file']
-    except:
-        utils.abort('\'log file\' must be present in the configuration')
+    def __init__(self):
+
+        self.raw_timings = []
+        self.par_timings = []
+        self.take_raw = -1
+        self.take_par = -1
+
+    def consume(self, line, following):
+
+        line = line.rstrip()
+        if not line.startswith("OOPS_STATS"):
+            return
+
+        # Each table starts and ends with a line containing its title
+        if "------------------------- Timing Statistics" in line:
+            self.take_raw *= -1
+        if "Parallel Timing Statistics" in line:
+            self.take_par *= -1
+
+        # Extract lines containing raw stats and parallel stats
+        if line.startswith("OOPS_STATS oops"):
+            if self.take_raw == 1:
+                self.raw_timings.append(line)
+            if self.take_par == 1:
+                self.par_timings.append(line)
+
+    def finish(self):
+
+        # Remove the headers and totals
+        del self.raw_timings[0:2]
+        del self.raw_timings[-1:]
+        del self.par_timings[0:3]
+        del self.par_timings[-2:]
+
+    def to_arrays(self):
+
+        return {'raw_timings': np.array(self.raw_timings, dtype=str),
+                'par_timings': np.array(self.par_timings, dtype=str)}
+
+    def from_arrays(self, arrays):
+
+        self.raw_timings = arrays['raw_timings'].tolist()
+        self.par_timings = arrays['par_timings'].tolist()
+
+    def timing_table(self):
+
+        # Method names, total time (ms), number of calls and time per call (ms) from the Timing
+        # Statistics table
+
+        names = np.empty(len(self.raw_timings), dtype='object')
+        total = np.empty(len(self.raw_timings))
+        calls = np.empty(len(self.raw_timings))
+        per_call = np.empty(len(self.raw_timings))
+        for n, raw_timing in enumerate(self.raw_timings):
+            values = raw_timing.split(": ")[1].split()
+            names[n] = raw_timing.split(": ")[0].split()[1]
+            total[n] = float(values[0])
+            try:
+                calls[n] = float(values[1])
+            except ValueError:
+                calls[n] = np.nan
+            per_call[n] = float(values[3])
+
+        return names, total, calls, per_call
+
+    def parallel_table(self):
+
+        # Method names and the minimum, maximum and average time (ms) over the MPI tasks from the
+        # Parallel Timing Statistics table
+
+        names = np.empty(len(self.par_timings), dtype='object')
+        minimum = np.empty(len(self.par_timings))
+        maximum = np.empty(len(self.par_timings))
+        average = np.empty(len(self.par_timings))
+        for n, par_timing in enumerate(self.par_timings):
+            values = par_timing.split(": ")[1].split()
+            names[n] = par_timing.split(": ")[0].split()[1]
+            minimum[n] = float(values[0])
+            maximum[n] = float(values[1])
+            average[n] = float(values[2])
+
+        return names, minimum, maximum, average
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_log_timing(datetime, conf, consumer, log_file):
 
     # Largest N times to plot
     # -----------------------
@@ -62,79 +158,9 @@ def log_timing(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Replace datetime in logfile name
-    # --------------------------------
-    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-    log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
-
-
-    # Read file and gather norm information
-    # -------------------------------------
-    print(" Reading timings from ", log_file)
-
-
-    # Open the file ready for reading
-    # -------------------------------
-    if os.path.exists(log_file):
-        file = open(log_file, "r")
-    else:
-        utils.abort('Log file not found.')
-
-
-    # Get all lines that match the search patterns
-    # --------------------------------------------
-    oops_stats = []
-    reg = re.compile("OOPS_STATS")
-    for line in file:
-        if bool(re.match(reg, line.rstrip())):
-            oops_stats.append(line.rstrip())
-
-
-    # Extract lines containing raw stats
-    # ---------------------------------------
-    search_str = "------------------------- Timing Statistics"
-    reg = re.compile("OOPS_STATS oops")
-    raw_timings = []
-    take_line = -1
-    for oops_stat in oops_stats:
-        if re.search(search_str, oops_stat):
-            take_line *= -1
-        if take_line == 1 and bool(re.match(reg, oops_stat)):
-            raw_timings.append(oops_stat)
-    del raw_timings[0:2]
-
-    # Remove totals
-    del raw_timings[-1]
-
-
-    # Extract lines containing parallel stats
-    # ---------------------------------------
-    search_str = "Parallel Timing Statistics"
-    reg = re.compile("OOPS_STATS oops")
-    par_timings = []
-    take_line = -1
-    for oops_stat in oops_stats:
-        if re.search(search_str, oops_stat):
-            take_line *= -1
-        if take_line == 1 and bool(re.match(reg, oops_stat)):
-            par_timings.append(oops_stat)
-    del par_timings[0:3]
-
-    # Remove totals
-    del par_timings[-2:]
-
-
     # Place times and names in to numpy arrays
     # ----------------------------------------
-    raw_timing_mname = np.empty(len(raw_timings), dtype='object')
-    raw_timing_ttime = np.empty(len(raw_timings))
-    raw_timing_pcall = np.empty(len(raw_timings))
-    n = 0
-    for raw_timing in raw_timings:
-        raw_timing_mname[n] = raw_timing.split(": ")[0].split()[1]
-        raw_timing_ttime[n] = float(raw_timing.split(": ")[1].split()[0])
-        raw_timing_pcall[n] = float(raw_timing.split(": ")[1].split()[3])
-        n += 1
+    raw_timing_mname, raw_timing_ttime, _, raw_timing_pcall = consumer.timing_table()
 
     # Total time for times being considered
     # -------------------------------------
@@ -178,6 +204,7 @@ def log_timing(datetime, conf):
               bbox_to_anchor=(1, 0, 0.5, 1))
     print(" Saving figure as", savename_total, "\n")
     plt.savefig(savename_total)
+    plt.close(fig)
 
     fig, ax = plt.subplots(figsize=(20, 7.5))
     wedges, texts, autotexts = ax.pie(raw_timing_pcall_time_plot, autopct=lambda p: '{:.1f}'.format(p * np.sum(raw_timing_pcall_time_plot) / 100),
@@ -187,5 +214,93 @@ def log_timing(datetime, conf):
               bbox_to_anchor=(1, 0, 0.5, 1))
     print(" Saving figure as", savename_percall, "\n")
     plt.savefig(savename_percall)
+    plt.close(fig)
+
+    # Load imbalance between the MPI tasks
+    # ------------------------------------
+    try:
+        load_imbalance = conf['load imbalance']
+    except:
+        load_imbalance = False
+
+    if load_imbalance:
+        try:
+            minimum_percent = conf['imbalance minimum percent']
+        except:
+            minimum_percent = 1.0
+        plot_load_imbalance(consumer, nplot, minimum_percent,
+                            os.path.join(output_path, savename+"_load_imbalance_"+
+                                         datetime.strftime("%Y%m%d_%H%M%S")), plotformat)
+
+# --------------------------------------------------------------------------------------------------
+
+def plot_load_imbalance(consumer, nplot, minimum_percent, savename, plotformat='png'):
+
+    # Ranked report and bar chart of the imbalance ratio max/avg of each method. The report is saved
+    # as savename.txt and the chart as savename.<plotformat>
+
+    names, minimum, maximum, average = consumer.parallel_table()
+
+    if len(names) == 0:
+        print(" No Parallel Timing Statistics in the log, skipping the load imbalance analysis")
+        return
+
+    # Imbalance ratio and the time the tasks spend waiting for the slowest one
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(average > 0, maximum/average, np.nan)
+    wait = maximum - average
+
+    # Rank the methods that take a significant time
+    significant = average >= minimum_percent/100.0*np.max(average)
+    ranked = [m for m in np.argsort(-np.nan_to_num(ratio, nan=-np.inf)) if significant[m]]
+
+    # Report
+    report = [" Load imbalance between MPI tasks, methods ranked by imbalance ratio (max/avg)",
+              "   {:<60} {:>8} {:>12} {:>12} {:>12} {:>12}".format("Method", "Ratio", "Min (ms)",
+                                                               "Max (ms)", "Avg (ms)", "Wait (ms)")]
+    for m in ranked:
+        report.append("   {:<60} {:8.3f} {:12.2f} {:12.2f} {:12.2f} {:12.2f}".format(
+                      names[m], ratio[m], minimum[m], maximum[m], average[m], wait[m]))
+    if ranked != []:
+        report.append("   Time weighted imbalance ratio of the ranked methods: "+
+                      '{:.3f}'.format(np.sum(maximum[ranked])/np.sum(average[ranked])))
+
+    print("\n"+"\n".join(report)+"\n")
+    with open(savename+".txt", 'w') as fh:
+        fh.write("\n".join(report)+"\n")
+
+    # Bar chart of the most imbalanced methods
+    shown = ranked[:nplot][::-1]
+    fig, ax = plt.subplots(figsize=(20, 7.5))
+    bars = ax.barh(np.arange(len(shown)), ratio[shown])
+    ax.set_yticks(np.arange(len(shown)))
+    ax.set_yticklabels([names[m]+" (avg "+'{:.1f}'.format(average[m])+" ms)" for m in shown])
+    ax.axvline(1.0, color='k', linestyle='--')
+    for bar, m in zip(bars, shown):
+        ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2,
+                " wait "+'{:.1f}'.format(wait[m])+" ms", va='center')
+    plt.title("JEDI load imbalance between MPI tasks per method (max/avg)")
+    plt.xlabel("Imbalance ratio (max/avg)")
+    print(" Saving figure as", savename+"."+plotformat, "\n")
+    plt.savefig(savename+"."+plotformat, bbox_inches='tight')
+    plt.close(fig)
+
+# --------------------------------------------------------------------------------------------------
+
+def log_timing(datetime, conf):
+
+
+    # Log file to parse
+    # -----------------
+    log_file = log_parser.log_file_name(datetime, conf)
+
+
+    # Read file and gather timing information
+    # ---------------------------------------
+    print(" Reading timings from ", log_file)
+    consumer = LogTimingConsumer()
+    log_parser.parse_log_configured(log_file, [consumer], conf)
+
+    plot_log_timing(datetime, conf, consumer, log_file)
 
 # --------------------------------------------------------------------------------------------------
@@ -0,0 +1,224 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import concurrent.futures
+import datetime as dt
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import warnings
+
+import fv3jeditools.columnar_store as columnar_store
+import fv3jeditools.diag_log_timing as diag_log_timing
+import fv3jeditools.log_parser as log_parser
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package log_timing_trend
+#
+#  This application can be triggered by using "application name: log_timing_trend"
+#
+#  Configuration options:
+#  ----------------------
+#  log file             | Template of the log files of the cycles, e.g. hyb-3dvar_%Y%m%d_%H%M%S.run
+#  number of cycles     | Number of cycles, ending at the datetime, to add to the database [1]
+#  cycle frequency      | Hours between cycles [6]
+#  database path        | Directory of the timing database [./timing_database]
+#  number of workers    | Number of processes parsing logs concurrently [1]
+#  number of methods    | Number of most expensive methods shown in the time series [10]
+#  baseline cycles      | Number of previous cycles in the rolling baseline [10]
+#  regression threshold | Percentage increase of the total time of a method over its baseline that
+#                         is reported as a regression [10]
+#  output path          | Path where the figures and the report are saved [./]
+#  plot format          | The extension used for the file name, png or pdf
+#  log cache            | Keep the tables parsed from the logs in a cache [false]
+#  log cache path       | Directory of the cache [$FV3JEDITOOLS_LOG_CACHE or ~/.cache/fv3jeditools/logs]
+#
+#
+#  This function keeps the OOPS_STATS timing tables of many cycles in an append-only columnar
+#  database (columnar_store) with one row per cycle and method: cycle, method, total time, time per
+#  call and number of calls. Cycles already in the database are not parsed again, so the
+#  application can be run every cycle to add the new log.
+#
+#  It plots the time series of the most expensive methods and writes a report of the methods whose
+#  total time at the datetime grew by more than the regression threshold compared with the median
+#  of the baseline cycles before it. A figure is made for each of these methods.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Columns of the timing database
+database_columns = {
+  "cycle": np.int64,
+  "method": str,
+  "total time": np.float64,
+  "time per call": np.float64,
+  "calls": np.float64
+}
+
+# Format of the cycle column
+cycle_format = "%Y%m%d%H%M%S"
+
+# --------------------------------------------------------------------------------------------------
+
+def _parse_cycle(cycle, log_file, conf):
+
+    # Timing table of one cycle, run in the worker processes
+
+    consumer = diag_log_timing.LogTimingConsumer()
+    log_parser.parse_log_configured(log_file, [consumer], conf)
+    names, total, calls, per_call = consumer.timing_table()
+
+    return cycle, names, total, calls, per_call
+
+# --------------------------------------------------------------------------------------------------
+
+def _plot_series(cycles, series, title, ylabel, savename):
+
+    fig, ax = plt.subplots(figsize=(15, 7.5))
+    for label, values in series:
+        ax.plot(cycles, values, linestyle='-', marker='x', label=label)
+    ax.tick_params(labelbottom=True, labeltop=False, labelleft=True, labelright=True)
+    plt.title(title)
+    plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    plt.xlabel("Cycle")
+    plt.ylabel(ylabel)
+    fig.autofmt_xdate()
+    print(" Saving figure as", savename, "\n")
+    plt.savefig(savename, bbox_inches='tight')
+    plt.close(fig)
+
+# --------------------------------------------------------------------------------------------------
+
+def log_timing_trend(datetime, conf):
+
+
+    # Parse configuration
+    # -------------------
+    log_file_template = utils.configGetOrFail(conf, 'log file')
+    ncycles = utils.configGet(conf, 'number of cycles', 1)
+    frequency = utils.configGet(conf, 'cycle frequency', 6)
+    database_path = utils.configGet(conf, 'database path', './timing_database')
+    workers = utils.configGet(conf, 'number of workers', 1)
+    nplot = utils.configGet(conf, 'number of methods', 10)
+    nbaseline = utils.configGet(conf, 'baseline cycles', 10)
+    threshold = utils.configGet(conf, 'regression threshold', 10.0)
+    output_path = utils.configGet(conf, 'output path', './')
+    plotformat = utils.configGet(conf, 'plot format', 'png')
+    utils.createPath(output_path)
+
+
+    # Add the cycles that are not in the database yet
+    # -----------------------------------------------
+    database = columnar_store.ColumnarStore(os.path.expandvars(database_path), database_columns)
+    stored = set(database.read()['cycle'].tolist())
+
+    to_parse = []
+    for n in reversed(range(ncycles)):
+        cycle = datetime - dt.timedelta(hours=n*frequency)
+        key = int(cycle.strftime(cycle_format))
+        if key in stored:
+            continue
+        isodatestr = cycle.strftime("%Y-%m-%dT%H:%M:%S")
+        log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file_template)
+        if not os.path.exists(log_file):
+            print(" log_timing_trend: no log for cycle", cycle, "("+log_file+")")
+            continue
+        to_parse.append((key, log_file))
+
+    print(" log_timing_trend: parsing", len(to_parse), "logs with", workers, "worker(s)")
+    results = []
+    if workers > 1 and len(to_parse) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_parse_cycle, key, log_file, conf)
+                       for key, log_file in to_parse]
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
+    else:
+        for key, log_file in to_parse:
+            results.append(_parse_cycle(key, log_file, conf))
+
+    # Append in cycle order
+    for cycle, names, total, calls, per_call in sorted(results, key=lambda result: result[0]):
+        database.append({'cycle': np.full(len(names), cycle, dtype=np.int64),
+                         'method': list(names), 'total time': total,
+                         'time per call': per_call, 'calls': calls})
+
+
+    # Time series of each method up to the datetime
+    # ---------------------------------------------
+    table = database.read()
+    current = int(datetime.strftime(cycle_format))
+    keep = table['cycle'] <= current
+    table = {name: values[keep] for name, values in table.items()}
+
+    cycles = np.unique(table['cycle'])
+    if current not in cycles:
+        utils.abort('log_timing_trend: no timings for '+str(datetime)+' in the database')
+    cycle_index = np.searchsorted(cycles, table['cycle'])
+    cycle_dates = [dt.datetime.strptime(str(cycle), cycle_format) for cycle in cycles]
+
+    methods = np.unique(table['method'])
+    method_index = np.searchsorted(methods, table['method'])
+
+    # (method, cycle) arrays, NaN where a method did not run in a cycle
+    total_time = np.full((len(methods), len(cycles)), np.nan)
+    total_time[method_index, cycle_index] = table['total time']
+    time_per_call = np.full((len(methods), len(cycles)), np.nan)
+    time_per_call[method_index, cycle_index] = table['time per call']
+
+
+    # Regressions against the rolling baseline
+    # ----------------------------------------
+    latest = total_time[:, -1]
+    baseline_time = total_time[:, max(len(cycles)-1-nbaseline, 0):len(cycles)-1]
+    regressions = []
+    if baseline_time.shape[1] > 0:
+        with np.errstate(all='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            baseline = np.nanmedian(baseline_time, axis=1)
+            change = 100.0*(latest - baseline)/baseline
+        for m in np.argsort(-np.nan_to_num(change, nan=-np.inf)):
+            if np.isfinite(change[m]) and change[m] > threshold:
+                regressions.append((methods[m], latest[m], baseline[m], change[m]))
+
+    report = [" Timing regressions for "+str(datetime)+": methods more than "+str(threshold)+
+              "% slower than the median of the previous "+str(baseline_time.shape[1])+" cycle(s)"]
+    if regressions == []:
+        report.append("   None")
+    for method, time, base, increase in regressions:
+        report.append("   {:<60} {:12.2f} ms  baseline {:12.2f} ms  +{:.1f}%".format(method, time,
+                                                                                   base, increase))
+
+    print("\n"+"\n".join(report)+"\n")
+    savename = os.path.join(output_path, "timing_regressions_"+
+                            datetime.strftime("%Y%m%d_%H%M%S")+".txt")
+    with open(savename, 'w') as fh:
+        fh.write("\n".join(report)+"\n")
+
+
+    # Figures
+    # -------
+    datestr = datetime.strftime("%Y%m%d_%H%M%S")
+
+    # Most expensive methods at the datetime
+    order = np.argsort(-np.nan_to_num(latest, nan=-np.inf))[:nplot]
+    _plot_series(cycle_dates, [(methods[m], total_time[m, :]) for m in order],
+                 "JEDI application timings per method", "Total time (ms)",
+                 os.path.join(output_path, "timing_trend_total_time_"+datestr+"."+plotformat))
+    _plot_series(cycle_dates, [(methods[m], time_per_call[m, :]) for m in order],
+                 "JEDI application timings per method per call", "Time per call (ms)",
+                 os.path.join(output_path, "timing_trend_per_call_"+datestr+"."+plotformat))
+
+    # Methods that regressed
+    for method, time, base, increase in regressions:
+        m = int(np.searchsorted(methods, method))
+        savename = "timing_trend_"+method.replace("::", "-").replace("/", "-").replace(" ", "-")+"_"+datestr+"."+ \
+                   plotformat
+        _plot_series(cycle_dates, [("Total time", total_time[m, :]),
+                                   ("Baseline", np.full(len(cycles), base))],
+                     method+" (+"+'{:.1f}'.format(increase)+"%)", "Total time (ms)",
+                     os.path.join(output_path, savename))
+
+# --------------------------------------------------------------------------------------------------
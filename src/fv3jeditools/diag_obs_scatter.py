@@ -3,11 +3,13 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
+import matplotlib
 import matplotlib.pyplot as plt
-import netCDF4
 import numpy as np
 import os
 
+import fv3jeditools.figure_pool as figure_pool
+import fv3jeditools.ioda_reader as ioda_reader
 import fv3jeditools.utils as utils
 
 # --------------------------------------------------------------------------------------------------
@@ -18,13 +20,56 @@ import fv3jeditools.utils as utils
 #  Configuration options:
 #  ----------------------
 #
-#
+#  ioda experiment files | List of IODA files from the experiment
+#  ioda reference files  | List of IODA files from the reference, same order as the experiment files
+#  experiment metrics    | List of groups to plot from the experiment files, e.g. hofx or omb
+#  reference metrics     | List of groups to plot from the reference files
+#  marker size           | Marker size for the scatter [2]
+#  output path           | Path where the figures are saved [./]
+#  figure file type      | Output format for the figures [png]
+#  ioda cache size       | Memory cap in MB for the arrays cached from each file, or from all the
+#                          files of a pipeline batch together
+#  number of workers     | Number of processes rendering the figures [1]
+#  figure queue depth    | Maximum number of figures waiting to be rendered [2 x number of workers]
+#  render mode           | scatter: one marker per observation, density: number of observations in
+#                          each pixel drawn as an image, for very large numbers of observations [scatter]
+#  density pixels        | Number of pixels along each axis in density mode [400]
 #
 #  This function can be used to plot observation type data comparing two experiments in a scatter
 #
 # --------------------------------------------------------------------------------------------------
 
+def _render_scatter(spec, shared):
+
+    # Create and save one scatter figure from its plot spec
+
+    data_min = spec['data min']
+    data_max = spec['data max']
+    data_dif = data_max - data_min
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    if 'grid' in spec:
+        grid = spec['grid']
+        im = plt.imshow(grid, origin='lower', interpolation='nearest',
+                        extent=[data_min - 0.1*data_dif, data_max + 0.1*data_dif,
+                                data_min - 0.1*data_dif, data_max + 0.1*data_dif],
+                        norm=matplotlib.colors.LogNorm(vmin=1, vmax=max(np.nanmax(grid), 1)))
+        cbar = plt.colorbar(im, ax=ax)
+        cbar.ax.set_ylabel('Number of observations')
+    else:
+        plt.scatter(spec['data ref'], spec['data exp'], s=spec['marker size'])
+    plt.title(spec['title'])
+    plt.ylabel(spec['ylabel'])
+    plt.xlabel(spec['xlabel'])
+    ax.set_aspect('equal', adjustable='box')
+    plt.xlim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
+    plt.ylim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
+    plt.axline((0, 0), slope=1.0, color='k')
+    plt.savefig(spec['savename'])
+    plt.close('all')
 
+# --------------------------------------------------------------------------------------------------
 
 def obs_scatter(datetime, conf):
 
@@ -48,149 +93,182 @@ def obs_scatter(datetime, conf):
     # Figure file type (pdf, png, etc)
     file_type = utils.configGet(conf, 'figure file type', 'png')
 
+    # Memory cap for the arrays cached from each file (MB)
+    cache_size = utils.configGet(conf, 'ioda cache size', ioda_reader.default_max_memory_mb)
 
-    # Loop over hofx files
-    # --------------------
-    for ioda_exp_file, ioda_ref_file in zip(ioda_exp_files, ioda_ref_files):
+    # Number of processes rendering the figures and the number of figures that can be waiting
+    workers = utils.configGet(conf, 'number of workers', 1)
+    queue_depth = utils.configGet(conf, 'figure queue depth', 2*workers)
 
-        # Replace datetime in input filenames
-        isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-        ioda_exp_file = utils.stringReplaceDatetimeTemplate(isodatestr, ioda_exp_file)
-        ioda_ref_file = utils.stringReplaceDatetimeTemplate(isodatestr, ioda_ref_file)
+    # Scatter or density rendering
+    render_mode = utils.configGet(conf, 'render mode', 'scatter')
+    if render_mode not in ['scatter', 'density']:
+        utils.abort('\'render mode\' must be scatter or density')
+    density_pixels = utils.configGet(conf, 'density pixels', 400)
 
-        # Message files being read
-        print(" Experiment file: "+ioda_exp_file)
-        print(" Reference file:  "+ioda_ref_file)
 
-        # Output filename
-        pathfile = os.path.split(ioda_exp_file)
-        source_file = pathfile[1]
+    # Loop over hofx files, the data is prepared here and rendered by the pool
+    # ------------------------------------------------------------------------
+    with figure_pool.FigurePool(workers, queue_depth=queue_depth) as pool:
 
-        # Get platform name
-        platform = source_file.split(".")[4]
-        platform_long_name = utils.ioda_platform_dict(platform)
+        for ioda_exp_file, ioda_ref_file in zip(ioda_exp_files, ioda_ref_files):
 
-        # Open the file
-        fh_exp = netCDF4.Dataset(ioda_exp_file)
-        fh_ref = netCDF4.Dataset(ioda_ref_file)
+            # Replace datetime in input filenames
+            isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+            ioda_exp_file = utils.stringReplaceDatetimeTemplate(isodatestr, ioda_exp_file)
+            ioda_ref_file = utils.stringReplaceDatetimeTemplate(isodatestr, ioda_ref_file)
 
-        # Get potential variables
-        variables = fh_exp.groups['hofx'].variables.keys()
+            # Message files being read
+            print(" Experiment file: "+ioda_exp_file)
+            print(" Reference file:  "+ioda_ref_file)
 
-        # Check for channels
-        try:
-            number_channels = fh_exp.dimensions["nchans"].size
-            has_chan = True
-        except:
-            number_channels = 1
-            has_chan = False
+            # Output filename
+            pathfile = os.path.split(ioda_exp_file)
+            source_file = pathfile[1]
 
-        # Check for similarity of channels
-        if has_chan:
-            channels_exp = fh_exp.variables['nchans'][:]
-            channels_ref = fh_ref.variables['nchans'][:]
-            assert not any(channels_exp != channels_ref), \
-                         "Files being compared have different channels"
+            # Get platform name
+            platform = source_file.split(".")[4]
+            platform_long_name = utils.ioda_platform_dict(platform)
 
-        # Loop over metrics
-        # -----------------
-        for exp_metric, ref_metric in zip(exp_metrics, ref_metrics):
+            # Open the file
+            fh_exp = ioda_reader.open_ioda(ioda_exp_file, cache_size)
+            fh_ref = ioda_reader.open_ioda(ioda_ref_file, cache_size)
 
-            print("\n  Metric: ", exp_metric, " versus ", ref_metric)
+            # Get potential variables
+            variables = fh_exp.variables('hofx')
 
-            # Long names for metrics
-            exp_metric_long_name = utils.ioda_group_dict(exp_metric)
-            ref_metric_long_name = utils.ioda_group_dict(ref_metric)
+            # Check for channels
+            number_channels = fh_exp.dimension("nchans")
+            has_chan = number_channels != 0
+            if not has_chan:
+                number_channels = 1
 
-            # Loop over variables
-            # -------------------
-            for variable in variables:
+            # Check for similarity of channels
+            if has_chan:
+                channels_exp = fh_exp.read(None, 'nchans')
+                channels_ref = fh_ref.read(None, 'nchans')
+                assert not any(channels_exp != channels_ref), \
+                             "Files being compared have different channels"
 
-                variable_name = variable
-                variable_name_no_ = variable.replace("_", " ")
-                variable_name_no_ = variable_name_no_.capitalize()
-                variable_name_no_fix = variable_name_no_
+            # Loop over metrics
+            # -----------------
+            for exp_metric, ref_metric in zip(exp_metrics, ref_metrics):
 
-                # Loop over channels
-                # -------------------
-                for channel_idx in range(number_channels):
+                print("\n  Metric: ", exp_metric, " versus ", ref_metric)
 
+                # Long names for metrics
+                exp_metric_long_name = utils.ioda_group_dict(exp_metric)
+                ref_metric_long_name = utils.ioda_group_dict(ref_metric)
 
-                    # Read the data
-                    # -------------
-                    if has_chan:
+                # Loop over variables
+                # -------------------
+                for variable in variables:
 
-                        channel = channels_exp[channel_idx]
+                    variable_name = variable
+                    variable_name_no_ = variable.replace("_", " ")
+                    variable_name_no_ = variable_name_no_.capitalize()
+                    variable_name_no_fix = variable_name_no_
 
-                        # Add channel number to name
-                        variable_name     = variable             + "-channel_" + str(channel)
-                        variable_name_no_ = variable_name_no_fix + " channel " + str(channel)
+                    # Read the whole (nlocs, nchans) block once, channels are views into it
+                    # ------------------------------------------------------------------------
+                    block_exp = utils.read_ioda_variable(fh_exp, exp_metric, variable)
+                    block_ref = utils.read_ioda_variable(fh_ref, ref_metric, variable)
 
-                        print("\n    Variable: ", variable_name_no_, "(", str(channel_idx+1),
-                              " of ", str(number_channels),")\n")
+                    # Valid locations for all channels at once, missing values are < -10e10
+                    valid_block = ~np.ma.getmaskarray(block_exp) & \
+                                  ~np.ma.getmaskarray(block_ref) & \
+                                  (np.ma.getdata(block_exp) >= -10e10) & \
+                                  (np.ma.getdata(block_ref) >= -10e10)
+                    block_exp = np.ma.getdata(block_exp)
+                    block_ref = np.ma.getdata(block_ref)
 
-                        data_exp = utils.read_ioda_variable(fh_exp, exp_metric, variable, channel_idx)
-                        data_ref = utils.read_ioda_variable(fh_ref, ref_metric, variable, channel_idx)
+                    # Loop over channels
+                    # -------------------
+                    for channel_idx in range(number_channels):
 
-                    else:
 
-                        print("\n    Variable: ", variable_name_no_, "\n")
+                        # Select the data
+                        # ---------------
+                        if has_chan:
 
-                        data_exp = utils.read_ioda_variable(fh_exp, exp_metric, variable)
-                        data_ref = utils.read_ioda_variable(fh_ref, ref_metric, variable)
+                            channel = channels_exp[channel_idx]
 
+                            # Add channel number to name
+                            variable_name     = variable             + "-channel_" + str(channel)
+                            variable_name_no_ = variable_name_no_fix + " channel " + str(channel)
 
-                    # Remove missing values (<-10e10)
-                    # -------------------------------
-                    remove_idx_exp = np.where(data_exp < -10e10)[0]
-                    remove_idx_ref = np.where(data_ref < -10e10)[0]
-                    remove_idx = np.unique(np.concatenate([remove_idx_exp,remove_idx_ref]))
+                            print("\n    Variable: ", variable_name_no_, "(", str(channel_idx+1),
+                                  " of ", str(number_channels),")\n")
+
+                            data_exp = block_exp[:, channel_idx]
+                            data_ref = block_ref[:, channel_idx]
+                            valid = valid_block[:, channel_idx]
 
-                    make_plot = True
-                    if len(remove_idx) > 0:
-                        print('      Missing values: removing ', len(remove_idx), ' values. ',
-                              'Original number of locations:', len(data_exp))
-                        if (len(remove_idx) != len(data_exp)):
-                            data_exp = np.delete(data_exp, remove_idx)
-                            data_ref = np.delete(data_ref, remove_idx)
                         else:
-                            make_plot = False
-                            print('      No data for this variable/channel, skip plotting')
-
-
-                    # Create and save the figure
-                    # --------------------------
-                    if make_plot:
-                        print("      Creating figure")
-
-                        # Create output filename
-                        output_path_fig = os.path.join(output_path, platform, variable_name)
-                        utils.createPath(output_path_fig)
-                        output_file = source_file.split(".")
-                        output_file[4] = output_file[4]+'-'+exp_metric+'_vs_'+ref_metric
-                        output_file = os.path.join(output_path_fig, ".".join(output_file))
-                        output_file = os.path.splitext(output_file)[0]+'.'+file_type
-
-                        # Limits for the figure
-                        data_min = min(min(data_exp), min(data_ref))
-                        data_max = max(max(data_exp), max(data_ref))
-                        data_dif = data_max - data_min
-
-                        # Create and save figure
-                        fig = plt.figure()
-                        ax = fig.add_subplot(111)
-                        plt.scatter(data_ref, data_exp, s=marker_size)
-                        plt.title(platform_long_name + ' | ' + variable_name_no_)
-                        plt.ylabel(exp_metric_long_name)
-                        plt.xlabel(ref_metric_long_name)
-                        ax.set_aspect('equal', adjustable='box')
-                        plt.xlim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
-                        plt.ylim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
-                        plt.axline((0, 0), slope=1.0, color='k')
-                        plt.savefig(output_file)
-                        plt.close('all')
-
-        # Close files
-        fh_exp.close()
-        fh_ref.close()
-        print("\n\n\n")
+
+                            print("\n    Variable: ", variable_name_no_, "\n")
+
+                            data_exp = block_exp
+                            data_ref = block_ref
+                            valid = valid_block
+
+
+                        # Remove missing values (<-10e10)
+                        # -------------------------------
+                        number_missing = len(valid) - np.count_nonzero(valid)
+
+                        make_plot = True
+                        if number_missing > 0:
+                            print('      Missing values: removing ', number_missing, ' values. ',
+                                  'Original number of locations:', len(data_exp))
+                            if (number_missing != len(data_exp)):
+                                data_exp = data_exp[valid]
+                                data_ref = data_ref[valid]
+                            else:
+                                make_plot = False
+                                print('      No data for this variable/channel, skip plotting')
+
+
+                        # Create and save the figure
+                        # --------------------------
+                        if make_plot:
+                            print("      Creating figure")
+
+                            # Create output filename
+                            output_path_fig = os.path.join(output_path, platform, variable_name)
+                            utils.createPath(output_path_fig)
+                            output_file = source_file.split(".")
+                            output_file[4] = output_file[4]+'-'+exp_metric+'_vs_'+ref_metric
+                            output_file = os.path.join(output_path_fig, ".".join(output_file))
+                            output_file = os.path.splitext(output_file)[0]+'.'+file_type
+
+                            # Limits for the figure
+                            data_min = min(np.min(data_exp), np.min(data_ref))
+                            data_max = max(np.max(data_exp), np.max(data_ref))
+
+                            spec = {'data min': data_min, 'data max': data_max,
+                                    'marker size': marker_size,
+                                    'title': platform_long_name + ' | ' + variable_name_no_,
+                                    'ylabel': exp_metric_long_name,
+                                    'xlabel': ref_metric_long_name,
+                                    'savename': output_file}
+
+                            # Density mode hands the pool the binned counts instead of the points
+                            if render_mode == 'density':
+                                data_dif = data_max - data_min
+                                limits = (data_min - 0.1*data_dif, data_max + 0.1*data_dif)
+                                spec['grid'] = utils.density_grid(data_ref, data_exp, None, limits,
+                                                                  limits, density_pixels,
+                                                                  density_pixels)
+                            else:
+                                spec['data exp'] = data_exp
+                                spec['data ref'] = data_ref
+
+                            # Hand the figure to the rendering pool
+                            pool.submit(_render_scatter, spec)
+
+            # Close files
+            fh_exp.close()
+            fh_ref.close()
+            print("\n\n\n")
+
@@ -0,0 +1,205 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import collections
+import concurrent.futures
+import itertools
+import netCDF4
+import numpy as np
+import os
+
+import fv3jeditools.cubesphere_reader as cubesphere_reader
+import fv3jeditools.running_statistics as running_statistics
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package ensemble_statistics
+#
+#  This application can be triggered by using "application name: ensemble_statistics"
+#
+#  Configuration options:
+#  ----------------------
+#  ensemble file     | Template of the member files, with the member pattern and datetime templates,
+#                      e.g. /data/%Y%m%d%H/mem%mem%/bvars.fv_core.res.nc
+#  number of members | Number of members
+#  first member      | Number of the first member [1]
+#  member pattern    | Pattern replaced by the member number in the ensemble file [%mem%]
+#  member digits     | Number of digits of the member number, padded with zeros [3]
+#  variables         | Variables to compute the statistics of
+#  levels            | Levels, numbered from 1, to compute the statistics of [all levels]
+#  file layout       | gfs (one file per tile) or geos (tiles along nf) [detected from the files]
+#  skewness          | Also compute the skewness [false]
+#  reader processes  | Number of processes reading members ahead of the accumulation [2]
+#  output file       | Template of the output file, written as the six tile files of the gfs layout,
+#                      e.g. ./ens_stats.fv_core.res.%Y%m%d_%H%M%S.nc
+#
+#
+#  This function computes the ensemble mean, standard deviation and optionally skewness of
+#  cube-sphere fields. For every variable the members are read one at a time with
+#  cubesphere_reader and added to a running_statistics accumulator, so the memory used is that of
+#  the accumulator and of the members being read, whatever the size of the ensemble. Members are
+#  read by a small pool of processes while earlier members are added to the statistics, processes
+#  rather than threads since netCDF4 with HDF5 is not thread-safe. At most reader processes members
+#  are read ahead, each is copied once from its reader process, so the memory used grows with the
+#  number of reader processes. With 1 reader process members are read in this process.
+#
+#  The output has the variables <variable>_mean, <variable>_stddev and <variable>_skewness. The
+#  standard deviation is the sample standard deviation (divided by the number of members minus one).
+#
+# --------------------------------------------------------------------------------------------------
+
+def member_file(template, member, pattern, digits, datetime):
+
+    # File of a member, the member is replaced first since %m is also a datetime template
+
+    member_template = template.replace(pattern, str(member).zfill(digits))
+    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+
+    return utils.stringReplaceDatetimeTemplate(isodatestr, member_template)
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_member(filename, variable, levels, layout):
+
+    # Field of one member, run in the reader processes
+
+    return cubesphere_reader.read_field(filename, variable, levels, layout)[0]
+
+# --------------------------------------------------------------------------------------------------
+
+def accumulate_members(files, variable, levels, layout, statistics, readers):
+
+    # Add the members in files to the statistics, with at most readers members read ahead
+
+    if readers <= 1:
+        for filename in files:
+            statistics.update(_read_member(filename, variable, levels, layout)[np.newaxis])
+        return statistics
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=readers) as executor:
+
+        files = iter(files)
+        pending = collections.deque(executor.submit(_read_member, filename, variable, levels,
+                                                    layout)
+                                    for filename in itertools.islice(files, readers))
+
+        while pending:
+            field = pending.popleft().result()
+            filename = next(files, None)
+            if filename is not None:
+                pending.append(executor.submit(_read_member, filename, variable, levels, layout))
+            statistics.update(field[np.newaxis])
+            del field
+
+    return statistics
+
+# --------------------------------------------------------------------------------------------------
+
+def _create_variable(fh, name, nz, ny, nx, long_name, units):
+
+    # Variable (Time, zaxis, yaxis, xaxis) of a tile file, with a z axis of size nz
+
+    zaxis = None
+    for dimension in fh.dimensions.values():
+        if dimension.name.startswith('zaxis_') and dimension.size == nz:
+            zaxis = dimension.name
+    if zaxis is None:
+        zaxis = 'zaxis_'+str(len([dim for dim in fh.dimensions if dim.startswith('zaxis_')])+1)
+        fh.createDimension(zaxis, nz)
+        fh.createVariable(zaxis, 'f4', (zaxis,))[:] = np.arange(1, nz+1)
+
+    var = fh.createVariable(name, 'f4', ('Time', zaxis, 'yaxis_1', 'xaxis_1'), fill_value=np.nan)
+    var.long_name = long_name
+    var.units = units
+
+    return var
+
+# --------------------------------------------------------------------------------------------------
+
+def ensemble_statistics(datetime, conf):
+
+
+    # Parse configuration
+    # -------------------
+    ensemble_file = utils.configGetOrFail(conf, 'ensemble file')
+    nmembers = utils.configGetOrFail(conf, 'number of members')
+    first_member = utils.configGet(conf, 'first member', 1)
+    pattern = utils.configGet(conf, 'member pattern', '%mem%')
+    digits = utils.configGet(conf, 'member digits', 3)
+    variables = utils.configGetOrFail(conf, 'variables')
+    levels = conf.get('levels')
+    layout = conf.get('file layout')
+    skewness = utils.configGet(conf, 'skewness', False)
+    readers = utils.configGet(conf, 'reader processes', 2)
+    output_file = utils.configGetOrFail(conf, 'output file')
+
+    if nmembers < 2:
+        utils.abort('ensemble_statistics: at least two members are needed')
+    if '.nc' not in output_file:
+        utils.abort('ensemble_statistics: output file should end with .nc, the tile files are '+
+                    'named by replacing it with .tileN.nc')
+
+    files = [member_file(ensemble_file, member, pattern, digits, datetime)
+             for member in range(first_member, first_member+nmembers)]
+
+    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+    output_file = utils.stringReplaceDatetimeTemplate(isodatestr, output_file)
+    if os.path.dirname(output_file) != '':
+        utils.createPath(os.path.dirname(output_file))
+
+
+    # Statistics of each variable, written to the six tile files
+    # ----------------------------------------------------------
+    tiles = [None]*6
+    try:
+
+        for variable in variables:
+
+            if layout is None:
+                layout = cubesphere_reader.file_layout(files[0], variable)
+
+            nlev = cubesphere_reader.field_levels(files[0], variable, layout)
+            variable_levels = levels if levels is not None else list(range(1, max(nlev, 1)+1))
+
+            print(" ensemble_statistics: "+variable+" from "+str(nmembers)+" members")
+            first, units, long_name = cubesphere_reader.read_field(files[0], variable,
+                                                                   variable_levels, layout)
+            statistics = running_statistics.RunningStatistics(first.shape, skewness=skewness)
+            statistics.update(first[np.newaxis])
+            del first
+            accumulate_members(files[1:], variable, variable_levels, layout, statistics, readers)
+
+            nz, ny, nx = statistics.mean.shape[1:]
+            if tiles[0] is None:
+                for itile in range(6):
+                    tiles[itile] = netCDF4.Dataset(cubesphere_reader.tile_file(output_file, itile),
+                                                   'w')
+                    tiles[itile].createDimension('xaxis_1', nx)
+                    tiles[itile].createDimension('yaxis_1', ny)
+                    tiles[itile].createDimension('Time', None)
+
+            outputs = [('mean', 'ensemble mean of ', statistics.mean),
+                       ('stddev', 'ensemble standard deviation of ', statistics.stddev(ddof=1))]
+            if skewness:
+                outputs.append(('skewness', 'ensemble skewness of ', statistics.skewness()))
+
+            for suffix, description, values in outputs:
+                for itile in range(6):
+                    var = _create_variable(tiles[itile], variable+'_'+suffix, nz, ny, nx,
+                                           description+long_name,
+                                           units if suffix != 'skewness' else '1')
+                    var[0, :, :, :] = values[itile].astype(np.float32)
+
+            del statistics, outputs
+
+    finally:
+        for fh in tiles:
+            if fh is not None:
+                fh.close()
+
+    print(" ensemble_statistics: written "+cubesphere_reader.tile_file(output_file, 0)+
+          " to tile6")
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,157 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import collections
+import concurrent.futures
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package figure_pool
+#
+#  Pool of processes that render figures with the Agg backend. Applications prepare lightweight plot
+#  specifications (arrays and labels) and submit them with a render function. The render function
+#  must be defined at module level and is called as render(spec, shared).
+#
+#  shared is a dictionary of data used by every figure, e.g. the longitudes and latitudes of the
+#  observations. It is handed to each worker once when the worker starts rather than with every
+#  figure.
+#
+#  At most queue_depth figures (default twice the number of workers) are pending at any time.
+#  Submitting another one waits for the oldest to finish, which caps the memory held by the specs
+#  waiting to be rendered.
+#
+#  A figure that fails does not stop the others. The failures are reported in the order the
+#  figures were submitted once all figures are done, and the application is then aborted.
+#
+#  With one worker the figures are rendered in the calling process.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Data shared by all figures rendered in this worker process
+_shared = {}
+
+# --------------------------------------------------------------------------------------------------
+
+def _initialize(shared):
+
+    global _shared
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    _shared = shared
+
+# --------------------------------------------------------------------------------------------------
+
+def _render(render, spec, shared):
+
+    import matplotlib.pyplot as plt
+
+    try:
+        render(spec, shared)
+    finally:
+        plt.close('all')
+
+# --------------------------------------------------------------------------------------------------
+
+def _render_in_worker(render, spec):
+
+    _render(render, spec, _shared)
+
+# --------------------------------------------------------------------------------------------------
+
+class FigurePool(object):
+
+    def __init__(self, workers=1, shared=None, queue_depth=None):
+
+        if queue_depth is None:
+            queue_depth = 2*workers
+
+        self.shared = {} if shared is None else shared
+        self.queue_depth = max(queue_depth, 1)
+        self.pending = collections.deque()
+        self.errors = []
+        self.submitted = 0
+        self.executor = None
+        if workers > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                                   initializer=_initialize,
+                                                                   initargs=(self.shared,))
+
+    def submit(self, render, spec, label=None):
+
+        # Label used to report a failure, by default the file the figure is saved to
+        if label is None:
+            label = str(spec.get('savename', ''))
+
+        self.submitted = self.submitted + 1
+
+        if self.executor is None:
+            try:
+                _render(render, spec, self.shared)
+            except Exception as e:
+                self.errors.append((self.submitted, label, repr(e)))
+            return
+
+        # Bound the number of pending figures
+        while len(self.pending) >= self.queue_depth:
+            self._collect()
+
+        future = self.executor.submit(_render_in_worker, render, spec)
+        self.pending.append((self.submitted, label, future))
+
+    def _collect(self):
+
+        # Wait for the oldest pending figure so errors are recorded in submission order
+
+        number, label, future = self.pending.popleft()
+        try:
+            future.result()
+        except concurrent.futures.CancelledError:
+            pass
+        except BaseException as e:
+            self.errors.append((number, label, repr(e)))
+
+    def wait(self):
+
+        # Wait for all the figures and report the failures in submission order
+
+        try:
+            while len(self.pending) > 0:
+                self._collect()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+        if self.errors != []:
+            print(" figure_pool:", len(self.errors), "of", self.submitted, "figures failed:")
+            for number, label, message in self.errors:
+                print("   figure", number, label+":", message)
+            errors = len(self.errors)
+            self.errors = []
+            utils.abort("figure_pool: "+str(errors)+" figure(s) failed")
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        # Do not mask an error raised while preparing the figures
+        if exc_type is not None:
+            for _, _, future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            self.errors = []
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+            return
+
+        self.wait()
+
+# --------------------------------------------------------------------------------------------------
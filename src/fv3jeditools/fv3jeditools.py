@@ -4,6 +4,7 @@
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
 import click
+import concurrent.futures
 import fv3jeditools
 from ruamel.yaml import YAML
 
@@ -16,12 +17,54 @@ from ruamel.yaml import YAML
 #   - Datetime in ISO format, allowable formats listed in fv3jeditools.utils_datetime
 #   - Configuration yaml file, e.g. application.yaml
 #
+#  Optional arguments (range mode):
+#   --final     | Final datetime in ISO format. When given the application is run for every cycle
+#                 from the positional datetime to the final datetime
+#   --frequency | Hours between cycles in range mode [6]
+#   --workers   | Number of worker processes the cycles are spread over in range mode [1]
+#
+# --------------------------------------------------------------------------------------------------
+
+def _run_cycle(app_name, datetime, app_conf):
+
+    success, message = fv3jeditools.run_application(app_name, datetime, app_conf)
+
+    return datetime, success, message
+
+# --------------------------------------------------------------------------------------------------
+
+def _run_cycles(app_name, app_conf, datetimes, workers):
+
+    results = []
+
+    # Run in this process when only one worker is requested
+    if workers <= 1:
+        for datetime in datetimes:
+            results.append(_run_cycle(app_name, datetime, app_conf))
+        return results
+
+    # Otherwise spread the cycles over a pool of processes. The application module is imported here
+    # so that forked workers inherit it rather than importing it for every cycle.
+    fv3jeditools.get_application(app_name)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_cycle, app_name, datetime, app_conf)
+                   for datetime in datetimes]
+        for future in concurrent.futures.as_completed(futures):
+            datetime, success, message = future.result()
+            print(" fv3jeditools: cycle", datetime, "finished", "" if success else "with failure")
+            results.append((datetime, success, message))
+
+    return sorted(results, key=lambda result: result[0])
+
 # --------------------------------------------------------------------------------------------------
 
 @click.command()
 @click.argument('isodatetime')
 @click.argument('config')
-def main(isodatetime, config):
+@click.option('--final', default=None, help='Final ISO datetime, run every cycle up to this time')
+@click.option('--frequency', default=6, type=int, help='Hours between cycles in range mode [6]')
+@click.option('--workers', default=1, type=int, help='Number of worker processes in range mode [1]')
+def main(isodatetime, config, final, frequency, workers):
 
     # Configure the yaml object
     yaml = YAML(typ='safe')
@@ -49,15 +92,60 @@ def main(isodatetime, config):
     # Remove application name key
     del app_conf['application name']
 
+    # Single cycle mode
+    # -----------------
+    if final is None:
+
+        # Print information
+        print("\n")
+        print("fv3jeditools: calling application "+app_name+" with the config \n")
+        print(app_conf)
+        print("and datetime: ", datetime)
+        print("\n")
+
+        # Execute the application
+        fv3jeditools.get_application(app_name)(datetime, app_conf)
+
+        return
+
+    # Range mode
+    # ----------
+    datetime_final = fv3jeditools.utils_datetime.stringToDateTime(final)
+    if datetime_final < datetime:
+        fv3jeditools.utils.abort("In fv3-jedi-tool driver final datetime is before start datetime")
+
+    # Expand the range into the cycles to process
+    dtformat = fv3jeditools.utils_datetime.dtformat_jedi
+    datetimes = fv3jeditools.utils.getDateTimes(datetime.strftime(dtformat),
+                                                datetime_final.strftime(dtformat),
+                                                frequency*3600, dtformat)
+
     # Print information
     print("\n")
     print("fv3jeditools: calling application "+app_name+" with the config \n")
     print(app_conf)
-    print("and datetime: ", datetime)
+    print("for", len(datetimes), "cycles from", datetimes[0], "to", datetimes[-1],
+          "using", workers, "worker(s)")
+    print("\n")
+
+    # Execute the application for every cycle
+    results = _run_cycles(app_name, app_conf, datetimes, workers)
+
+    # Summary of the cycles
+    print("\n")
+    print("fv3jeditools: summary for application "+app_name)
+    failures = 0
+    for datetime, success, message in results:
+        if success:
+            print("  ", datetime, " success")
+        else:
+            failures = failures + 1
+            print("  ", datetime, " FAILED: "+message)
+    print("fv3jeditools:", len(results)-failures, "of", len(results), "cycles succeeded")
     print("\n")
 
-    # Execute the application
-    getattr(fv3jeditools, app_name)(datetime, app_conf)
+    if failures > 0:
+        fv3jeditools.utils.abort(str(failures)+" of "+str(len(results))+" cycles failed")
 
 # --------------------------------------------------------------------------------------------------
 
@@ -0,0 +1,255 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import collections
+import contextlib
+import netCDF4
+import numpy as np
+import os
+
+# --------------------------------------------------------------------------------------------------
+## @package ioda_reader
+#
+#  Reader for IODA observation files that keeps the arrays it has read in memory. Applications open
+#  files with open_ioda. Inside a sharing() block every application asking for the same file gets
+#  the same reader, so arrays read by one application are reused by the next one rather than being
+#  read from disk again. This is how the pipeline application shares data between its steps.
+#
+#  Each reader holds at most max_memory bytes of arrays. When a new array does not fit, the least
+#  recently used arrays are evicted. Arrays larger than the cap are returned without being cached.
+#  Inside a sharing() block the readers of all files hold their arrays in one cache, keyed by file,
+#  group and variable, so the cap applies to all the files of the block together rather than to
+#  each of them. The counters of cache hits, misses and evictions are printed when the reader, or
+#  the sharing block, is closed and can be used to size the cap.
+#
+#  Groups that are not in the files but derived from them, such as omb, are computed from the
+#  cached input arrays.
+#
+#  The arrays returned are the cached arrays themselves, which other applications may also be
+#  given, so they are made read-only. Callers that need to modify an array must copy it first.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Default cap on the memory held by one reader, or by all the readers of a sharing block (MB), can be
+# set with FV3JEDITOOLS_IODA_CACHE_MB
+default_max_memory_mb = int(os.environ.get("FV3JEDITOOLS_IODA_CACHE_MB", 2048))
+
+# Derived groups and the groups they are computed from (first minus second)
+derived_groups = {
+  "omb": ("ObsValue", "hofx"),
+  "Gsiomb": ("ObsValue", "GsiHofX"),
+  "GsiombBc": ("ObsValue", "GsiHofXBc")
+}
+
+# Readers shared between applications, keyed by absolute file path, and the cache they hold their
+# arrays in (None when not sharing)
+_shared_readers = None
+_shared_cache = None
+
+# --------------------------------------------------------------------------------------------------
+
+class ArrayCache(object):
+
+    def __init__(self, max_memory_mb=None):
+
+        # Least recently used arrays, holding at most max_memory_mb
+
+        if max_memory_mb is None:
+            max_memory_mb = default_max_memory_mb
+
+        self.max_memory = int(max_memory_mb*1024*1024)
+        self.arrays = collections.OrderedDict()
+        self.memory = 0
+        self.evictions = 0
+
+    def get(self, key):
+
+        # Cached array for the key, or None
+
+        data = self.arrays.get(key)
+        if data is not None:
+            self.arrays.move_to_end(key)
+
+        return data
+
+    def insert(self, key, data):
+
+        # Add an array, evicting the least recently used arrays to make room
+
+        if data.nbytes > self.max_memory:
+            return
+
+        while self.memory + data.nbytes > self.max_memory:
+            _, evicted = self.arrays.popitem(last=False)
+            self.memory = self.memory - evicted.nbytes
+            self.evictions = self.evictions + 1
+
+        self.arrays[key] = data
+        self.memory = self.memory + data.nbytes
+
+    def limit(self, max_memory_mb):
+
+        # Lower the cap to max_memory_mb if it is smaller, evicting arrays that no longer fit
+
+        self.max_memory = min(self.max_memory, int(max_memory_mb*1024*1024))
+        while self.memory > self.max_memory:
+            _, evicted = self.arrays.popitem(last=False)
+            self.memory = self.memory - evicted.nbytes
+            self.evictions = self.evictions + 1
+
+    def clear(self):
+
+        self.arrays = collections.OrderedDict()
+        self.memory = 0
+
+    def report(self, name):
+
+        print(" ioda_reader: "+name+": evictions", self.evictions,
+              "memory {:.1f} of {:.1f} MB".format(self.memory/1024**2, self.max_memory/1024**2))
+
+# --------------------------------------------------------------------------------------------------
+
+class IodaReader(object):
+
+    def __init__(self, filename, shared=False, max_memory_mb=None, cache=None):
+
+        # Shared readers are given the cache of the sharing block, others have their own
+
+        self.filename = filename
+        self.path = os.path.abspath(filename)
+        self.shared = shared
+        self.cache = cache if cache is not None else ArrayCache(max_memory_mb)
+        self.fh = netCDF4.Dataset(filename)
+        self.hits = 0
+        self.misses = 0
+
+    def dimension(self, name, default=0):
+
+        # Size of a dimension, or the default when the file does not have it
+
+        try:
+            return self.fh.dimensions[name].size
+        except:
+            return default
+
+    def variables(self, group):
+
+        # Names of the variables in a group
+
+        return list(self.fh.groups[group].variables.keys())
+
+    def read(self, group, variable):
+
+        # Complete array for group/variable. Group None refers to the variables at the root of the
+        # file. Arrays come from the cache when possible and are read from the file otherwise.
+
+        key = (self.path, group, variable)
+        data = self.cache.get(key)
+        if data is not None:
+            self.hits = self.hits + 1
+            return data
+
+        self.misses = self.misses + 1
+
+        if group in derived_groups:
+            data = self.read(derived_groups[group][0], variable) - \
+                   self.read(derived_groups[group][1], variable)
+        elif group is None:
+            data = self.fh.variables[variable][:]
+        else:
+            data = self.fh.groups[group].variables[variable][:]
+
+        _read_only(data)
+        self.cache.insert(key, data)
+
+        return data
+
+    def statistics(self):
+
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.cache.evictions,
+                'memory': self.cache.memory}
+
+    def report(self):
+
+        # Evictions and memory of a shared reader are those of the sharing block, reported with it
+
+        if self.shared:
+            print(" ioda_reader: "+os.path.basename(self.filename)+": cache hits", self.hits,
+                  "misses", self.misses)
+        else:
+            print(" ioda_reader: "+os.path.basename(self.filename)+": cache hits", self.hits,
+                  "misses", self.misses, "evictions", self.cache.evictions,
+                  "memory {:.1f} of {:.1f} MB".format(self.cache.memory/1024**2,
+                                                      self.cache.max_memory/1024**2))
+
+    def close(self):
+
+        # Shared readers stay open until the end of the sharing block
+
+        if not self.shared:
+            self._close()
+
+    def _close(self):
+
+        if self.hits + self.misses > 0:
+            self.report()
+        if not self.shared:
+            self.cache.clear()
+        self.fh.close()
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_only(data):
+
+    # Make an array, and the mask of a masked array, read-only
+
+    data.setflags(write=False)
+    mask = np.ma.getmask(data)
+    if mask is not np.ma.nomask:
+        mask.setflags(write=False)
+
+# --------------------------------------------------------------------------------------------------
+
+def open_ioda(filename, max_memory_mb=None):
+
+    # Return a reader for the file, reusing the shared one if there is one
+
+    if _shared_readers is None:
+        return IodaReader(filename, max_memory_mb=max_memory_mb)
+
+    # A smaller cap asked for by an application applies to the whole sharing block
+    if max_memory_mb is not None:
+        _shared_cache.limit(max_memory_mb)
+
+    key = os.path.abspath(filename)
+    if key not in _shared_readers:
+        _shared_readers[key] = IodaReader(filename, shared=True, cache=_shared_cache)
+
+    return _shared_readers[key]
+
+# --------------------------------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def sharing(max_memory_mb=None):
+
+    # Within this block readers, and the arrays they hold, are shared between applications. The
+    # arrays of all the readers are held in one cache of at most max_memory_mb.
+
+    global _shared_readers, _shared_cache
+
+    _shared_readers = {}
+    _shared_cache = ArrayCache(max_memory_mb)
+    try:
+        yield
+    finally:
+        for reader in _shared_readers.values():
+            reader._close()
+        if _shared_readers:
+            _shared_cache.report("shared readers")
+        _shared_cache.clear()
+        _shared_readers = None
+        _shared_cache = None
+
+# --------------------------------------------------------------------------------------------------
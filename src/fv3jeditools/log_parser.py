@@ -0,0 +1,619 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import bz2
+import collections
+import copy
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import lzma
+import mmap
+import numpy as np
+import os
+import re
+import tempfile
+import time
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package log_parser
+#
+#  Single pass parser for JEDI log files. The applications that read logs (da_convergence,
+#  da_block_convergence, log_timing, femps_convergence) each provide a consumer describing the
+#  lines they need. One pass over the file feeds every consumer, so several diagnostics of the same
+#  log cost one read of the log.
+#
+#  A consumer lists substrings in triggers. Each line containing one of them is passed to the
+#  consume method of the consumer together with the lookahead lines that follow it, which is how
+#  multi-line blocks such as the minimizer iteration reports are read. The parser only holds the
+#  current line and the lookahead lines in memory, whatever the size of the log.
+#
+#  When all lines have been read the finish method of each consumer is called.
+#
+#  Plain text logs are memory-mapped and searched for the triggers with compiled bytes expressions
+#  over the whole buffer, one expression per trigger since a single literal is searched much faster
+#  than an alternation. Only the lines containing a trigger and their lookahead lines are decoded,
+#  the rest of the log, usually most of it, is never turned into Python strings.
+#
+#  Logs compressed with gzip, bzip2, xz or zstd (zstd needs the optional zstandard package) are
+#  recognised from their first bytes and decompressed as they are read, so they do not need to be
+#  decompressed to disk first and memory use is the same as for plain text logs.
+#
+#  parse_log_cached saves what the consumers extracted to a compact .npz sidecar in a cache
+#  directory, so re-plotting the same log, e.g. with another yscale or plot format, does not parse
+#  it again. Entries are keyed by the absolute path, size and modification time of the log and by
+#  the class, configuration and version of the consumer, and are named after a hash of the log path
+#  and of the consumer so that differently configured consumers do not share an entry. An index
+#  file in the cache directory records the log of each entry, entries that no longer match their
+#  log, or whose log is gone, are removed using the index when the cache is written. Entries are
+#  written to a unique temporary file first, so that processes parsing logs at the same time never
+#  read or replace a partial entry. Applications only use the cache when their 'log cache' option
+#  is true (see parse_log_configured), nothing is written to the cache directory otherwise.
+#
+#  follow_log parses a log that is still being written, e.g. by a running variational job. It keeps
+#  the byte offset it has read up to and only reads the bytes appended since the previous poll. An
+#  incomplete last line, and lines whose lookahead lines are not written yet, are held back until
+#  the rest arrives. The offset and the state of the consumers are checkpointed to a json file so
+#  that a restarted follower resumes where it stopped rather than parsing the log again.
+#
+# --------------------------------------------------------------------------------------------------
+
+class LogConsumer(object):
+
+    # Substrings selecting the lines passed to consume
+    triggers = []
+
+    # Number of lines following a selected line that are passed with it
+    lookahead = 0
+
+    def consume(self, line, following):
+
+        # Called for each line containing a trigger, following holds up to lookahead lines (fewer
+        # at the end of the log)
+
+        pass
+
+    def finish(self):
+
+        # Called once all lines have been read
+
+        pass
+
+    # Version of the parsed data, to be increased when the parsing changes so that the results
+    # cached by parse_log_cached are discarded
+    version = 1
+
+    def configuration(self):
+
+        # Options of the consumer that change the parsed data, part of the key of the results cached
+        # by parse_log_cached, must be json serializable. Consumers with options of their own add
+        # them to these.
+
+        return {'triggers': list(self.triggers), 'lookahead': self.lookahead}
+
+    def to_arrays(self):
+
+        # Dictionary of numpy arrays holding the parsed data for parse_log_cached, None when the
+        # consumer cannot be cached
+
+        return None
+
+    def from_arrays(self, arrays):
+
+        # Restore the parsed data from the arrays returned by to_arrays
+
+        pass
+
+    def state(self):
+
+        # State of the consumer stored in the follow_log checkpoint, must be json serializable
+
+        return copy.deepcopy(vars(self))
+
+    def restore(self, state):
+
+        # Restore a state returned by state
+
+        self.__dict__.update(copy.deepcopy(state))
+
+# --------------------------------------------------------------------------------------------------
+
+class LogParser(object):
+
+    # Incremental parser, lines can be fed in several goes as they become available
+
+    def __init__(self, consumers):
+
+        self.consumers = consumers
+
+        # One expression finds the lines that interest any consumer, the triggers of each consumer
+        # are then only checked for these lines
+        self.triggers = sorted(set(itertools.chain.from_iterable(consumer.triggers
+                                                                 for consumer in consumers)))
+        if self.triggers:
+            self.selector = re.compile("|".join(re.escape(trigger) for trigger in self.triggers))
+        else:
+            self.selector = None
+        self.lookahead = max([consumer.lookahead for consumer in consumers] + [0])
+
+        # Lines read but not dispatched yet because their lookahead lines are not all read
+        self.window = collections.deque()
+
+    def dispatch(self, lines):
+
+        # Pass lines[0] and the lines following it to the consumers interested in lines[0]
+
+        line = lines[0]
+        if self.selector is None or self.selector.search(line) is None:
+            return
+        following = None
+        for consumer in self.consumers:
+            if any(trigger in line for trigger in consumer.triggers):
+                if following is None:
+                    following = list(itertools.islice(lines, 1, None))
+                consumer.consume(line, following[:consumer.lookahead])
+
+    def _dispatch(self):
+
+        self.dispatch(self.window)
+
+    def feed(self, lines):
+
+        # Each line is dispatched once the lookahead lines after it have been read
+
+        window = self.window
+        for line in lines:
+            window.append(line)
+            if len(window) > self.lookahead:
+                self._dispatch()
+                window.popleft()
+
+    def pending(self):
+
+        # Number of lines held back waiting for their lookahead lines
+
+        return len(self.window)
+
+    def finish(self):
+
+        # End of the log, the last lines have fewer lines following them
+
+        while self.window:
+            self._dispatch()
+            self.window.popleft()
+
+        for consumer in self.consumers:
+            consumer.finish()
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_lines(lines, consumers):
+
+    # Feed an iterable of lines to the consumers in a single pass
+
+    parser = LogParser(consumers)
+    parser.feed(lines)
+    parser.finish()
+
+    return consumers
+
+# --------------------------------------------------------------------------------------------------
+
+# Magic numbers at the start of the compressed formats
+compression_magic = {
+  b'\x1f\x8b': 'gzip',
+  b'BZh': 'bzip2',
+  b'\xfd7zXZ\x00': 'xz',
+  b'\x28\xb5\x2f\xfd': 'zstd'
+}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_compression(log_file):
+
+    # Compression of a log file from its first bytes, None for plain text
+
+    with open(log_file, 'rb') as fh:
+        start = fh.read(8)
+
+    for magic, compression in compression_magic.items():
+        if start.startswith(magic):
+            return compression
+
+    return None
+
+# --------------------------------------------------------------------------------------------------
+
+def open_log(log_file):
+
+    # Open a log for reading text, decompressing it on the fly when it is compressed
+
+    compression = log_compression(log_file)
+
+    if compression is None:
+        return open(log_file, errors='replace')
+    elif compression == 'gzip':
+        return gzip.open(log_file, 'rt', errors='replace')
+    elif compression == 'bzip2':
+        return bz2.open(log_file, 'rt', errors='replace')
+    elif compression == 'xz':
+        return lzma.open(log_file, 'rt', errors='replace')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            utils.abort('Reading the zstd compressed log '+log_file+' needs the zstandard package')
+        return zstandard.open(log_file, 'rt', errors='replace')
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_mapped(log_file, consumers):
+
+    # Same as parse_log for a plain text log, but the log is memory-mapped and only the lines with a
+    # trigger, and their lookahead lines, are decoded
+
+    parser = LogParser(consumers)
+
+    with open(log_file, 'rb') as fh:
+
+        size = os.fstat(fh.fileno()).st_size
+
+        if size > 0 and parser.triggers:
+
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+
+                # Occurrences of all the triggers in the order they appear in the log
+                matches = heapq.merge(*[re.compile(re.escape(trigger.encode())).finditer(buffer)
+                                        for trigger in parser.triggers],
+                                      key=lambda match: match.start())
+
+                position = 0
+                match = None
+                for match in matches:
+
+                    # Skip other triggers found in a line that was already dispatched
+                    if match.start() < position:
+                        continue
+                    start = buffer.rfind(b'\n', 0, match.start()) + 1
+
+                    # Decode the line and its lookahead lines
+                    lines = []
+                    for n in range(parser.lookahead + 1):
+                        if start >= size:
+                            break
+                        end = buffer.find(b'\n', start)
+                        end = size if end == -1 else end + 1
+                        lines.append(buffer[start:end].decode(errors='replace'))
+                        start = end
+
+                    parser.dispatch(lines)
+
+                    # Carry on after the line, the lookahead lines are searched too
+                    position = buffer.find(b'\n', match.end())
+                    if position == -1:
+                        break
+                    position = position + 1
+
+                # Release the matches, they refer to the buffer which cannot be closed until then
+                matches = match = None
+
+    parser.finish()
+
+    return consumers
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_log(log_file, consumers, mapped=True):
+
+    # Feed the lines of a log file to the consumers in a single pass. Plain text logs are scanned
+    # with parse_mapped unless mapped is False.
+
+    if mapped and log_compression(log_file) is None:
+        return parse_mapped(log_file, consumers)
+
+    with open_log(log_file) as file:
+        return parse_lines(file, consumers)
+
+# --------------------------------------------------------------------------------------------------
+
+# Directory of the parsed log cache, can be set with FV3JEDITOOLS_LOG_CACHE
+default_cache_path = os.environ.get("FV3JEDITOOLS_LOG_CACHE",
+                                    os.path.join(os.path.expanduser("~"), ".cache", "fv3jeditools",
+                                                 "logs"))
+
+# --------------------------------------------------------------------------------------------------
+
+def _cache_key(log_file, consumer):
+
+    # Identity of a log file and consumer, and the name of its entry in the cache
+
+    log_file = os.path.abspath(log_file)
+    stat = os.stat(log_file)
+    consumer_name = type(consumer).__module__+'.'+type(consumer).__qualname__
+    key = {'log file': log_file, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+           'consumer': consumer_name, 'configuration': consumer.configuration(),
+           'version': consumer.version}
+
+    identity = json.dumps([log_file, consumer_name, key['configuration'], key['version']],
+                          sort_keys=True)
+    name = hashlib.sha1(identity.encode()).hexdigest()[:16]+'_'+type(consumer).__name__+'_v'+ \
+           str(consumer.version)+'.npz'
+
+    return key, name
+
+# --------------------------------------------------------------------------------------------------
+
+def _entry_key(filename):
+
+    # Key stored in a cache entry, None when the entry cannot be read
+
+    try:
+        with np.load(filename) as npz:
+            return json.loads(str(npz['__key__']))
+    except Exception:
+        return None
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_index(cache_path):
+
+    # Log file, size and modification time of each entry of the cache, by entry name
+
+    try:
+        with open(os.path.join(cache_path, 'index.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+# --------------------------------------------------------------------------------------------------
+
+def _evict(cache_path, stored):
+
+    # Add the stored entries (name: key) to the index and remove the entries whose log is gone or
+    # has changed since it was parsed. Only the index is read, not the entries.
+
+    index = _read_index(cache_path)
+    for name, key in stored.items():
+        index[name] = {'log file': key['log file'], 'size': key['size'], 'mtime': key['mtime']}
+
+    for name, record in list(index.items()):
+        filename = os.path.join(cache_path, name)
+        try:
+            stat = os.stat(record['log file'])
+            stale = stat.st_size != record['size'] or stat.st_mtime_ns != record['mtime']
+        except Exception:
+            stale = True
+        if stale or not os.path.exists(filename):
+            del index[name]
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    # Replace the index in one step so readers never see a partial file
+    index_file = os.path.join(cache_path, 'index.json')
+    with open(index_file+'.'+str(os.getpid())+'.tmp', 'w') as fh:
+        json.dump(index, fh)
+    os.replace(index_file+'.'+str(os.getpid())+'.tmp', index_file)
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_log_cached(log_file, consumers, cache_path=None):
+
+    # Same as parse_log but the consumers are filled from the cache when the log was already parsed
+    # by the same version of the consumer. Only the consumers that are not cached read the log.
+
+    if cache_path is None:
+        cache_path = default_cache_path
+    cache_path = os.path.expandvars(cache_path)
+    os.makedirs(cache_path, exist_ok=True)
+
+    to_parse = []
+    for consumer in consumers:
+        key, name = _cache_key(log_file, consumer)
+        filename = os.path.join(cache_path, name)
+        if os.path.exists(filename) and _entry_key(filename) == key:
+            with np.load(filename) as npz:
+                consumer.from_arrays({array: npz[array] for array in npz.files
+                                      if array != '__key__'})
+            print(" log_parser: "+type(consumer).__name__+" loaded from the cache "+filename)
+        else:
+            to_parse.append(consumer)
+
+    if to_parse == []:
+        return consumers
+
+    parse_log(log_file, to_parse)
+
+    # Store the new results, written to a temporary file first so readers never see partial files
+    stored = {}
+    for consumer in to_parse:
+        arrays = consumer.to_arrays()
+        if arrays is None:
+            continue
+        key, name = _cache_key(log_file, consumer)
+        filename = os.path.join(cache_path, name)
+        fd, temporary = tempfile.mkstemp(prefix=name+'.', suffix='.tmp', dir=cache_path)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, __key__=np.array(json.dumps(key)), **arrays)
+            os.replace(temporary, filename)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        stored[name] = key
+
+    if stored:
+        _evict(cache_path, stored)
+
+    return consumers
+
+# --------------------------------------------------------------------------------------------------
+
+def _read_checkpoint(checkpoint_file, log_file):
+
+    # Checkpoint of the log, None when there is none or it belongs to another file
+
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return None
+
+    # A truncated or otherwise unreadable checkpoint is ignored
+    try:
+        with open(checkpoint_file) as fh:
+            checkpoint = json.load(fh)
+        stat = os.stat(log_file)
+        matches = checkpoint['log file'] == os.path.abspath(log_file) and \
+                  checkpoint['inode'] == stat.st_ino and checkpoint['offset'] <= stat.st_size
+    except (ValueError, KeyError, TypeError):
+        print(" log_parser: checkpoint "+checkpoint_file+" cannot be read, starting over")
+        return None
+
+    if not matches:
+        print(" log_parser: checkpoint "+checkpoint_file+" does not match the log, starting over")
+        return None
+
+    return checkpoint
+
+# --------------------------------------------------------------------------------------------------
+
+def _write_checkpoint(checkpoint_file, log_file, inode, offset, consumers):
+
+    checkpoint = {'log file': os.path.abspath(log_file), 'inode': inode, 'offset': offset,
+                  'consumers': [consumer.state() for consumer in consumers]}
+
+    # Replace the previous checkpoint in one step so an interrupted write does not corrupt it
+    with open(checkpoint_file+'.tmp', 'w') as fh:
+        json.dump(checkpoint, fh)
+    os.replace(checkpoint_file+'.tmp', checkpoint_file)
+
+# --------------------------------------------------------------------------------------------------
+
+def follow_log(log_file, consumers, checkpoint_file=None, poll_interval=30.0, idle_timeout=3600.0,
+               update=None, chunk_size=16*1024*1024):
+
+    # Parse a log as it is written. Every poll_interval seconds the bytes appended to the log are
+    # fed to the consumers and update() is called when some lines were parsed. Following stops when
+    # the log has not grown for idle_timeout seconds, the held back lines are then parsed as the end
+    # of the log.
+
+    # A compressed log is complete, it is parsed once
+    if log_compression(log_file) is not None:
+        print(" log_parser: "+log_file+" is compressed, parsing it without following")
+        parse_log(log_file, consumers)
+        if update is not None:
+            update()
+        return consumers
+
+    initial = [consumer.state() for consumer in consumers]
+
+    # Resume from the checkpoint
+    offset = 0
+    checkpoint = _read_checkpoint(checkpoint_file, log_file)
+    if checkpoint is not None:
+        offset = checkpoint['offset']
+        for consumer, state in zip(consumers, checkpoint['consumers']):
+            consumer.restore(state)
+        print(" log_parser: resuming "+log_file+" from byte", offset)
+
+    parser = LogParser(consumers)
+    inode = os.stat(log_file).st_ino
+    position = offset                 # Bytes of the log read so far
+    partial = b''                     # Incomplete last line
+    held = collections.deque()        # Sizes of the lines held back by the parser
+    last_growth = time.time()
+
+    while True:
+
+        # Start over if the log was replaced or truncated
+        stat = os.stat(log_file)
+        if stat.st_ino != inode or stat.st_size < position:
+            print(" log_parser: "+log_file+" was replaced or truncated, starting over")
+            for consumer, state in zip(consumers, initial):
+                consumer.restore(state)
+            parser = LogParser(consumers)
+            inode, position, partial = stat.st_ino, 0, b''
+            held.clear()
+
+        # Parse the bytes appended since the previous poll
+        parsed = False
+        with open(log_file, 'rb') as fh:
+            fh.seek(position)
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                position = position + len(chunk)
+                lines = (partial + chunk).split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    held.append(len(line)+1)
+                    parser.feed([line.decode(errors='replace')+'\n'])
+                    while len(held) > parser.pending():
+                        held.popleft()
+                parsed = parsed or len(lines) > 0
+
+        if parsed:
+            last_growth = time.time()
+            offset = position - len(partial) - sum(held)
+            if checkpoint_file is not None:
+                _write_checkpoint(checkpoint_file, log_file, inode, offset, consumers)
+            if update is not None:
+                update()
+        elif time.time() - last_growth >= idle_timeout:
+            break
+
+        time.sleep(poll_interval)
+
+    # The log has stopped growing, parse what was held back as the end of the log
+    if partial:
+        parser.feed([partial.decode(errors='replace')])
+    parser.finish()
+    if update is not None:
+        update()
+
+    return consumers
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_log_configured(log_file, consumers, conf):
+
+    # Parse a log with or without the cache depending on the 'log cache' and 'log cache path'
+    # options of an application, the cache is only used when asked for
+
+    try:
+        use_cache = conf['log cache']
+    except:
+        use_cache = False
+
+    if use_cache:
+        try:
+            cache_path = conf['log cache path']
+        except:
+            cache_path = None
+        return parse_log_cached(log_file, consumers, cache_path)
+
+    return parse_log(log_file, consumers)
+
+# --------------------------------------------------------------------------------------------------
+
+def log_file_name(datetime, conf):
+
+    # Log file from the configuration with the datetime templates replaced, aborts if it is missing
+
+    log_file = utils.configGetOrFail(conf, 'log file')
+
+    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+    log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
+
+    if not os.path.exists(log_file):
+        utils.abort('Log file not found.')
+
+    return log_file
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,234 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import concurrent.futures
+import glob
+import os
+
+import fv3jeditools.applications as applications
+import fv3jeditools.ioda_reader as ioda_reader
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package pipeline
+#
+#  This application can be triggered by using "application name: pipeline"
+#
+#  Configuration options:
+#  ----------------------
+#
+#  steps             | List of steps, each with the options below
+#    step name       | Unique name of the step
+#    depends on      | Optional list of step names that must complete before this step runs
+#    application     | Configuration of the application to run, including its application name
+#  number of workers | Number of processes used to run independent steps concurrently [1]
+#  done path         | Directory holding the completion markers of the steps [./]
+#
+#
+#  This function runs several applications for one datetime. Steps whose dependencies are complete
+#  run concurrently. Ready steps that read the same IODA files (hofx files, ioda experiment files or
+#  ioda reference files) are run one after the other in the same process so that the arrays read by
+#  the first step are shared with the others instead of being read from disk again.
+#
+#  A completion marker is written for every step that succeeds (utils.setDone). When the pipeline
+#  is run again for the same datetime, steps with a marker (utils.isDone) are skipped, so a re-run
+#  after a failure only runs the steps that did not finish.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Configuration keys of the applications that hold IODA files
+ioda_file_keys = ['hofx files', 'ioda experiment files', 'ioda reference files']
+
+# --------------------------------------------------------------------------------------------------
+
+def _done_name(step_name, datetime):
+
+    return 'pipeline_'+step_name+'_'+datetime.strftime("%Y%m%d_%H%M%S")
+
+# --------------------------------------------------------------------------------------------------
+
+def _step_files(datetime, app_conf):
+
+    # The set of IODA files that a step reads
+
+    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+
+    files = set()
+    for key in ioda_file_keys:
+        templates = app_conf.get(key, [])
+        if isinstance(templates, str):
+            templates = [templates]
+        for template in templates:
+            template = utils.stringReplaceDatetimeTemplate(isodatestr, template)
+            files.update(os.path.abspath(file) for file in glob.glob(template))
+
+    return files
+
+# --------------------------------------------------------------------------------------------------
+
+def _batches(datetime, ready, steps):
+
+    # Group the ready steps so that steps sharing any IODA file end up in the same batch
+
+    batches = []
+    for name in ready:
+        files = _step_files(datetime, steps[name]['application'])
+        batch = {'names': [name], 'files': files}
+        for other in [other for other in batches if other['files'] & files]:
+            batch['names'] = other['names'] + batch['names']
+            batch['files'] = other['files'] | batch['files']
+            batches.remove(other)
+        batches.append(batch)
+
+    return [batch['names'] for batch in batches]
+
+# --------------------------------------------------------------------------------------------------
+
+def _run_batch(datetime, batch, done_path):
+
+    # Run a batch of steps in this process, sharing the IODA readers between them
+
+    results = []
+    with ioda_reader.sharing():
+        for step_name, app_name, app_conf in batch:
+            print(" pipeline: running step "+step_name+" ("+app_name+")")
+            success, message = applications.run_application(app_name, datetime, app_conf)
+            if success:
+                utils.setDone(done_path, _done_name(step_name, datetime))
+            results.append((step_name, success, message))
+
+    return results
+
+# --------------------------------------------------------------------------------------------------
+
+def pipeline(datetime, conf):
+
+
+    # Parse configuration
+    # -------------------
+
+    # Steps of the pipeline
+    steps_conf = utils.configGetOrFail(conf, 'steps')
+
+    # Number of processes
+    workers = utils.configGet(conf, 'number of workers', 1)
+
+    # Path for the completion markers
+    done_path = os.path.expandvars(utils.configGet(conf, 'done path', './'))
+    utils.createPath(done_path)
+
+
+    # Check the steps
+    # ---------------
+    steps = {}
+    for step_conf in steps_conf:
+        name = utils.configGetOrFail(step_conf, 'step name')
+        if name in steps:
+            utils.abort('pipeline: step name \''+name+'\' is used more than once')
+        app_conf = dict(utils.configGetOrFail(step_conf, 'application'))
+        utils.configGetOrFail(app_conf, 'application name')
+        steps[name] = {'application': app_conf,
+                       'depends on': list(step_conf.get('depends on', []))}
+
+    for name, step in steps.items():
+        for dependency in step['depends on']:
+            if dependency not in steps:
+                utils.abort('pipeline: step \''+name+'\' depends on unknown step \''+dependency+'\'')
+
+    # Check the dependencies do not form a cycle
+    ordered = []
+    while len(ordered) < len(steps):
+        free = [name for name, step in steps.items()
+                if name not in ordered and all(d in ordered for d in step['depends on'])]
+        if free == []:
+            utils.abort('pipeline: the step dependencies form a cycle')
+        ordered = ordered + free
+
+
+    # Skip the steps completed by a previous run
+    # ------------------------------------------
+    status = {}
+    for name in steps:
+        if utils.isDone(done_path, _done_name(name, datetime)):
+            status[name] = 'done (previous run)'
+
+
+    # Run the steps as their dependencies complete
+    # --------------------------------------------
+    messages = {}
+    running = {}
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    while True:
+
+        # Steps depending on a step that did not succeed are skipped
+        changed = True
+        while changed:
+            changed = False
+            for name, step in steps.items():
+                if name not in status and any(status.get(d, '').startswith(('failed', 'skipped'))
+                                              for d in step['depends on']):
+                    status[name] = 'skipped'
+                    changed = True
+
+        # Steps that are ready to run
+        in_flight = [name for names in running.values() for name in names]
+        ready = [name for name in ordered if name not in status and name not in in_flight and
+                 all(status.get(d, '').startswith('done') for d in steps[name]['depends on'])]
+
+        for names in _batches(datetime, ready, steps):
+            batch = [(name, steps[name]['application']['application name'],
+                      {key: value for key, value in steps[name]['application'].items()
+                       if key != 'application name'}) for name in names]
+            if executor is None:
+                results = _run_batch(datetime, batch, done_path)
+                for name, success, message in results:
+                    status[name] = 'done' if success else 'failed'
+                    messages[name] = message
+            else:
+                running[executor.submit(_run_batch, datetime, batch, done_path)] = names
+
+        if executor is None:
+            if ready == []:
+                break
+            continue
+
+        if running == {}:
+            break
+
+        # Wait for a batch to finish
+        finished, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            names = running.pop(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(name, False, repr(e)) for name in names]
+            for name, success, message in results:
+                status[name] = 'done' if success else 'failed'
+                messages[name] = message
+
+    if executor is not None:
+        executor.shutdown()
+
+
+    # Summary
+    # -------
+    print("\n pipeline: summary for", datetime)
+    failures = 0
+    for name in ordered:
+        if status[name] == 'failed':
+            failures = failures + 1
+            print("   "+name+": failed: "+messages[name])
+        else:
+            print("   "+name+": "+status[name])
+
+    if failures > 0:
+        utils.abort('pipeline: '+str(failures)+' step(s) failed')
+
+# --------------------------------------------------------------------------------------------------
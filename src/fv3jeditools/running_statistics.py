@@ -0,0 +1,152 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package running_statistics
+#
+#  Accumulators for statistics of data that is seen a chunk at a time, e.g. one file after another,
+#  so that the complete data never has to be held in memory.
+#
+#  RunningStatistics keeps the count, mean, sum of squared deviations (M2), minimum and maximum.
+#  Each chunk is reduced on its own and combined with the running values using the pairwise update
+#  of Chan et al., which is stable for large counts. Two accumulators, e.g. from two files, two
+#  processes or two cycles, are combined the same way with merge. With skewness=True the sum of
+#  cubed deviations (M3) is also kept, combined with the pairwise update of Pebay.
+#
+#  Histogram accumulates counts on bin edges that are fixed when it is created, so histograms of
+#  different chunks or cycles can be added together.
+#
+#  The accumulators work element wise on arrays of the shape given when they are created. Chunks
+#  have this shape with an extra leading dimension along which the data is reduced. NaN values are
+#  ignored.
+#
+# --------------------------------------------------------------------------------------------------
+
+class RunningStatistics(object):
+
+    def __init__(self, shape=(), skewness=False):
+
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.m3 = np.zeros(shape) if skewness else None
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+    def update(self, data):
+
+        # Add a chunk of data with shape (n,)+shape
+
+        data = np.asarray(data, dtype=np.float64)
+        valid = ~np.isnan(data)
+
+        count = np.count_nonzero(valid, axis=0)
+        total = np.sum(data, axis=0, where=valid)
+        mean = np.divide(total, count, out=np.zeros(np.shape(total)), where=count > 0)
+        m2 = np.sum((data - mean)**2, axis=0, where=valid)
+        m3 = np.sum((data - mean)**3, axis=0, where=valid) if self.m3 is not None else None
+        minimum = np.min(data, axis=0, where=valid, initial=np.inf)
+        maximum = np.max(data, axis=0, where=valid, initial=-np.inf)
+
+        self._combine(count, mean, m2, minimum, maximum, m3)
+
+    def merge(self, other):
+
+        # Add the data accumulated by another accumulator
+
+        if self.m3 is not None and other.m3 is None:
+            utils.abort('RunningStatistics: an accumulator without skewness cannot be merged into '+
+                        'one with skewness')
+
+        self._combine(other.count, other.mean, other.m2, other.minimum, other.maximum, other.m3)
+
+    def _combine(self, count, mean, m2, minimum, maximum, m3=None):
+
+        total = self.count + count
+        delta = mean - self.mean
+        inverse = np.divide(1.0, total, out=np.zeros(np.shape(total)), where=total > 0)
+        weight = count * inverse
+
+        if self.m3 is not None:
+            self.m3 = self.m3 + m3 + delta**3 * self.count * weight * (self.count - count) * inverse \
+                      + 3.0 * delta * (self.count * m2 - count * self.m2) * inverse
+
+        self.m2 = self.m2 + m2 + delta**2 * self.count * weight
+        self.mean = self.mean + delta * weight
+        self.count = total
+        self.minimum = np.minimum(self.minimum, minimum)
+        self.maximum = np.maximum(self.maximum, maximum)
+
+    def variance(self, ddof=0):
+
+        # Variance, NaN where there are not more than ddof values
+
+        return np.divide(self.m2, self.count - ddof, out=np.full(np.shape(self.m2), np.nan),
+                         where=self.count > ddof)
+
+    def stddev(self, ddof=0):
+
+        return np.sqrt(self.variance(ddof))
+
+    def skewness(self):
+
+        # Sample skewness g1 = sqrt(n) M3 / M2^(3/2), NaN where the values do not vary
+
+        if self.m3 is None:
+            utils.abort('RunningStatistics: skewness is only kept when created with skewness=True')
+
+        return np.divide(np.sqrt(self.count) * self.m3, self.m2**1.5,
+                         out=np.full(np.shape(self.m2), np.nan), where=self.m2 > 0)
+
+# --------------------------------------------------------------------------------------------------
+
+class Histogram(object):
+
+    def __init__(self, edges):
+
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges)-1, dtype=np.int64)
+
+    def update(self, data):
+
+        # Add a chunk of data, values outside the edges and NaN values are not counted
+
+        data = np.asarray(data, dtype=np.float64).ravel()
+        counts, _ = np.histogram(data[~np.isnan(data)], bins=self.edges)
+        self.counts = self.counts + counts
+
+    def merge(self, other):
+
+        # Add the counts of a histogram with the same edges
+
+        if not np.array_equal(self.edges, other.edges):
+            utils.abort('Histogram: histograms with different bin edges cannot be merged')
+
+        self.counts = self.counts + other.counts
+
+    def centers(self):
+
+        return (self.edges[:-1] + self.edges[1:])/2
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_edges(minimum, maximum, nbins):
+
+    # Evenly spaced edges for nbins bins from minimum to maximum, widened when the range is empty.
+    # Bounds that are not finite, as those of statistics without any data, give edges around zero.
+
+    if not (np.isfinite(minimum) and np.isfinite(maximum)):
+        minimum, maximum = 0.0, 0.0
+
+    if not maximum > minimum:
+        minimum, maximum = minimum - 0.5, maximum + 0.5
+
+    return np.linspace(minimum, maximum, nbins+1)
+
+# --------------------------------------------------------------------------------------------------
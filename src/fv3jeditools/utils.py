@@ -22,7 +22,7 @@ __all__ = ['dtformat', 'dtformatprnt','configGetOrFail','configGet','ordinalNumb
            'run_csh_command', 'run_bash_command', 'run_shell_command',
            'getFileSize', 'wait_for_batch_job', 'abort',
            'depends', 'ship2S3', 'recvS3', 'lines_that_contain',
-           'ioda_platform_dict', 'ioda_group_dict', 'read_ioda_variable']
+           'ioda_platform_dict', 'ioda_group_dict', 'read_ioda_variable', 'density_grid']
 
 # --------------------------------------------------------------------------------------------------
 
@@ -117,35 +117,74 @@ def read_ioda_variable(fh, group, variable, channel = None):
     # Users often want omb, which is not a group in the files. This special case and other special
     # cases can be added here.
 
+    # fh can be a netCDF4 Dataset or an ioda_reader.IodaReader, which caches the arrays it reads and
+    # computes the derived groups (see ioda_reader.derived_groups) from the cached inputs
+
     if channel == None:
+        index = slice(None)
+    else:
+        index = (slice(None), channel-1)
+
+    if hasattr(fh, 'read'):
+        return fh.read(group, variable)[index]
+
+    if group=='omb':
+        data = fh.groups['ObsValue' ].variables[variable][index] - \
+               fh.groups['hofx'     ].variables[variable][index]
+    elif group=='Gsiomb':
+        data = fh.groups['ObsValue' ].variables[variable][index] - \
+               fh.groups['GsiHofX'  ].variables[variable][index]
+    elif group=='GsiombBc':
+        data = fh.groups['ObsValue' ].variables[variable][index] - \
+               fh.groups['GsiHofXBc'].variables[variable][index]
+    else:
+        data = fh.groups[group].variables[variable][index]
 
-        if group=='omb':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['hofx'     ].variables[variable][:]
-        elif group=='Gsiomb':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['GsiHofX'  ].variables[variable][:]
-        elif group=='GsiombBc':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['GsiHofXBc'].variables[variable][:]
-        else:
-            data = fh.groups[group].variables[variable][:]
+    return data
 
+# --------------------------------------------------------------------------------------------------
+
+def density_grid(x, y, values, xlim, ylim, nx, ny, aggregation='count'):
+
+    # Bin points into an (ny, nx) grid of pixels covering xlim by ylim. The aggregation is either
+    # the number of points in each pixel (count) or the mean of the values in each pixel (mean).
+    # Pixels without points are NaN. Points outside the limits or with NaN values are ignored.
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Make sure the pixels have a width
+    if xlim[1] <= xlim[0]:
+        xlim = (xlim[0]-0.5, xlim[0]+0.5)
+    if ylim[1] <= ylim[0]:
+        ylim = (ylim[0]-0.5, ylim[0]+0.5)
+
+    valid = np.isfinite(x) & np.isfinite(y) & \
+            (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+    if values is not None:
+        values = np.asarray(values, dtype=np.float64)
+        valid = valid & np.isfinite(values)
+
+    # Pixel index of each point, points on the upper limits go in the last pixel
+    ix = np.minimum(((x[valid] - xlim[0]) * (nx/(xlim[1] - xlim[0]))).astype(np.int64), nx-1)
+    iy = np.minimum(((y[valid] - ylim[0]) * (ny/(ylim[1] - ylim[0]))).astype(np.int64), ny-1)
+    pixel = iy*nx + ix
+
+    counts = np.bincount(pixel, minlength=nx*ny).astype(np.float64)
+
+    if aggregation == 'count':
+        grid = counts
+    elif aggregation == 'mean':
+        if values is None:
+            abort('density_grid: mean aggregation needs values')
+        sums = np.bincount(pixel, weights=values[valid], minlength=nx*ny)
+        grid = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
     else:
+        abort('density_grid: aggregation must be count or mean, not \''+aggregation+'\'')
 
-        if group=='omb':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['hofx'     ].variables[variable][:,channel-1]
-        elif group=='Gsiomb':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['GsiHofX'  ].variables[variable][:,channel-1]
-        elif group=='GsiombBc':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['GsiHofXBc'].variables[variable][:,channel-1]
-        else:
-            data = fh.groups[group].variables[variable][:,channel-1]
+    grid[counts == 0] = np.nan
 
-    return data
+    return grid.reshape(ny, nx)
 
 # --------------------------------------------------------------------------------------------------
 
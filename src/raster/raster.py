@@ -11,363 +11,415 @@
 
 import os
 import argparse
+import concurrent.futures
 import sys
 import time
 import subprocess
 import numpy as np
-from netCDF4 import Dataset
-
-# -----------------------------------------------------------------------------
-
-# Initial time
-initial_time = time.perf_counter()
 
 # -----------------------------------------------------------------------------
 
 # Environment variables
 
 # FV3_GRID_DIR: directory with FV3 grid files for each resolution ("fv3grid_cNNNN.nc")
+# FV3JEDITOOLS_GRID_CACHE: directory where the grids are cached (~/.cache/fv3jeditools/grids)
 gridfiledir = os.environ.get("FV3_GRID_DIR", os.path.dirname(os.path.realpath(__file__)) + "/fv3grid")
 
 # Host name
 hostname = os.environ.get("HOSTNAME", "")
 
-# -----------------------------------------------------------------------------
+# Lon/lat of view
+lonview = -45.0
+latview = 45.0
 
-# Parser
-parser = argparse.ArgumentParser()
+# -----------------------------------------------------------------------------
 
-# GEOS / GFS input file
-parser.add_argument("--geos", dest="geos", action="store_true", help="GEOS input file")
-parser.add_argument("--gfs", dest="gfs", action="store_true", help="GFS input file")
+def parse_arguments(argv=None):
+    # Parser
+    parser = argparse.ArgumentParser()
 
-# File path
-parser.add_argument("--filepath", "-f", help="File path")
+    # GEOS / GFS input file
+    parser.add_argument("--geos", dest="geos", action="store_true", help="GEOS input file")
+    parser.add_argument("--gfs", dest="gfs", action="store_true", help="GFS input file")
 
-# Variable
-parser.add_argument("--variable", "-v", help="Variable")
+    # File path
+    parser.add_argument("--filepath", "-f", help="File path")
 
-# Base file path to compute a difference (optional)
-parser.add_argument("--basefilepath", "-bf", help="Base file path to compute a difference (optional)")
+    # Variables
+    parser.add_argument("--variable", "-v", help="Variables (values separated with commas)")
 
-# Base variable to compute a difference (optional)
-parser.add_argument("--basevariable", "-bv", help="Base variable")
+    # Base file path to compute a difference (optional)
+    parser.add_argument("--basefilepath", "-bf", help="Base file path to compute a difference (optional)")
 
-# Levels
-parser.add_argument("--levels", "-l", type=str, help="Levels (values separated with commas)")
+    # Base variables to compute a difference (optional)
+    parser.add_argument("--basevariable", "-bv", help="Base variables (values separated with commas)")
 
-# Color map (optional, default=jet or coolwarm)
-parser.add_argument("--colormap", "-cm", type=str, nargs="?", help="Color map (optional, default=jet or coolwarm)")
+    # Levels
+    parser.add_argument("--levels", "-l", type=str, help="Levels (values separated with commas)")
 
-# Centered color map
-parser.add_argument("--centered", dest="centered", action="store_true", help="Centered color map")
+    # Color map (optional, default=jet or coolwarm)
+    parser.add_argument("--colormap", "-cm", type=str, nargs="?", help="Color map (optional, default=jet or coolwarm)")
 
-# Ferret script (a lot faster)
-parser.add_argument("--ferret", dest="ferret", action="store_true", help="Ferret script")
+    # Centered color map
+    parser.add_argument("--centered", dest="centered", action="store_true", help="Centered color map")
 
-# Output file path
-parser.add_argument("--output", "-o", help="Output file path")
+    # Ferret script (optional, the default matplotlib rendering does not need Ferret)
+    parser.add_argument("--ferret", dest="ferret", action="store_true", help="Ferret script (optional)")
 
-# Lon/lat of view
-lonview = -45.0
-latview = 45.0
+    # Output file path
+    parser.add_argument("--output", "-o", help="Output file path")
 
-# Parse arguments
-args = parser.parse_args()
+    # Number of processes rendering levels concurrently
+    parser.add_argument("--workers", "-n", type=int, default=1, help="Number of processes rendering levels (optional, default=1)")
 
-# -----------------------------------------------------------------------------
+    # Parse arguments
+    args = parser.parse_args(argv)
 
-# Set default string values
-if args.colormap is None:
-    if args.centered:
-        if args.ferret:
-            args.colormap = "cmocean_balance"
-        else:
-            args.colormap = "seismic"
-    else:
-        if args.ferret:
-            args.colormap = "default"
+    # Set default string values
+    if args.colormap is None:
+        if args.centered:
+            if args.ferret:
+                args.colormap = "cmocean_balance"
+            else:
+                args.colormap = "seismic"
         else:
-            args.colormap = "viridis"
-
-# Print arguments
-print("Parameters:")
-print(" - gridfiledir: " + gridfiledir)
-for arg in vars(args):
-    if not arg is None:
-        print(" - " + arg + ": " + str(getattr(args, arg)))
-
-# Check arguments
-if not (args.geos or args.gfs):
-    print("ERROR: --geos or --gfs is required")
-    sys.exit(1)
-if args.filepath is None:
-    print("ERROR: filepath is required")
-    sys.exit(1)
-if args.variable is None:
-    print("ERROR: variable is required")
-    sys.exit(1)
-if args.levels is None:
-    print("ERROR: levels is required")
-    sys.exit(1)
-if args.output is None:
-    print("ERROR: output is required")
-    sys.exit(1)
-
-# Convert levels list to array of integers
-levels = np.array(list(map(int, args.levels.split(","))))
-
-# -----------------------------------------------------------------------------
-
-if args.geos:
-    # Check file extension
-    if not args.filepath.endswith(".nc4"):
-        print("   Error: filepath extension should be .nc4")
+            if args.ferret:
+                args.colormap = "default"
+            else:
+                args.colormap = "viridis"
+
+    # Print arguments
+    print("Parameters:")
+    print(" - gridfiledir: " + gridfiledir)
+    for arg in vars(args):
+        if not arg is None:
+            print(" - " + arg + ": " + str(getattr(args, arg)))
+
+    # Check arguments
+    if not (args.geos or args.gfs):
+        print("ERROR: --geos or --gfs is required")
+        sys.exit(1)
+    if args.filepath is None:
+        print("ERROR: filepath is required")
+        sys.exit(1)
+    if args.variable is None:
+        print("ERROR: variable is required")
+        sys.exit(1)
+    if args.levels is None:
+        print("ERROR: levels is required")
+        sys.exit(1)
+    if args.output is None:
+        print("ERROR: output is required")
         sys.exit(1)
 
-    # Open data file
-    fdata = Dataset(args.filepath, "r", format="NETCDF4")
+    return args
 
-    # Read field
-    fld = fdata[args.variable][0,levels-1,:,:,:]
-    units = fdata[args.variable].units
-    long_name = fdata[args.variable].long_name
+# -----------------------------------------------------------------------------
+
+def read_field(args, variable, basevariable, levels):
+    import fv3jeditools.cubesphere_reader as cubesphere_reader
 
-    if not args.basefilepath is None:
-        # Check base file extension
-        if not args.basefilepath.endswith(".nc4"):
+    if args.geos:
+        # Check file extensions
+        if not args.filepath.endswith(".nc4"):
+            print("   Error: filepath extension should be .nc4")
+            sys.exit(1)
+        if not args.basefilepath is None and not args.basefilepath.endswith(".nc4"):
             print("   Error: basefilepath extension should be .nc4")
             sys.exit(1)
+        layout = "geos"
+    elif args.gfs:
+        # Check file extensions
+        if not args.filepath.endswith(".nc"):
+            print("   Error: filepath extension should be .nc")
+            sys.exit(1)
+        if not args.basefilepath is None and not args.basefilepath.endswith(".nc"):
+            print("   Error: basefilepath extension should be .nc")
+            sys.exit(1)
+        layout = "gfs"
 
-        # Open data file
-        fdata = Dataset(args.basefilepath, "r", format="NETCDF4")
+    # Read the levels of the six tiles, minus the base field if given, as (6, nz, ny, nx)
+    fld, units, long_name = cubesphere_reader.read_field(args.filepath, variable, levels, layout,
+                                                         args.basefilepath, basevariable)
 
-        # Variable name
-        if args.basevariable is None:
-            variable = args.variable
-        else:
-            variable = args.basevariable
+    return fld, units, long_name
 
-        # Read field
-        basefld = fdata[variable][0,levels-1,:,:,:]
+# -----------------------------------------------------------------------------
 
-        # Compute increment
-        fld = fld - basefld
+def read_grid(nx):
+    import fv3jeditools.cubesphere_grid as cubesphere_grid
 
-    # Get shape
-    shp = np.shape(fld)
-    nz = shp[1]
-    ny = shp[2]
-    nx = shp[3]
-elif args.gfs:
-    # Check file extension
-    if not args.filepath.endswith(".nc"):
-        print("   Error: filepath extension should be .nc")
-        sys.exit(1)
+    # Read grid vertices lons/lats in degrees, memory-mapped from the grid cache after the first
+    # read of the grid file
+    vlons, vlats, lons, lats = cubesphere_grid.read_grid(nx, gridfiledir)
+
+    return vlons, vlats
+
+# -----------------------------------------------------------------------------
+
+def tile_cells(projection, vlons, vlats):
+    import cartopy.crs as ccrs
 
+    # Cell polygons of each tile in projection coordinates, from the (6, ny+1, nx+1) vertices.
+    # All the vertices are projected in one call and the four corners of every cell are gathered
+    # by slicing. Cells with a vertex outside the projection domain (e.g. the far side of the
+    # globe) are dropped, valid is the mask of the cells kept.
+    cells = []
     for itile in range(0, 6):
-        # Open data file
-        filename = args.filepath.replace(".nc", ".tile" + str(itile+1) + ".nc")
-        fdata = Dataset(filename, "r", format="NETCDF4")
+        lons = np.asarray(vlons[itile,:,:], dtype=np.float64)
+        lats = np.asarray(vlats[itile,:,:], dtype=np.float64)
+        xyz = projection.transform_points(ccrs.Geodetic(), lons, lats)
+        x = xyz[:,:,0]
+        y = xyz[:,:,1]
 
-        # Read field
-        fld_tmp = fdata[args.variable][0,levels-1,:,:]
+        # Corners ordered around the cell, shape (ny, nx, 4, 2)
+        verts = np.stack([np.stack([x[:-1,:-1], x[:-1,1:], x[1:,1:], x[1:,:-1]], axis=-1),
+                          np.stack([y[:-1,:-1], y[:-1,1:], y[1:,1:], y[1:,:-1]], axis=-1)], axis=-1)
 
-        units = fdata[args.variable].units
-        long_name = fdata[args.variable].long_name
+        valid = np.all(np.isfinite(verts), axis=(2,3))
+        cells.append((verts[valid], valid))
 
-        if itile == 0:
-            # Get shape
-            shp = np.shape(fld_tmp)
-            nz = shp[0]
-            ny = shp[1]
-            nx = shp[2]
+    return cells
 
-            # Initialize field
-            fld = np.zeros((6, nz, ny, nx))
+# -----------------------------------------------------------------------------
 
-        # Copy field
-        fld[itile,:,:,:] = fld_tmp
+# Figure of a rendering process, set up once by init_plot and reused for every level
+plot_state = {}
 
-    if not args.basefilepath is None:
-        # Check base file extension
-        if not args.basefilepath.endswith(".nc"):
-            print("   Error: basefilepath extension should be .nc")
-            sys.exit(1)
+def init_plot(vlons, vlats):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    from matplotlib.collections import PolyCollection
 
-        for itile in range(0, 6):
-            # Open data file
-            filename = args.basefilepath.replace(".nc", ".tile" + str(itile+1) + ".nc")
-            fdata = Dataset(filename, "r", format="NETCDF4")
+    # Projection
+    projection = ccrs.Orthographic(lonview, latview)
 
-            # Variable name
-            if args.basevariable is None:
-                variable = args.variable
-            else:
-                variable = args.basevariable
+    # Cell polygons, the same for all levels
+    cells = tile_cells(projection, vlons, vlats)
 
-            # Read field
-            fld_tmp = fdata[variable][0,levels-1,:,:]
+    # Initialize figure
+    fig,ax = plt.subplots(figsize=(8,8),subplot_kw=dict(projection=projection))
+    ax.set_global()
+    ax.coastlines()
 
-            # Copy field
-            fld[itile,:,:,:] = fld[itile,:,:,:] - fld_tmp
+    # One collection per tile, sharing the normalization
+    norm = plt.Normalize(vmin=0.0, vmax=1.0)
+    collections = []
+    for itile in range(0, 6):
+        collection = PolyCollection(cells[itile][0], norm=norm, edgecolors="face", linewidths=0.1)
+        collection.set_array(np.zeros(len(cells[itile][0])))
+        ax.add_collection(collection)
+        collections.append(collection)
 
+    # Set colorbar
+    colorbar = plt.colorbar(collections[0], ax=ax, orientation="vertical",shrink=0.8)
 
-# Compute min/max
-if args.centered:
-    vmax = np.max(np.abs(fld))
-    vmin = -vmax
-else:
-    vmin = np.min(fld)
-    vmax = np.max(fld)
+    plot_state.update(cells=cells, fig=fig, ax=ax, norm=norm, collections=collections,
+                      colorbar=colorbar)
 
-# Open grid file
-fgrid = Dataset(gridfiledir + "/fv3grid_c" + str(nx).zfill(4) + ".nc4", "r", format="NETCDF4")
+# -----------------------------------------------------------------------------
 
-# Read grid vertices lons/lats
-vlons = np.degrees(fgrid["vlons"][:,:,:])
-vlats = np.degrees(fgrid["vlats"][:,:,:])
+def plot_level(fld_level, colormap, vmin, vmax, title, output):
+    import matplotlib.pyplot as plt
+    import copy
+
+    # Colormap
+    cmap = copy.copy(plt.get_cmap(colormap))
+    cmap.set_bad('gray', 1)
+
+    # Normalization
+    norm = plot_state["norm"]
+    norm.vmin = float(vmin)
+    norm.vmax = float(vmax)
+
+    # Colors are mapped in bulk from the values of each tile
+    for itile in range(0, 6):
+        valid = plot_state["cells"][itile][1]
+        collection = plot_state["collections"][itile]
+        collection.set_cmap(cmap)
+        collection.set_array(np.ma.asarray(fld_level[itile,:,:])[valid])
+    plot_state["colorbar"].update_normal(plot_state["collections"][0])
 
-if args.ferret:
-    # Write field in NetCDF file
-    if args.geos:
-        # TODO
-        print('not implemented yet')
-        exit()
-    elif args.gfs:
-        for itile in range(0, 6):
-            # Ferret file name
-            ferret_file_name = "ferret_tile"
-
-            # Open data file
-            filename = ferret_file_name + str(itile+1) + ".nc"
-            ncferret = Dataset(filename,mode="w",format="NETCDF4_CLASSIC")
-
-            # Create dimensions
-            nvx_dim = ncferret.createDimension('nvx', nx+1)
-            nvy_dim = ncferret.createDimension('nvy', ny+1)
-            ncx_dim = ncferret.createDimension('ncx', nx)
-            ncy_dim = ncferret.createDimension('ncy', ny)
-            nz_dim = ncferret.createDimension('nz', nz)
-
-            # Create variables
-            lat = ncferret.createVariable('lat', np.float64, ('nvy','nvx',))
-            lat.units = 'degrees_north'
-            lat.long_name = 'latitude'
-            lon = ncferret.createVariable('lon', np.float64, ('nvy','nvx',))
-            lon.units = 'degrees_east'
-            lon.long_name = 'longitude'
-            var = ncferret.createVariable('var', np.float64, ('nz','ncy','ncx',))
-            var.units = units
-            var.long_name = long_name
-
-            # Write variables
-            lat[:,:] = vlats[itile,:,:]
-            lon[:,:] = vlons[itile,:,:]
-            var[:,:,:] = fld[itile,:,:,:]
-
-            # Close file
-            ncferret.close()
-
-for iz in range(0, nz):
     # Figure title
-    title = long_name + " (" + units + ") at level " + str(levels[iz]) + " - C" + str(nx)
-    title = title.replace("_", " ")
-
-    # Output
-    output = args.output + "_" + str(levels[iz])
-    
-    if args.ferret:
-        if "Orion" in hostname:
-            # Run ferret script (pyferret not available on Orion)
-            info = subprocess.getstatusoutput('ferret -help')
-            if info[0] == 0:
-                subprocess.run(["ferret", "-unmapped", "-gif", "-script", "raster_orion.jnl", ferret_file_name, str(iz+1), "\"" + title + "\"", str(lonview), str(latview), args.colormap, str(vmin), str(vmax), output],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.STDOUT)
-            else:
-                print(info[1])
+    plot_state["ax"].set_title(title)
+
+    # Save figure, trimmed to the drawn area
+    plot_state["fig"].savefig(output + ".png", format="png", dpi=300, bbox_inches="tight", pad_inches=0.05)
+
+    return output
+
+# -----------------------------------------------------------------------------
+
+def write_ferret_files(fld, units, long_name, vlons, vlats, ferret_file_name):
+    from netCDF4 import Dataset
+
+    # Get shape
+    nz = fld.shape[1]
+    ny = fld.shape[2]
+    nx = fld.shape[3]
+
+    for itile in range(0, 6):
+        # Open data file
+        filename = ferret_file_name + str(itile+1) + ".nc"
+        ncferret = Dataset(filename,mode="w",format="NETCDF4_CLASSIC")
+
+        # Create dimensions
+        ncferret.createDimension('nvx', nx+1)
+        ncferret.createDimension('nvy', ny+1)
+        ncferret.createDimension('ncx', nx)
+        ncferret.createDimension('ncy', ny)
+        ncferret.createDimension('nz', nz)
+
+        # Create variables
+        lat = ncferret.createVariable('lat', np.float64, ('nvy','nvx',))
+        lat.units = 'degrees_north'
+        lat.long_name = 'latitude'
+        lon = ncferret.createVariable('lon', np.float64, ('nvy','nvx',))
+        lon.units = 'degrees_east'
+        lon.long_name = 'longitude'
+        var = ncferret.createVariable('var', np.float64, ('nz','ncy','ncx',))
+        var.units = units
+        var.long_name = long_name
+
+        # Write variables
+        lat[:,:] = vlats[itile,:,:]
+        lon[:,:] = vlons[itile,:,:]
+        var[:,:,:] = np.ma.masked_invalid(fld[itile,:,:,:])
+
+        # Close file
+        ncferret.close()
+
+# -----------------------------------------------------------------------------
+
+def run_ferret(ferret_file_name, iz, title, colormap, vmin, vmax, output):
+    if "Orion" in hostname:
+        # Run ferret script (pyferret not available on Orion)
+        info = subprocess.getstatusoutput('ferret -help')
+        if info[0] == 0:
+            subprocess.run(["ferret", "-unmapped", "-gif", "-script", "raster_orion.jnl", ferret_file_name, str(iz+1), "\"" + title + "\"", str(lonview), str(latview), colormap, str(vmin), str(vmax), output],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT)
         else:
-            # Run pyferret script
-            info = subprocess.getstatusoutput('pyferret -help')
-            if info[0] == 0:
-                subprocess.run(["pyferret", "-png", "-script", "raster.jnl", ferret_file_name, str(iz+1), title, str(lonview), str(latview), args.colormap, str(vmin), str(vmax), output],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.STDOUT)
-            else:
-                print(info[1])
+            print(info[1])
     else:
-        # Import modules
-        import matplotlib.pyplot as plt
-        import matplotlib.patches as mpatches
-        import matplotlib.cm as cm
-        import cartopy.crs as ccrs
-        import copy
-    
-        # Projection
-        projection = ccrs.Orthographic(lonview, latview)
-        
-        # Initialize figure
-        fig,ax = plt.subplots(figsize=(8,8),subplot_kw=dict(projection=projection))
-        ax.set_global()
-        ax.coastlines()
-    
-        # Colormap
-        cmap = copy.copy(cm.get_cmap(args.colormap))
-        cmap.set_bad('gray', 1)
-    
-        # Normalization
-        norm = plt.Normalize(vmin=vmin, vmax=vmax)
-
-        # Figure title
-        plt.title(title)
-    
-        # Loop over tiles
-        for itile in range(0, 6):
-            # Loop over polygons
-            for iy in range(0, ny):
-                for ix in range(0, nx):
-                    # Polygon coordinates
-                    xy = [[vlons[itile,iy+0,ix+0], vlats[itile,iy+0,ix+0]],
-                          [vlons[itile,iy+0,ix+1], vlats[itile,iy+0,ix+1]],
-                          [vlons[itile,iy+1,ix+1], vlats[itile,iy+1,ix+1]],
-                          [vlons[itile,iy+1,ix+0], vlats[itile,iy+1,ix+0]]]
-    
-                    # Add polygon
-                    ax.add_patch(mpatches.Polygon(xy=xy, closed=True, facecolor=cmap(norm(fld[itile,iz,iy,ix])),transform=ccrs.Geodetic()))
-    
-        # Set colorbar
-        sm = cm.ScalarMappable(cmap=args.colormap, norm=norm)
-        sm.set_array([])
-        plt.colorbar(sm, orientation="vertical",shrink=0.8)
-    
-        # Save and close figure
-        plt.savefig(output + ".png", format="png", dpi=300)
-        plt.close()
-    
-    # Trim figure with mogrify if available
-    info = subprocess.getstatusoutput('mogrify -help')
-    if info[0] == 0:
-        if args.ferret and "Orion" in hostname:
-            subprocess.run(["mogrify", "-trim", "-format", "png", output + ".gif"])
-            os.remove(output + ".gif")
+        # Run pyferret script
+        info = subprocess.getstatusoutput('pyferret -help')
+        if info[0] == 0:
+            subprocess.run(["pyferret", "-png", "-script", "raster.jnl", ferret_file_name, str(iz+1), title, str(lonview), str(latview), colormap, str(vmin), str(vmax), output],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT)
         else:
-            subprocess.run(["mogrify", "-trim", output + ".png"])
-
-if args.ferret:
-    # Remove temporary files
-    if args.geos:
-        # TODO
-        print('not implemented yet')
-        exit()
-    elif args.gfs:
-        for itile in range(0, 6):
-            os.remove(ferret_file_name + str(itile+1) + ".nc")    
+            print(info[1])
 
 # -----------------------------------------------------------------------------
 
-# Final time
-final_time = time.perf_counter()
+def main():
+    # Initial time
+    initial_time = time.perf_counter()
+
+    # Parse arguments
+    args = parse_arguments()
+
+    # Convert levels list to array of integers
+    levels = np.array(list(map(int, args.levels.split(","))))
+
+    # Variables and base variables
+    variables = args.variable.split(",")
+    if args.basevariable is None:
+        basevariables = variables
+    else:
+        basevariables = args.basevariable.split(",")
+        if len(basevariables) != len(variables):
+            print("ERROR: basevariable should have as many values as variable")
+            sys.exit(1)
+
+    # Ferret file name
+    ferret_file_name = "ferret_tile"
+
+    # Levels to render with matplotlib
+    tasks = []
+
+    vlons = None
+    for variable, basevariable in zip(variables, basevariables):
+        # Read field
+        fld, units, long_name = read_field(args, variable, basevariable, levels)
+
+        # Get shape
+        shp = np.shape(fld)
+        nz = shp[1]
+        nx = shp[3]
+
+        # Compute min/max
+        if args.centered:
+            vmax = np.nanmax(np.abs(fld))
+            vmin = -vmax
+        else:
+            vmin = np.nanmin(fld)
+            vmax = np.nanmax(fld)
+
+        # Read grid
+        if vlons is None:
+            vlons, vlats = read_grid(nx)
+
+        # Output file path of the variable
+        if len(variables) == 1:
+            output_variable = args.output
+        else:
+            output_variable = args.output + "_" + variable
+
+        if args.ferret:
+            # Write field in NetCDF file
+            write_ferret_files(fld, units, long_name, vlons, vlats, ferret_file_name)
+
+        for iz in range(0, nz):
+            # Figure title
+            title = long_name + " (" + units + ") at level " + str(levels[iz]) + " - C" + str(nx)
+            title = title.replace("_", " ")
+
+            # Output
+            output = output_variable + "_" + str(levels[iz])
+
+            if args.ferret:
+                run_ferret(ferret_file_name, iz, title, args.colormap, vmin, vmax, output)
+
+                # Trim figure with mogrify if available
+                info = subprocess.getstatusoutput('mogrify -help')
+                if info[0] == 0:
+                    if "Orion" in hostname:
+                        subprocess.run(["mogrify", "-trim", "-format", "png", output + ".gif"])
+                        os.remove(output + ".gif")
+                    else:
+                        subprocess.run(["mogrify", "-trim", output + ".png"])
+            else:
+                tasks.append((np.ascontiguousarray(fld[:,iz,:,:]), args.colormap, vmin, vmax, title, output))
+
+        if args.ferret:
+            # Remove temporary files
+            for itile in range(0, 6):
+                os.remove(ferret_file_name + str(itile+1) + ".nc")
+
+    # Render the levels, each process sets up its figure once and reuses it for all its levels
+    if args.workers > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(args.workers, len(tasks)),
+                                                    initializer=init_plot,
+                                                    initargs=(vlons, vlats)) as executor:
+            futures = [executor.submit(plot_level, *task) for task in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                print(" - saved " + future.result() + ".png")
+    elif len(tasks) > 0:
+        init_plot(vlons, vlats)
+        for task in tasks:
+            print(" - saved " + plot_level(*task) + ".png")
+
+    # Final time
+    final_time = time.perf_counter()
+
+    # Print timing
+    print(f"raster.py executed in {final_time - initial_time:0.4f} seconds")
+
+# -----------------------------------------------------------------------------
 
-# Print timing
-print(f"raster.py executed in {final_time - initial_time:0.4f} seconds")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+import os
+import pytest
+
+from fv3jeditools.columnar_store import ColumnarStore
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of the append-only columnar store
+# --------------------------------------------------------------------------------------------------
+
+columns = {'cycle': np.int64, 'method': str, 'time': np.float64}
+
+# --------------------------------------------------------------------------------------------------
+
+def test_empty_store(tmp_path):
+
+    store = ColumnarStore(str(tmp_path/'store'), columns)
+    table = store.read()
+
+    assert store.rows() == 0
+    assert all(len(table[name]) == 0 for name in columns)
+
+    store.append({'cycle': [], 'method': [], 'time': []})
+    assert store.rows() == 0
+
+
+def test_appends_are_read_back(tmp_path):
+
+    store = ColumnarStore(str(tmp_path/'store'), columns)
+    store.append({'cycle': [1, 1], 'method': ['oops::Run', 'fv3jedi::Model'], 'time': [2.0, 0.5]})
+    store.append({'cycle': [2], 'method': ['fv3jedi::Model'], 'time': [0.75]})
+
+    # A new store on the same directory sees the same rows
+    table = ColumnarStore(str(tmp_path/'store'), columns).read()
+
+    np.testing.assert_array_equal(table['cycle'], [1, 1, 2])
+    assert list(table['method']) == ['oops::Run', 'fv3jedi::Model', 'fv3jedi::Model']
+    np.testing.assert_array_equal(table['time'], [2.0, 0.5, 0.75])
+
+    # Strings are stored once in the dictionary
+    with open(os.path.join(str(tmp_path/'store'), 'method.dict')) as fh:
+        assert fh.read().splitlines() == ['oops::Run', 'fv3jedi::Model']
+
+
+def test_interrupted_append_is_truncated(tmp_path):
+
+    store = ColumnarStore(str(tmp_path/'store'), columns)
+    store.append({'cycle': [1], 'method': ['a'], 'time': [1.0]})
+
+    # An append interrupted after writing some of the columns, the last one cut within a value
+    with open(os.path.join(str(tmp_path/'store'), 'cycle.bin'), 'ab') as fh:
+        np.array([2, 2], dtype=np.int64).tofile(fh)
+    with open(os.path.join(str(tmp_path/'store'), 'time.bin'), 'ab') as fh:
+        fh.write(b'\0\0\0')
+
+    assert store.rows() == 1
+    np.testing.assert_array_equal(store.read()['cycle'], [1])
+
+    # The next append drops the partial rows first
+    store.append({'cycle': [3], 'method': ['b'], 'time': [3.0]})
+    table = store.read()
+
+    np.testing.assert_array_equal(table['cycle'], [1, 3])
+    assert list(table['method']) == ['a', 'b']
+    np.testing.assert_array_equal(table['time'], [1.0, 3.0])
+
+
+def test_columns_of_different_lengths_abort(tmp_path):
+
+    store = ColumnarStore(str(tmp_path/'store'), columns)
+
+    with pytest.raises(SystemExit):
+        store.append({'cycle': [1, 2], 'method': ['a'], 'time': [1.0, 2.0]})
+    assert store.rows() == 0
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,129 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import netCDF4
+import numpy as np
+import pytest
+
+import fv3jeditools.cubesphere_reader as cubesphere_reader
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of the cube-sphere reader on small synthetic files in the gfs and geos layouts
+# --------------------------------------------------------------------------------------------------
+
+nx, ny, nz = 4, 3, 5
+fill_value = 1.0e15
+
+# --------------------------------------------------------------------------------------------------
+
+def field(offset=0.0):
+
+    # (6, nz, ny, nx) values, with a missing value on tile 3
+
+    values = offset + np.arange(6*nz*ny*nx, dtype=np.float32).reshape(6, nz, ny, nx)
+    values[2, 1, 0, 0] = fill_value
+
+    return values
+
+# --------------------------------------------------------------------------------------------------
+
+def write_gfs(path, values):
+
+    filepath = str(path/'fv_core.res.nc')
+    for itile in range(6):
+        with netCDF4.Dataset(cubesphere_reader.tile_file(filepath, itile), 'w') as fh:
+            for name, size in [('xaxis_1', nx), ('yaxis_1', ny), ('zaxis_1', nz), ('Time', None)]:
+                fh.createDimension(name, size)
+            var = fh.createVariable('T', 'f4', ('Time', 'zaxis_1', 'yaxis_1', 'xaxis_1'),
+                                    fill_value=fill_value)
+            var.units = 'K'
+            var[0] = values[itile]
+            fh.createVariable('ps', 'f4', ('Time', 'yaxis_1', 'xaxis_1'))[0] = values[itile, 0]
+
+    return filepath
+
+# --------------------------------------------------------------------------------------------------
+
+def write_geos(path, values):
+
+    filepath = str(path/'geos.nc4')
+    with netCDF4.Dataset(filepath, 'w') as fh:
+        for name, size in [('Xdim', nx), ('Ydim', ny), ('nf', 6), ('lev', nz), ('time', 1)]:
+            fh.createDimension(name, size)
+        var = fh.createVariable('T', 'f4', ('time', 'lev', 'nf', 'Ydim', 'Xdim'),
+                                fill_value=fill_value)
+        var.units = 'K'
+        var[0] = np.moveaxis(values, 0, 1)
+        fh.createVariable('ps', 'f4', ('time', 'nf', 'Ydim', 'Xdim'))[0] = values[:, 0]
+
+    return filepath
+
+# --------------------------------------------------------------------------------------------------
+
+def expected(values, levels):
+
+    result = values[:, [level-1 for level in levels]]
+
+    return np.where(result == fill_value, np.nan, result)
+
+# --------------------------------------------------------------------------------------------------
+
+def test_level_runs():
+
+    assert cubesphere_reader.level_runs([1, 2, 3, 7, 8, 5]) == [(0, 0, 3), (3, 6, 2), (5, 4, 1)]
+    assert cubesphere_reader.level_runs([4]) == [(0, 3, 1)]
+
+
+@pytest.mark.parametrize('write, layout', [(write_gfs, 'gfs'), (write_geos, 'geos')])
+def test_read_field_matches_file(tmp_path, write, layout):
+
+    values = field()
+    filepath = write(tmp_path, values)
+    assert cubesphere_reader.file_layout(filepath, 'T') == layout
+
+    for levels in [[1, 2, 3, 4, 5], [2], [5, 1, 2, 4]]:
+        out, units, long_name = cubesphere_reader.read_field(filepath, 'T', levels)
+        assert out.dtype == np.float32 and units == 'K' and long_name == 'T'
+        np.testing.assert_array_equal(out, expected(values, levels))
+
+    assert cubesphere_reader.field_levels(filepath, 'T') == nz
+    assert cubesphere_reader.field_levels(filepath, 'ps') == 0
+
+
+@pytest.mark.parametrize('write', [write_gfs, write_geos])
+def test_read_field_without_levels(tmp_path, write):
+
+    values = field()
+    filepath = write(tmp_path, values)
+
+    out, units, long_name = cubesphere_reader.read_field(filepath, 'ps', [3, 4])
+    np.testing.assert_array_equal(out, expected(values, [1]))
+
+
+def test_read_field_minus_base(tmp_path):
+
+    values = field()
+    filepath = write_gfs(tmp_path, values)
+    (tmp_path/'base').mkdir()
+    base_values = field(offset=0.5)
+    base_filepath = write_gfs(tmp_path/'base', base_values)
+
+    out, units, long_name = cubesphere_reader.read_field(filepath, 'T', [2, 3],
+                                                         base_filepath=base_filepath)
+    np.testing.assert_array_equal(out, expected(values, [2, 3]) - expected(base_values, [2, 3]))
+
+
+def test_read_field_levels_out_of_range(tmp_path):
+
+    filepath = write_gfs(tmp_path, field())
+
+    with pytest.raises(SystemExit):
+        cubesphere_reader.read_field(filepath, 'T', [0, 1])
+    with pytest.raises(SystemExit):
+        cubesphere_reader.read_field(filepath, 'T', [nz+1])
+    with pytest.raises(SystemExit):
+        cubesphere_reader.read_field(filepath, 'U', [1])
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,66 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+import pytest
+
+import fv3jeditools.log_parser as log_parser
+from fv3jeditools.diag_da_block_convergence import DaBlockConvergenceConsumer
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of the block minimizer statistics parsed from synthetic logs
+# --------------------------------------------------------------------------------------------------
+
+def block_log(members, iterations, equals):
+
+    # Log of a block minimization, values of member m at iteration i are m + i/10
+
+    lines = ["Some setup line\n", "  Minimizer algorithm=DRPBlockLanczos\n"]
+    for iteration in range(iterations):
+        for label, offset in [("Norm reduction all members", 0.0),
+                              ("Quadratic cost function all members: J", 100.0)]:
+            values = [offset + member + iteration/10 for member in range(members)]
+            if equals:
+                text = " ("+str(iteration+1)+") = "+", ".join(str(value) for value in values)
+            else:
+                text = " "+" ".join(str(value) for value in values)
+            lines.append("   "+label+text+"\n")
+
+    return lines
+
+# --------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('equals', [True, False])
+def test_member_values(equals):
+
+    # With or without an equals sign, the first value keeps all its digits
+
+    members, iterations = 80, 12
+    consumer = DaBlockConvergenceConsumer()
+    log_parser.parse_lines(block_log(members, iterations, equals), [consumer])
+
+    expected = np.arange(members)[:, np.newaxis] + np.arange(iterations)[np.newaxis, :]/10
+    assert consumer.minimizer == 'DRPBlockLanczos'
+    np.testing.assert_allclose(consumer.values('norm'), expected)
+    np.testing.assert_allclose(consumer.values('cost'), 100.0 + expected)
+
+
+def test_statistics_before_the_minimizer_are_ignored():
+
+    lines = ["   Norm reduction all members 5.0 6.0\n"] + block_log(2, 1, False)
+    consumer = DaBlockConvergenceConsumer()
+    log_parser.parse_lines(lines, [consumer])
+
+    np.testing.assert_allclose(consumer.values('norm'), [[0.0], [1.0]])
+
+
+def test_no_statistics():
+
+    consumer = DaBlockConvergenceConsumer()
+    log_parser.parse_lines(block_log(3, 0, False), [consumer])
+
+    assert consumer.values('norm').shape == (0, 0)
+
+# --------------------------------------------------------------------------------------------------
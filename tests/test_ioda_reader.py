@@ -0,0 +1,125 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import netCDF4
+import numpy as np
+import pytest
+
+import fv3jeditools.ioda_reader as ioda_reader
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of the IODA reader and its array cache on small synthetic files
+# --------------------------------------------------------------------------------------------------
+
+nlocs = 1000
+megabyte = 1024*1024
+
+# --------------------------------------------------------------------------------------------------
+
+def ioda_file(path, offset=0.0):
+
+    # IODA-like file with ObsValue and hofx groups of float64 variables (8000 bytes each)
+
+    with netCDF4.Dataset(str(path), 'w') as fh:
+        fh.createDimension('nlocs', nlocs)
+        for group, shift in [('ObsValue', 1.0), ('hofx', 0.0)]:
+            variables = fh.createGroup(group)
+            for variable in ['air_temperature', 'specific_humidity']:
+                values = offset + shift + np.arange(nlocs, dtype=np.float64)
+                variables.createVariable(variable, 'f8', ('nlocs',))[:] = values
+
+    return str(path)
+
+# --------------------------------------------------------------------------------------------------
+
+def test_array_cache_evicts_least_recently_used():
+
+    cache = ioda_reader.ArrayCache(max_memory_mb=2.5*80/megabyte)
+    arrays = {key: np.zeros(10) for key in 'abc'}
+
+    cache.insert('a', arrays['a'])
+    cache.insert('b', arrays['b'])
+    assert cache.get('a') is arrays['a']
+
+    # b is now the least recently used
+    cache.insert('c', arrays['c'])
+    assert cache.get('b') is None
+    assert cache.get('a') is arrays['a'] and cache.get('c') is arrays['c']
+    assert cache.memory == 160 and cache.evictions == 1
+
+    # Arrays larger than the cap are not cached
+    cache.insert('d', np.zeros(100))
+    assert cache.get('d') is None and cache.memory == 160
+
+    # Lowering the cap evicts what no longer fits
+    cache.limit(80/megabyte)
+    assert cache.memory == 80 and cache.get('c') is arrays['c']
+
+
+def test_reader_caches_and_derives_groups(tmp_path):
+
+    reader = ioda_reader.open_ioda(ioda_file(tmp_path/'obs.nc4'))
+
+    omb = reader.read('omb', 'air_temperature')
+    np.testing.assert_array_equal(omb, np.ones(nlocs))
+    assert reader.read('ObsValue', 'air_temperature') is reader.read('ObsValue', 'air_temperature')
+    assert reader.statistics()['misses'] == 3 and reader.statistics()['hits'] == 2
+
+    reader.close()
+
+
+def test_cached_arrays_are_read_only(tmp_path):
+
+    # The cached arrays are handed to every application asking for them, none can change them
+
+    reader = ioda_reader.open_ioda(ioda_file(tmp_path/'obs.nc4'))
+
+    for group in ['ObsValue', 'omb']:
+        data = reader.read(group, 'air_temperature')
+        with pytest.raises(ValueError):
+            data[0] = -1.0
+        mask = np.ma.getmask(data)
+        if mask is not np.ma.nomask:
+            with pytest.raises(ValueError):
+                mask[0] = True
+
+    # Copies can be changed
+    data = np.array(reader.read('ObsValue', 'air_temperature'))
+    data[0] = -1.0
+    assert reader.read('ObsValue', 'air_temperature')[0] == 1.0
+
+    reader.close()
+
+
+def test_shared_readers_hold_one_cap_together(tmp_path):
+
+    # Three arrays fit in the cap of the sharing block, whatever the file they come from
+
+    files = [ioda_file(tmp_path/('obs'+str(n)+'.nc4'), offset=n) for n in range(3)]
+
+    with ioda_reader.sharing(max_memory_mb=3*8*nlocs/megabyte):
+
+        readers = [ioda_reader.open_ioda(filename) for filename in files]
+        assert ioda_reader.open_ioda(files[0]) is readers[0]
+
+        for reader in readers:
+            for group in ['ObsValue', 'hofx']:
+                reader.read(group, 'air_temperature')
+
+        cache = readers[0].cache
+        assert all(reader.cache is cache for reader in readers)
+        assert cache.memory == 3*8*nlocs and cache.evictions == 3
+
+        # The most recent arrays are those of the last file
+        assert readers[2].read('hofx', 'air_temperature')[0] == 2.0
+        assert readers[2].statistics()['hits'] == 1
+
+        # A smaller cap asked for by an application applies to all the readers
+        ioda_reader.open_ioda(files[1], max_memory_mb=8*nlocs/megabyte)
+        assert cache.memory == 8*nlocs
+
+    assert ioda_reader._shared_readers is None and cache.memory == 0
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,385 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import bz2
+import concurrent.futures
+import gzip
+import json
+import lzma
+import numpy as np
+import os
+import pytest
+
+import fv3jeditools.log_parser as log_parser
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of log_parser on small synthetic logs
+# --------------------------------------------------------------------------------------------------
+
+log_lines = [
+  "OOPS starting\n",
+  " cost function J = 10.0\n",
+  "   gradient norm 1.0\n",
+  " unrelated line\n",
+  " cost function J = 5.0 (outer loop 2)\n",
+  "   gradient norm 0.5\n",
+  " timing OOPS_STATS something\n",
+  " cost function J = 2.5\n"
+]
+
+# --------------------------------------------------------------------------------------------------
+
+class RecordingConsumer(log_parser.LogConsumer):
+
+    # Records every line passed to it with its lookahead lines
+
+    def __init__(self, triggers, lookahead=0):
+
+        self.triggers = triggers
+        self.lookahead = lookahead
+        self.records = []
+        self.finished = False
+
+    def consume(self, line, following):
+
+        self.records.append((line, list(following)))
+
+    def finish(self):
+
+        self.finished = True
+
+# --------------------------------------------------------------------------------------------------
+
+def expected_records(lines, triggers, lookahead):
+
+    # What a consumer should be given, computed the obvious way
+
+    return [(line, lines[n+1:n+1+lookahead]) for n, line in enumerate(lines)
+            if any(trigger in line for trigger in triggers)]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_parse_lines_dispatches_triggers_with_lookahead():
+
+    cost = RecordingConsumer(["cost function"], lookahead=1)
+    stats = RecordingConsumer(["OOPS_STATS", "OOPS starting"])
+
+    log_parser.parse_lines(log_lines, [cost, stats])
+
+    assert cost.records == expected_records(log_lines, ["cost function"], 1)
+    assert stats.records == expected_records(log_lines, ["OOPS_STATS", "OOPS starting"], 0)
+    assert cost.finished and stats.finished
+
+
+def test_parse_lines_short_lookahead_at_end_of_log():
+
+    # The last trigger only has the lines that are left after it
+
+    consumer = RecordingConsumer(["cost function"], lookahead=3)
+    log_parser.parse_lines(log_lines, [consumer])
+
+    assert consumer.records[-1] == (log_lines[-1], [])
+    assert consumer.records[-2] == (log_lines[4], log_lines[5:8])
+
+
+def test_parse_lines_empty_log_and_no_triggers():
+
+    consumer = RecordingConsumer(["cost function"], lookahead=2)
+    log_parser.parse_lines([], [consumer])
+    assert consumer.records == [] and consumer.finished
+
+    silent = RecordingConsumer([])
+    log_parser.parse_lines(log_lines, [silent])
+    assert silent.records == [] and silent.finished
+
+
+def test_feed_in_pieces_matches_single_pass():
+
+    # Lines fed in several goes give the same result as all at once
+
+    whole = RecordingConsumer(["cost function", "gradient"], lookahead=2)
+    log_parser.parse_lines(log_lines, [whole])
+
+    pieces = RecordingConsumer(["cost function", "gradient"], lookahead=2)
+    parser = log_parser.LogParser([pieces])
+    for start in range(0, len(log_lines), 3):
+        parser.feed(log_lines[start:start+3])
+    parser.finish()
+
+    assert pieces.records == whole.records
+
+# --------------------------------------------------------------------------------------------------
+
+def write_log(path, lines, mode='w'):
+
+    with open(path, mode) as fh:
+        fh.write(''.join(lines))
+
+    return str(path)
+
+# --------------------------------------------------------------------------------------------------
+
+def follow(log_file, consumer, checkpoint_file=None):
+
+    # Follow a log that is not growing, a single poll parses it all
+
+    return log_parser.follow_log(log_file, [consumer], checkpoint_file, poll_interval=0,
+                                 idle_timeout=0)[0]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_follow_log_matches_single_pass(tmp_path):
+
+    # A log without an end of line on its last line, which is parsed at the end
+
+    log_file = write_log(tmp_path/'run.log', log_lines[:-1] + [log_lines[-1].rstrip()])
+    consumer = follow(log_file, RecordingConsumer(["cost function"], lookahead=1))
+
+    expected = expected_records(log_lines[:-1] + [log_lines[-1].rstrip()], ["cost function"], 1)
+    assert consumer.records == expected
+
+
+def test_follow_log_resumes_from_checkpoint(tmp_path, capsys):
+
+    # A follower stopped after the first part of the log resumes from its checkpoint and ends up
+    # with the same records as a single pass over the whole log
+
+    log_file = write_log(tmp_path/'run.log', log_lines[:5])
+    checkpoint_file = str(tmp_path/'run.json')
+    follow(log_file, RecordingConsumer(["cost function"], lookahead=1), checkpoint_file)
+    assert os.path.exists(checkpoint_file)
+
+    write_log(log_file, log_lines[5:], mode='a')
+    capsys.readouterr()
+    resumed = follow(log_file, RecordingConsumer(["cost function"], lookahead=1), checkpoint_file)
+    assert 'resuming' in capsys.readouterr().out
+
+    expected = expected_records(log_lines, ["cost function"], 1)
+    assert [tuple(record) for record in resumed.records] == expected
+
+
+def test_follow_log_ignores_truncated_or_foreign_checkpoint(tmp_path):
+
+    log_file = write_log(tmp_path/'run.log', log_lines)
+    expected = expected_records(log_lines, ["cost function"], 0)
+
+    # Checkpoint cut short while being written
+    truncated = tmp_path/'truncated.json'
+    truncated.write_text('{"log file": "'+log_file)
+    consumer = follow(log_file, RecordingConsumer(["cost function"]), str(truncated))
+    assert consumer.records == expected
+
+    # Checkpoint of another log
+    foreign = tmp_path/'foreign.json'
+    foreign.write_text(json.dumps({'log file': str(tmp_path/'other.log'), 'inode': 0,
+                                   'offset': 10, 'consumers': [{}]}))
+    consumer = follow(log_file, RecordingConsumer(["cost function"]), str(foreign))
+    assert consumer.records == expected
+
+# --------------------------------------------------------------------------------------------------
+
+class CostConsumer(log_parser.LogConsumer):
+
+    # Cost function values, cacheable. Lines consumed by all instances are counted to tell parsed
+    # logs from cached ones.
+
+    triggers = ["cost function J ="]
+    consumed = 0
+
+    def __init__(self, scale=1.0):
+
+        self.scale = scale
+        self.costs = []
+
+    def consume(self, line, following):
+
+        CostConsumer.consumed = CostConsumer.consumed + 1
+        self.costs.append(self.scale*float(line.split('=')[1].split()[0]))
+
+    def configuration(self):
+
+        return dict(super().configuration(), scale=self.scale)
+
+    def to_arrays(self):
+
+        return {'costs': np.array(self.costs)}
+
+    def from_arrays(self, arrays):
+
+        self.costs = list(arrays['costs'])
+
+# --------------------------------------------------------------------------------------------------
+
+def parse_cached(log_file, cache_path, scale=1.0):
+
+    # Costs of a log through the cache and the number of lines parsed to get them
+
+    consumed = CostConsumer.consumed
+    consumer = log_parser.parse_log_cached(log_file, [CostConsumer(scale)], cache_path)[0]
+
+    return consumer.costs, CostConsumer.consumed - consumed
+
+# --------------------------------------------------------------------------------------------------
+
+def entries(cache_path):
+
+    return sorted(entry for entry in os.listdir(cache_path) if entry.endswith('.npz'))
+
+# --------------------------------------------------------------------------------------------------
+
+def test_cache_returns_parsed_results_without_parsing(tmp_path):
+
+    log_file = write_log(tmp_path/'run.log', log_lines)
+    cache_path = str(tmp_path/'cache')
+
+    costs, parsed = parse_cached(log_file, cache_path)
+    assert costs == [10.0, 5.0, 2.5] and parsed == 3
+
+    costs, parsed = parse_cached(log_file, cache_path)
+    assert costs == [10.0, 5.0, 2.5] and parsed == 0
+
+
+def test_cache_keeps_configurations_apart(tmp_path):
+
+    log_file = write_log(tmp_path/'run.log', log_lines)
+    cache_path = str(tmp_path/'cache')
+
+    parse_cached(log_file, cache_path)
+    costs, parsed = parse_cached(log_file, cache_path, scale=2.0)
+    assert costs == [20.0, 10.0, 5.0] and parsed == 3
+    assert len(entries(cache_path)) == 2
+
+    costs, parsed = parse_cached(log_file, cache_path)
+    assert costs == [10.0, 5.0, 2.5] and parsed == 0
+
+
+def test_cache_reparses_changed_log_and_evicts_stale_entries(tmp_path):
+
+    log_file = write_log(tmp_path/'run.log', log_lines)
+    other_log = write_log(tmp_path/'other.log', log_lines)
+    cache_path = str(tmp_path/'cache')
+
+    parse_cached(log_file, cache_path)
+    parse_cached(other_log, cache_path)
+    assert len(entries(cache_path)) == 2
+
+    # A changed log is parsed again, its entry replaced
+    write_log(log_file, [" cost function J = 1.0\n"], mode='a')
+    costs, parsed = parse_cached(log_file, cache_path)
+    assert costs == [10.0, 5.0, 2.5, 1.0] and parsed == 4
+    assert len(entries(cache_path)) == 2
+
+    # The entry of a log that is gone is removed when the cache is next written
+    os.remove(other_log)
+    write_log(log_file, [" cost function J = 0.5\n"], mode='a')
+    parse_cached(log_file, cache_path)
+    assert len(entries(cache_path)) == 1
+
+
+def _parse_in_process(log_file, cache_path):
+
+    return parse_cached(log_file, cache_path)[0]
+
+
+def test_cache_concurrent_writers(tmp_path):
+
+    # Processes storing the same entry at the same time never leave a partial entry
+
+    log_file = write_log(tmp_path/'run.log', log_lines*2000)
+    cache_path = str(tmp_path/'cache')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_parse_in_process, [log_file]*8, [cache_path]*8))
+
+    assert all(costs == [10.0, 5.0, 2.5]*2000 for costs in results)
+    assert sorted(os.listdir(cache_path)) == sorted(['index.json'] + entries(cache_path))
+    assert len(entries(cache_path)) == 1
+
+    costs, parsed = parse_cached(log_file, cache_path)
+    assert costs == [10.0, 5.0, 2.5]*2000 and parsed == 0
+
+
+def test_configured_parse_only_caches_when_asked(tmp_path):
+
+    log_file = write_log(tmp_path/'run.log', log_lines)
+    cache_path = str(tmp_path/'cache')
+
+    consumer = log_parser.parse_log_configured(log_file, [CostConsumer()],
+                                               {'log cache path': cache_path})[0]
+    assert consumer.costs == [10.0, 5.0, 2.5]
+    assert not os.path.exists(cache_path)
+
+    log_parser.parse_log_configured(log_file, [CostConsumer()],
+                                    {'log cache': True, 'log cache path': cache_path})
+    assert len(entries(cache_path)) == 1
+
+# --------------------------------------------------------------------------------------------------
+
+def test_mapped_scan_matches_line_scan(tmp_path):
+
+    # Several triggers on one line, triggers inside lookahead lines, a last line without an end of
+    # line and non-ASCII bytes give the same records from the memory-mapped scan
+
+    lines = log_lines + [" gradient norm and cost function J = 1.0 \u00e9\n", " cost function J"]
+    log_file = write_log(tmp_path/'run.log', lines)
+
+    for lookahead in [0, 1, 3]:
+        mapped = RecordingConsumer(["cost function", "gradient"], lookahead)
+        log_parser.parse_log(log_file, [mapped], mapped=True)
+        scanned = RecordingConsumer(["cost function", "gradient"], lookahead)
+        log_parser.parse_log(log_file, [scanned], mapped=False)
+
+        assert mapped.records == scanned.records
+        assert mapped.records == expected_records(lines, ["cost function", "gradient"], lookahead)
+
+
+def test_mapped_scan_empty_log(tmp_path):
+
+    log_file = write_log(tmp_path/'empty.log', [])
+    consumer = RecordingConsumer(["cost function"], lookahead=1)
+    log_parser.parse_mapped(log_file, [consumer])
+
+    assert consumer.records == [] and consumer.finished
+
+# --------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('compression, opener', [('gzip', gzip.open), ('bzip2', bz2.open),
+                                                 ('xz', lzma.open)])
+def test_compressed_logs_match_plain_log(tmp_path, compression, opener):
+
+    log_file = str(tmp_path/'run.log.compressed')
+    with opener(log_file, 'wt') as fh:
+        fh.write(''.join(log_lines))
+    assert log_parser.log_compression(log_file) == compression
+
+    consumer = RecordingConsumer(["cost function"], lookahead=2)
+    log_parser.parse_log(log_file, [consumer])
+
+    assert consumer.records == expected_records(log_lines, ["cost function"], 2)
+
+
+def test_zstd_log_matches_plain_log(tmp_path):
+
+    # zstd logs need the optional zstandard package
+
+    zstandard = pytest.importorskip('zstandard')
+
+    log_file = str(tmp_path/'run.log.zst')
+    with zstandard.open(log_file, 'wt') as fh:
+        fh.write(''.join(log_lines))
+    assert log_parser.log_compression(log_file) == 'zstd'
+
+    consumer = RecordingConsumer(["cost function"], lookahead=2)
+    log_parser.parse_log(log_file, [consumer])
+
+    assert consumer.records == expected_records(log_lines, ["cost function"], 2)
+
+
+def test_plain_and_empty_logs_are_not_compressed(tmp_path):
+
+    assert log_parser.log_compression(write_log(tmp_path/'run.log', log_lines)) is None
+    assert log_parser.log_compression(write_log(tmp_path/'empty.log', [])) is None
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,148 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+import pytest
+
+import fv3jeditools.running_statistics as running_statistics
+
+# --------------------------------------------------------------------------------------------------
+#  Tests of the running statistics against numpy on the complete data
+# --------------------------------------------------------------------------------------------------
+
+def chunks(data, sizes):
+
+    # Split data along its first dimension into chunks of the given sizes
+
+    return np.split(data, np.cumsum(sizes)[:-1])
+
+# --------------------------------------------------------------------------------------------------
+
+def test_update_in_chunks_matches_numpy():
+
+    rng = np.random.default_rng(1)
+    data = 1.0e4 + rng.standard_normal((1000, 3, 4))
+
+    statistics = running_statistics.RunningStatistics((3, 4))
+    for chunk in chunks(data, [1, 10, 489, 500]):
+        statistics.update(chunk)
+
+    assert np.all(statistics.count == 1000)
+    np.testing.assert_allclose(statistics.mean, np.mean(data, axis=0), rtol=1.0e-12)
+    np.testing.assert_allclose(statistics.variance(ddof=1), np.var(data, axis=0, ddof=1),
+                               rtol=1.0e-9)
+    np.testing.assert_array_equal(statistics.minimum, np.min(data, axis=0))
+    np.testing.assert_array_equal(statistics.maximum, np.max(data, axis=0))
+
+
+def test_merge_matches_single_accumulator():
+
+    # Accumulators of different chunks, merged in any grouping, equal one accumulator of all
+
+    rng = np.random.default_rng(2)
+    data = rng.gamma(2.0, size=(600, 5))
+
+    single = running_statistics.RunningStatistics((5,))
+    single.update(data)
+
+    parts = []
+    for chunk in chunks(data, [100, 250, 250]):
+        part = running_statistics.RunningStatistics((5,))
+        part.update(chunk)
+        parts.append(part)
+    merged = running_statistics.RunningStatistics((5,))
+    merged.merge(parts[2])
+    parts[0].merge(parts[1])
+    merged.merge(parts[0])
+
+    np.testing.assert_array_equal(merged.count, single.count)
+    np.testing.assert_allclose(merged.mean, single.mean, rtol=1.0e-12)
+    np.testing.assert_allclose(merged.m2, single.m2, rtol=1.0e-10)
+    np.testing.assert_array_equal(merged.minimum, single.minimum)
+    np.testing.assert_array_equal(merged.maximum, single.maximum)
+
+
+def test_skewness_merge_matches_numpy():
+
+    rng = np.random.default_rng(3)
+    data = rng.gamma(2.0, size=(900, 2))
+
+    merged = running_statistics.RunningStatistics((2,), skewness=True)
+    for chunk in chunks(data, [1, 299, 600]):
+        part = running_statistics.RunningStatistics((2,), skewness=True)
+        part.update(chunk)
+        merged.merge(part)
+
+    deviations = data - np.mean(data, axis=0)
+    expected = np.sqrt(len(data))*np.sum(deviations**3, axis=0)/np.sum(deviations**2, axis=0)**1.5
+    np.testing.assert_allclose(merged.skewness(), expected, rtol=1.0e-10)
+
+    # An accumulator without skewness cannot be merged into one with skewness
+    with pytest.raises(SystemExit):
+        merged.merge(running_statistics.RunningStatistics((2,)))
+
+
+def test_missing_values_are_ignored():
+
+    data = np.array([[1.0, np.nan], [3.0, np.nan], [np.nan, np.nan]])
+
+    statistics = running_statistics.RunningStatistics((2,))
+    statistics.update(data[:1])
+    statistics.update(data[1:])
+
+    np.testing.assert_array_equal(statistics.count, [2, 0])
+    np.testing.assert_array_equal(statistics.mean, [2.0, 0.0])
+    assert statistics.variance()[0] == 1.0
+    assert np.isnan(statistics.variance()[1])
+    assert statistics.minimum[1] == np.inf and statistics.maximum[1] == -np.inf
+
+
+def test_empty_accumulators():
+
+    # Merging or updating with nothing leaves the statistics unchanged
+
+    statistics = running_statistics.RunningStatistics()
+    statistics.update(np.zeros(0))
+    statistics.merge(running_statistics.RunningStatistics())
+
+    assert statistics.count == 0 and statistics.mean == 0.0
+    assert np.isnan(statistics.variance(ddof=1))
+
+    statistics.update(np.array([4.0, 6.0]))
+    statistics.merge(running_statistics.RunningStatistics())
+    assert statistics.count == 2 and statistics.mean == 5.0 and statistics.variance() == 1.0
+
+# --------------------------------------------------------------------------------------------------
+
+def test_histogram_merge_and_range():
+
+    edges = np.linspace(0.0, 1.0, 11)
+    data = np.array([0.05, 0.15, 0.15, 0.95, 1.5, -0.5, np.nan])
+
+    first = running_statistics.Histogram(edges)
+    first.update(data[:3])
+    second = running_statistics.Histogram(edges)
+    second.update(data[3:])
+    first.merge(second)
+
+    expected, _ = np.histogram(data[~np.isnan(data)], bins=edges)
+    np.testing.assert_array_equal(first.counts, expected)
+
+    with pytest.raises(SystemExit):
+        first.merge(running_statistics.Histogram(np.linspace(0.0, 2.0, 11)))
+
+
+@pytest.mark.parametrize('minimum, maximum', [(np.inf, -np.inf), (np.nan, np.nan), (2.0, 2.0),
+                                              (-np.inf, 1.0)])
+def test_histogram_edges_are_finite(minimum, maximum):
+
+    # Statistics without data, or with a single value, still give increasing finite edges
+
+    edges = running_statistics.histogram_edges(minimum, maximum, 10)
+
+    assert len(edges) == 11
+    assert np.all(np.isfinite(edges)) and np.all(np.diff(edges) > 0)
+
+# --------------------------------------------------------------------------------------------------